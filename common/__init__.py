@@ -0,0 +1,2 @@
+# Code shared by the services. Each image copies this
+# package next to the service's own modules (see the Dockerfiles).
@@ -0,0 +1,80 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+from common.http_client import get_http_client
+
+# --- Settings ---
+# Readiness is computed by a background loop and cached, so orchestrator
+# probes never touch the database themselves no matter how often they poll.
+HEALTH_PROBE_INTERVAL_SECONDS = float(os.getenv("HEALTH_PROBE_INTERVAL_SECONDS", "5"))
+HEALTH_PROBE_TIMEOUT_SECONDS = float(os.getenv("HEALTH_PROBE_TIMEOUT_SECONDS", "2"))
+
+# Only these checks decide readiness; the others are reported for information.
+REQUIRED_CHECKS = {"database"}
+
+# Each service passes its own database check and the other services it
+# reports on to start_health_probes().
+_check_database: Callable[[], Awaitable[dict]] | None = None
+_services: dict[str, str] = {}
+
+_status: dict = {"ready": False, "checked_at": None, "checks": {}}
+_probe_task: asyncio.Task | None = None
+
+
+async def _check_service(url: str) -> dict:
+    response = await get_http_client().get(url, timeout=HEALTH_PROBE_TIMEOUT_SECONDS)
+    return {"ok": response.status_code == 200, "status_code": response.status_code}
+
+
+async def _run_check(check) -> dict:
+    try:
+        return await asyncio.wait_for(check, timeout=HEALTH_PROBE_TIMEOUT_SECONDS)
+    except Exception as e:
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+async def run_probes():
+    global _status
+    checks = {"database": await _run_check(_check_database())}
+    for name, url in _services.items():
+        checks[name] = await _run_check(_check_service(url))
+    _status = {
+        "ready": all(checks[name]["ok"] for name in REQUIRED_CHECKS),
+        "checked_at": datetime.now(timezone.utc).isoformat(),
+        "checks": checks,
+    }
+
+
+async def _probe_loop():
+    while True:
+        await run_probes()
+        await asyncio.sleep(HEALTH_PROBE_INTERVAL_SECONDS)
+
+
+def start_health_probes(check_database: Callable[[], Awaitable[dict]], services: dict[str, str]):
+    """
+    `check_database` returns {"ok": True, ...} or raises; `services` maps a
+    name to the liveness URL of another service.
+    """
+    global _check_database, _services, _probe_task
+    _check_database = check_database
+    _services = dict(services)
+    if _probe_task is None:
+        _probe_task = asyncio.create_task(_probe_loop())
+
+
+async def stop_health_probes():
+    global _probe_task
+    if _probe_task is not None:
+        _probe_task.cancel()
+        try:
+            await _probe_task
+        except asyncio.CancelledError:
+            pass
+        _probe_task = None
+
+
+def get_health_status() -> dict:
+    return _status
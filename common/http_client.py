@@ -0,0 +1,44 @@
+import os
+import httpx
+
+# --- Settings ---
+# One AsyncClient per process, created at startup and closed at shutdown.
+# Reusing it keeps TCP (and TLS) connections to the other services alive
+# between requests instead of opening a new pool for every call.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "2"))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "5"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+
+client: httpx.AsyncClient = None
+
+def start_http_client():
+    global client
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(
+                HTTP_READ_TIMEOUT_SECONDS,
+                connect=HTTP_CONNECT_TIMEOUT_SECONDS,
+            ),
+        )
+
+async def close_http_client():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    The Dependency routes use for inter-service calls.
+    """
+    start_http_client()
+    return client
@@ -0,0 +1,75 @@
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import IndexModel
+
+# Each service declares, in its own indexes.py:
+#   INDEXES      = {collection: [IndexModel, ...]}
+#   QUERY_SHAPES = {name: (collection, filter, sort or None)}, the queries it
+#                  serves, whose winning plans must use an index.
+# The helpers below create the former and explain the latter;
+# common/tests/test_indexes.py asserts on the plans of every service.
+
+QueryShape = tuple[str, dict, Optional[list[tuple[str, int]]]]
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase, indexes: dict[str, list[IndexModel]]):
+    """
+    Creates every declared index (idempotent: create_indexes() is a no-op for
+    indexes that already exist with the same spec). Called at startup.
+    """
+    for collection, models in indexes.items():
+        names = await db[collection].create_indexes(models)
+        print(f"Indexes ensured on '{collection}': {', '.join(names)}")
+
+
+def plan_stages(plan) -> list[str]:
+    """
+    Walks an explain() plan tree and collects every "stage" name.
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+async def explain_query_shapes(db: AsyncIOMotorDatabase, shapes: dict[str, QueryShape]) -> dict[str, list[str]]:
+    """
+    Returns the winning-plan stages of every query shape.
+    """
+    plans = {}
+    for name, (collection, query, sort) in shapes.items():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        plans[name] = plan_stages(explain["queryPlanner"]["winningPlan"])
+    return plans
+
+
+async def explain_on_scratch_database(
+    mongo_uri: str,
+    indexes: dict[str, list[IndexModel]],
+    shapes: dict[str, QueryShape],
+) -> dict[str, list[str]]:
+    """
+    Creates the indexes in a throwaway database, explains every query shape
+    there and drops the database again. Used by the services' tests.
+    """
+    from uuid import uuid4
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(mongo_uri)
+    db = client[f"plan_check_{uuid4().hex[:12]}"]
+    try:
+        await ensure_indexes(db, indexes)
+        return await explain_query_shapes(db, shapes)
+    finally:
+        await client.drop_database(db.name)
+        client.close()
@@ -0,0 +1,67 @@
+import os
+import time
+from typing import Iterable, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+# --- Settings ---
+# Claims older than this are ignored and the usual remote/DB check runs.
+# Staleness is decided by the membership version below, so by default claims
+# are used for the whole life of the access token (60 minutes, user_service).
+TEAM_CLAIMS_MAX_AGE_SECONDS = float(os.getenv("TEAM_CLAIMS_MAX_AGE_SECONDS", "3600"))
+# Users in more teams than this get only the version stamp, no team lists
+TEAM_CLAIMS_MAX_TEAMS = int(os.getenv("TEAM_CLAIMS_MAX_TEAMS", "50"))
+
+# Access tokens may carry {"teams": {"v": <version>, "l": [led team ids], "m": [other team ids]}}
+# (user_service asks GET /teams/internal/memberships/{username} at login/refresh).
+# `v` is the user's membership version: a millisecond stamp kept in the
+# shared membership_versions collection, raised in the same transaction as
+# every membership or leadership change of that user (team deletion
+# included). A claim is only trusted while the stored version is not newer
+# than its `v`, which every replica of every service sees the same way.
+MEMBERSHIP_VERSIONS = "membership_versions" # {"_id": username, "v": int}
+
+
+def version_stamp() -> int:
+    return int(time.time() * 1000)
+
+
+async def bump_membership_versions(
+    db: AsyncIOMotorDatabase,
+    usernames: Iterable[str],
+    session: Optional[AsyncIOMotorClientSession] = None,
+):
+    """
+    Raises the membership version of these users (their claims become stale).
+    """
+    usernames = list(dict.fromkeys(usernames))
+    if not usernames:
+        return
+    stamp = version_stamp()
+    await db[MEMBERSHIP_VERSIONS].bulk_write(
+        [UpdateOne({"_id": username}, {"$max": {"v": stamp}}, upsert=True) for username in usernames],
+        ordered=False,
+        session=session,
+    )
+
+
+async def claims_role(db: AsyncIOMotorDatabase, current_user, team_id: str) -> Optional[str]:
+    """
+    "leader" or "member" according to the user's token (a TokenData of
+    either service), or None when the claims are missing, too old or stale,
+    or don't mention the team. Claims only ever grant access; a None means
+    "do the usual check". Costs one _id lookup when the token has claims.
+    """
+    claims = current_user.teams
+    if not claims or current_user.issued_at is None:
+        return None
+    if time.time() - current_user.issued_at > TEAM_CLAIMS_MAX_AGE_SECONDS:
+        return None
+    if team_id not in claims.get("l", ()) and team_id not in claims.get("m", ()):
+        return None
+
+    version_doc = await db[MEMBERSHIP_VERSIONS].find_one({"_id": current_user.username})
+    if version_doc is not None and version_doc["v"] > claims.get("v", 0):
+        return None # changed since the token was issued (or the team was deleted)
+    return "leader" if team_id in claims.get("l", ()) else "member"
@@ -0,0 +1,25 @@
+import importlib
+import os
+import sys
+
+# The shared package is imported as `common`, from the repository root.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_ROOT)
+
+
+def load_service_module(service: str, name: str):
+    """
+    Imports one module of a service the way uvicorn does (its modules import
+    each other by plain name), then forgets the service's modules again so
+    another service's same-named ones (schemas, db, ...) can be loaded next.
+    """
+    service_dir = os.path.join(REPO_ROOT, service)
+    before = set(sys.modules)
+    sys.path.insert(0, service_dir)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.remove(service_dir)
+        for module_name in set(sys.modules) - before:
+            if (getattr(sys.modules[module_name], "__file__", None) or "").startswith(service_dir + os.sep):
+                del sys.modules[module_name]
@@ -0,0 +1,47 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("motor")
+from common.team_claims import MEMBERSHIP_VERSIONS, claims_role
+
+
+class VersionsCollection:
+    # Just enough of a motor collection for claims_role's one _id lookup
+    def __init__(self, versions: dict[str, int]):
+        self.versions = versions
+
+    async def find_one(self, query: dict):
+        username = query["_id"]
+        return {"_id": username, "v": self.versions[username]} if username in self.versions else None
+
+
+def make_db(versions: dict[str, int]) -> dict:
+    return {MEMBERSHIP_VERSIONS: VersionsCollection(versions)}
+
+
+def make_user(issued_seconds_ago: float, version: int = 1000) -> SimpleNamespace:
+    return SimpleNamespace(
+        username="alice",
+        teams={"v": version, "l": ["led"], "m": ["joined"]},
+        issued_at=int(time.time() - issued_seconds_ago),
+    )
+
+
+def test_claims_of_an_old_token_are_honored_while_the_version_is_unchanged():
+    user = make_user(issued_seconds_ago=30 * 60)
+    db = make_db({"alice": 1000})
+    assert asyncio.run(claims_role(db, user, "joined")) == "member"
+    assert asyncio.run(claims_role(db, user, "led")) == "leader"
+
+
+def test_claims_are_ignored_once_the_version_moved_on():
+    user = make_user(issued_seconds_ago=5)
+    assert asyncio.run(claims_role(make_db({"alice": 1001}), user, "joined")) is None
+
+
+def test_teams_missing_from_the_claims_fall_back_to_the_usual_check():
+    user = make_user(issued_seconds_ago=5)
+    assert asyncio.run(claims_role(make_db({}), user, "other")) is None
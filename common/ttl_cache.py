@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    Bounded LRU of key -> value where every entry expires after a TTL.
+    The caches of each service build on it and only add their keys and
+    invalidation rules.
+
+    invalidate() leaves a tombstone behind: a put() given the time its read
+    started is ignored if the key was invalidated since, so a read that raced
+    with a write can't bring the old value back.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (stored_at, expires_at, value); a None value is a tombstone
+        self._entries: OrderedDict[K, tuple[float, float, V | None]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[2] is None:
+            self.misses += 1
+            return None
+        if time.monotonic() > entry[1]:
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def peek(self, key: K) -> V | None:
+        # The stored value, expired or not, without touching the LRU order or the counters
+        entry = self._entries.get(key)
+        return None if entry is None else entry[2]
+
+    def put(self, key: K, value: V, read_started: float | None = None, ttl_seconds: float | None = None) -> bool:
+        """
+        Stores the value unless the key was invalidated after `read_started`.
+        Returns whether it was stored.
+        """
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        if ttl <= 0:
+            return False
+        current = self._entries.get(key)
+        if read_started is not None and current is not None and current[2] is None and current[0] >= read_started:
+            return False  # invalidated while we were reading
+        now = time.monotonic()
+        self._entries[key] = (now, now + ttl, value)
+        self._entries.move_to_end(key)
+        self._evict()
+        return True
+
+    def invalidate(self, key: K):
+        now = time.monotonic()
+        self._entries[key] = (now, now + self.ttl_seconds, None)
+        self._entries.move_to_end(key)
+        self.invalidations += 1
+        self._evict()
+
+    def discard(self, key: K):
+        # Removes the entry without leaving a tombstone
+        self._drop(key)
+
+    def _drop(self, key: K):
+        # Every removal goes through here (subclasses that index keys elsewhere extend it)
+        self._entries.pop(key, None)
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
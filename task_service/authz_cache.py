@@ -0,0 +1,118 @@
+import os
+from enum import StrEnum
+
+import httpx
+from fastapi import HTTPException, status
+
+from schemas import TokenData
+from db import get_database
+from common.team_claims import claims_role
+from common.ttl_cache import TTLCache
+
+# --- Settings ---
+AUTHZ_CACHE_MAX_ENTRIES = int(os.getenv("AUTHZ_CACHE_MAX_ENTRIES", "50000"))
+# The longest a member/leader decision is trusted without asking team_service.
+# team_service invalidates on membership changes (webhook), so this only
+# matters when the webhook is lost or hits another task_service replica.
+AUTHZ_CACHE_MAX_STALENESS_SECONDS = float(os.getenv("AUTHZ_CACHE_MAX_STALENESS_SECONDS", "60"))
+# Denials are kept shorter: a user just added to a team should not wait long.
+AUTHZ_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("AUTHZ_CACHE_NEGATIVE_TTL_SECONDS", "10"))
+
+
+class TeamAccess(StrEnum):
+    MEMBER = "member"
+    LEADER = "leader"
+    DENIED = "denied"
+
+
+class AuthzDecisionCache(TTLCache[tuple[str, str], TeamAccess]):
+    """
+    (username, team_id) -> TeamAccess, with a shorter TTL for denials.
+    Every invalidation bumps `epoch`; a decision fetched while an
+    invalidation happened is not stored, so it can't bring stale data back.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float, negative_ttl_seconds: float):
+        super().__init__(max_entries, ttl_seconds)
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._by_team: dict[str, set[str]] = {}
+        self.epoch = 0
+
+    def get(self, username: str, team_id: str) -> TeamAccess | None:
+        return super().get((username, team_id))
+
+    def put(self, username: str, team_id: str, decision: TeamAccess, epoch: int):
+        if epoch != self.epoch:
+            return  # invalidated while we were asking team_service
+        ttl = self.negative_ttl_seconds if decision == TeamAccess.DENIED else self.ttl_seconds
+        if super().put((username, team_id), decision, ttl_seconds=ttl):
+            self._by_team.setdefault(team_id, set()).add(username)
+
+    def invalidate_team(self, team_id: str, usernames: list[str] | None = None):
+        """
+        Drops the decisions of `usernames` in the team (all of them if None).
+        """
+        self.epoch += 1
+        self.invalidations += 1
+        cached = self._by_team.get(team_id, set())
+        for username in list(cached if usernames is None else cached & set(usernames)):
+            self.discard((username, team_id))
+
+    def _drop(self, key: tuple[str, str]):
+        super()._drop(key)
+        username, team_id = key
+        members = self._by_team.get(team_id)
+        if members is not None:
+            members.discard(username)
+            if not members:
+                del self._by_team[team_id]
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["max_staleness_seconds"] = stats.pop("ttl_seconds")
+        stats["negative_ttl_seconds"] = self.negative_ttl_seconds
+        return stats
+
+
+# The single cache instance for this process
+authz_cache = AuthzDecisionCache(
+    AUTHZ_CACHE_MAX_ENTRIES, AUTHZ_CACHE_MAX_STALENESS_SECONDS, AUTHZ_CACHE_NEGATIVE_TTL_SECONDS
+)
+
+
+async def _fetch_team_access(current_user: TokenData, team_id: str, http_client: httpx.AsyncClient) -> TeamAccess:
+    # team_service answers 200 to members (and admins), 403 to everyone else,
+    # 400 to malformed ids; the leader is in the response body.
+    team_service_url = f"http://team_service:8002/teams/{team_id}"
+    try:
+        headers = {"Authorization": f"Bearer {current_user.token}"}
+        response = await http_client.get(team_service_url, headers=headers)
+    except httpx.ConnectError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Team service is unreachable.")
+
+    if response.status_code in (400, 403, 404):
+        return TeamAccess.DENIED
+    if response.status_code != 200:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Team service error.")
+    if response.json().get("leader_id") == current_user.username:
+        return TeamAccess.LEADER
+    return TeamAccess.MEMBER
+
+
+async def resolve_team_access(current_user: TokenData, team_id: str, http_client: httpx.AsyncClient) -> TeamAccess:
+    """
+    The user's access to a team: from the cache, or one call to team_service.
+    Admins are not special-cased here; callers decide what admins may do.
+    Fresh membership claims in the token answer without either.
+    """
+    claimed = await claims_role(get_database(), current_user, team_id)
+    if claimed is not None:
+        return TeamAccess(claimed)
+
+    decision = authz_cache.get(current_user.username, team_id)
+    if decision is not None:
+        return decision
+
+    epoch = authz_cache.epoch
+    decision = await _fetch_team_access(current_user, team_id, http_client)
+    authz_cache.put(current_user.username, team_id, decision, epoch)
+    return decision
@@ -0,0 +1,167 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+# --- Settings ---
+COMMENT_MIGRATION_ENABLED = os.getenv("COMMENT_MIGRATION_ENABLED", "true").lower() in ("1", "true", "yes")
+COMMENT_MIGRATION_BATCH_SIZE = int(os.getenv("COMMENT_MIGRATION_BATCH_SIZE", "200"))
+# Pause between batches, so the migration never saturates MongoDB
+COMMENT_MIGRATION_PAUSE_SECONDS = float(os.getenv("COMMENT_MIGRATION_PAUSE_SECONDS", "0.1"))
+
+# One document per comment: {"_id", "task_id", "text", "created_by", "created_at"}.
+# Comments used to live in an unbounded `comments` array inside each task, so
+# every read of a task carried its whole thread. Here a page of comments is
+# one walk of the (task_id, created_at, _id) index and a delete is one keyed
+# lookup (see indexes.py).
+#
+# Tasks written before this collection existed still have the array. They
+# are moved over lazily (the first time their comments are touched) and by
+# a background migration, in batches. Both copy with upserts on the comment
+# _id and then $pull exactly the copied comments, so they can run at the same
+# time, be interrupted, and be run again.
+COMMENTS = "task_comments"
+
+
+# -------------- Reads and writes -----------------
+
+async def insert_comment(db: AsyncIOMotorDatabase, comment_doc: dict):
+    await db[COMMENTS].insert_one(comment_doc)
+
+
+async def find_task_comments(
+    db: AsyncIOMotorDatabase,
+    task_id: ObjectId,
+    limit: int,
+    after: Optional[tuple[datetime, ObjectId]] = None,
+) -> list[dict]:
+    """
+    Returns up to `limit` comments of the task, oldest first, starting after
+    the (created_at, _id) of the last comment of the previous page.
+    """
+    query = {"task_id": task_id}
+    if after is not None:
+        after_created_at, after_id = after
+        query["$or"] = [
+            {"created_at": {"$gt": after_created_at}},
+            {"created_at": after_created_at, "_id": {"$gt": after_id}},
+        ]
+    cursor = db[COMMENTS].find(query).sort([("created_at", 1), ("_id", 1)]).limit(limit)
+    return await cursor.to_list(length=limit)
+
+
+async def find_comment(db: AsyncIOMotorDatabase, task_id: ObjectId, comment_id: ObjectId) -> Optional[dict]:
+    return await db[COMMENTS].find_one({"_id": comment_id, "task_id": task_id}, projection={"created_by": 1})
+
+
+async def delete_comment(db: AsyncIOMotorDatabase, task_id: ObjectId, comment_id: ObjectId) -> bool:
+    result = await db[COMMENTS].delete_one({"_id": comment_id, "task_id": task_id})
+    return result.deleted_count == 1
+
+
+async def delete_task_comments(db: AsyncIOMotorDatabase, task_id: ObjectId):
+    await db[COMMENTS].delete_many({"task_id": task_id})
+
+
+# -------------- Migration of the embedded arrays -----------------
+
+# Only tasks that still have at least one embedded comment
+EMBEDDED_COMMENTS_FILTER = {"comments.0": {"$exists": True}}
+# Projection for reads that need the task's team and whether it still has
+# embedded comments, without loading the array ($slice keeps one element)
+TASK_TEAM_PROJECTION = {"team_id": 1, "comments": {"$slice": 1}}
+
+
+def has_embedded_comments(task_doc: dict) -> bool:
+    return bool(task_doc.get("comments"))
+
+
+async def _move_embedded_comments(db: AsyncIOMotorDatabase, tasks: list[dict]) -> int:
+    # Copy (idempotent upserts), then remove from the tasks only what was copied
+    copies, pulls = [], []
+    for task in tasks:
+        comment_ids = []
+        for comment in task.get("comments", []):
+            copies.append(UpdateOne(
+                {"_id": comment["_id"]},
+                {"$setOnInsert": {
+                    "task_id": task["_id"],
+                    "text": comment["text"],
+                    "created_by": comment["created_by"],
+                    "created_at": comment["created_at"],
+                }},
+                upsert=True,
+            ))
+            comment_ids.append(comment["_id"])
+        if comment_ids:
+            pulls.append(UpdateOne({"_id": task["_id"]}, {"$pull": {"comments": {"_id": {"$in": comment_ids}}}}))
+    if copies:
+        await db[COMMENTS].bulk_write(copies, ordered=False)
+        await db["tasks"].bulk_write(pulls, ordered=False)
+    return len(copies)
+
+
+async def migrate_task_comments(db: AsyncIOMotorDatabase, task_id: ObjectId) -> int:
+    """
+    Moves the embedded comments of one task, if it still has any.
+    Called before the comments of a task that has_embedded_comments() are used.
+    """
+    task = await db["tasks"].find_one({"_id": task_id, **EMBEDDED_COMMENTS_FILTER}, projection={"comments": 1})
+    if task is None:
+        return 0
+    return await _move_embedded_comments(db, [task])
+
+
+async def migrate_embedded_comments(db: AsyncIOMotorDatabase) -> int:
+    """
+    Moves every embedded comment to the comments collection, a batch of tasks
+    at a time (walking tasks by _id). Returns how many comments were moved.
+    """
+    moved, after_id = 0, None
+    while True:
+        query = dict(EMBEDDED_COMMENTS_FILTER)
+        if after_id is not None:
+            query["_id"] = {"$gt": after_id}
+        tasks = await db["tasks"].find(query, projection={"comments": 1}).sort("_id", 1) \
+            .limit(COMMENT_MIGRATION_BATCH_SIZE).to_list(length=COMMENT_MIGRATION_BATCH_SIZE)
+        if not tasks:
+            return moved
+        moved += await _move_embedded_comments(db, tasks)
+        after_id = tasks[-1]["_id"]
+        await asyncio.sleep(COMMENT_MIGRATION_PAUSE_SECONDS)
+
+
+_migration_task: asyncio.Task | None = None
+
+
+async def _run_migration(db: AsyncIOMotorDatabase):
+    try:
+        moved = await migrate_embedded_comments(db)
+        if moved:
+            print(f"Moved {moved} embedded task comments to '{COMMENTS}'.")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # The lazy path still migrates tasks as they are used; the next start retries the rest
+        print(f"Warning: comment migration stopped: {e}")
+
+
+def start_comment_migration(db: AsyncIOMotorDatabase):
+    global _migration_task
+    if COMMENT_MIGRATION_ENABLED and _migration_task is None:
+        _migration_task = asyncio.create_task(_run_migration(db))
+
+
+async def stop_comment_migration():
+    global _migration_task
+    if _migration_task is not None:
+        _migration_task.cancel()
+        try:
+            await _migration_task
+        except asyncio.CancelledError:
+            pass
+        _migration_task = None
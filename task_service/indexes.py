@@ -0,0 +1,60 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+
+from bson import ObjectId
+
+from common import indexes as common_indexes
+from comments import COMMENTS
+
+# --- Index declarations ---
+# One entry per query shape we serve. create_indexes() is a no-op for
+# indexes that already exist with the same spec, so this runs on every startup.
+INDEXES = {
+    "tasks": [
+        # list_my_assigned_tasks: assigned_to (+ status) sorted by due_date.
+        # _id is the tie-breaker so the sort order is stable.
+        IndexModel([("assigned_to", ASCENDING), ("status", ASCENDING), ("due_date", ASCENDING), ("_id", ASCENDING)],
+                   name="assigned_to_status_due_date"),
+        IndexModel([("assigned_to", ASCENDING), ("due_date", ASCENDING), ("_id", ASCENDING)],
+                   name="assigned_to_due_date"),
+        # list_tasks_by_team: team_id (+ status) sorted by due_date
+        IndexModel([("team_id", ASCENDING), ("status", ASCENDING), ("due_date", ASCENDING), ("_id", ASCENDING)],
+                   name="team_id_status_due_date"),
+        IndexModel([("team_id", ASCENDING), ("due_date", ASCENDING), ("_id", ASCENDING)],
+                   name="team_id_due_date"),
+        # both listings without sort_by_due are paged by _id (+ status filter)
+        IndexModel([("assigned_to", ASCENDING), ("_id", ASCENDING)], name="assigned_to_id"),
+        IndexModel([("assigned_to", ASCENDING), ("status", ASCENDING), ("_id", ASCENDING)],
+                   name="assigned_to_status_id"),
+        IndexModel([("team_id", ASCENDING), ("_id", ASCENDING)], name="team_id_id"),
+        IndexModel([("team_id", ASCENDING), ("status", ASCENDING), ("_id", ASCENDING)],
+                   name="team_id_status_id"),
+    ],
+    COMMENTS: [
+        # a task's comments page by page, oldest first; also delete_task_comments
+        IndexModel([("task_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+                   name="task_id_created_at"),
+    ],
+}
+
+# Representative queries (collection, filter, sort) whose plans must use an
+# index; common/tests/test_indexes.py checks them against a real MongoDB.
+QUERY_SHAPES = {
+    "list_my_assigned_tasks": ("tasks", {"assigned_to": "u"}, [("due_date", 1), ("_id", 1)]),
+    "list_my_assigned_tasks (status)": ("tasks", {"assigned_to": "u", "status": "TODO"}, [("due_date", 1), ("_id", 1)]),
+    "list_my_assigned_tasks (by _id)": ("tasks", {"assigned_to": "u"}, [("_id", 1)]),
+    "list_my_assigned_tasks (status, by _id)": ("tasks", {"assigned_to": "u", "status": "TODO"}, [("_id", 1)]),
+    "list_tasks_by_team": ("tasks", {"team_id": "t"}, [("due_date", 1), ("_id", 1)]),
+    "list_tasks_by_team (status)": ("tasks", {"team_id": "t", "status": "TODO"}, [("due_date", 1), ("_id", 1)]),
+    "list_tasks_by_team (by _id)": ("tasks", {"team_id": "t"}, [("_id", 1)]),
+    "list_tasks_by_team (status, by _id)": ("tasks", {"team_id": "t", "status": "TODO"}, [("_id", 1)]),
+    "get_team_task_stats ($match)": ("tasks", {"team_id": "t"}, None),
+    "get_all_task_comments": (COMMENTS, {"task_id": ObjectId()}, [("created_at", 1), ("_id", 1)]),
+}
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """
+    Creates every declared index (idempotent). Called at startup.
+    """
+    await common_indexes.ensure_indexes(db, INDEXES)
@@ -1,9 +1,18 @@
 from dotenv import load_dotenv
 load_dotenv() # Load environment variables first
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from security import get_current_admin_user
 from routes import router as tasks_router
+from common.health import start_health_probes, stop_health_probes, get_health_status
+from common.http_client import start_http_client, close_http_client
+from indexes import ensure_indexes
+from authz_cache import authz_cache
+from task_stats import task_stats_cache
+from comments import start_comment_migration, stop_comment_migration
+from db import get_database, check_database
 
 app = FastAPI(title="Task Management API", version="0.1.0")
 
@@ -15,6 +24,40 @@ app.add_middleware(
 
 app.include_router(tasks_router)
 
+@app.on_event("startup")
+async def on_startup():
+    await ensure_indexes(get_database())
+    start_http_client()
+    start_health_probes(check_database, {
+        "user_service": "http://user_service:8001/health/live",
+        "team_service": "http://team_service:8002/health/live",
+    })
+    start_comment_migration(get_database())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_comment_migration()
+    await stop_health_probes()
+    await close_http_client()
+
+@app.get("/health/live")
+async def liveness():
+    # the process is up and serving requests; no dependencies are checked
+    return {"status": "alive"}
+
+@app.get("/health/ready")
 @app.get("/health")
-def health():
-    return {"service": "Task Management API", "status": "running"}
\ No newline at end of file
+async def readiness():
+    # cached result of the background probe loop (see common/health.py), never hits MongoDB
+    health_status = get_health_status()
+    return JSONResponse(health_status, status_code=200 if health_status["ready"] else 503)
+
+@app.get("/metrics/authz-cache", dependencies=[Depends(get_current_admin_user)])
+async def authz_cache_metrics():
+    # hit ratio of the team-access decision cache (see authz_cache.py)
+    return authz_cache.stats()
+
+@app.get("/metrics/task-stats-cache", dependencies=[Depends(get_current_admin_user)])
+async def task_stats_cache_metrics():
+    # hit ratio of the team task stats cache (see task_stats.py)
+    return task_stats_cache.stats()
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import List, Optional
+from typing import Optional
 from bson import ObjectId
 from schemas import TaskStatus, TaskPriority # <-- ADD THIS IMPORT
 
@@ -18,9 +18,10 @@ class PyObjectId(ObjectId):
     def __get_pydantic_json_schema__(cls, field_schema, *args, **kwargs):
         field_schema.update(type="string")
 
-# --- Comment Entity ---
+# --- Comment Entity (collection task_comments, see comments.py) ---
 class Comment(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
+    task_id: PyObjectId = Field(...) # The task the comment belongs to
     text: str = Field(...)
     created_by: str = Field(...) # Username
     created_at: datetime = Field(default_factory=datetime.now)
@@ -41,7 +42,8 @@ class Task(BaseModel):
     priority: TaskPriority = Field(...) # USE ENUM
     due_date: datetime = Field(...)
     created_at: datetime = Field(default_factory=datetime.now)
-    comments: List[Comment] = Field(default_factory=list)
+    # Comments are stored in their own collection (comments.py); older
+    # task documents may still carry an embedded `comments` array until migrated.
 
     class Config:
         populate_by_name = True
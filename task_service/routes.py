@@ -1,21 +1,55 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from datetime import datetime
 from typing import Annotated, List, Optional # ADD THIS
 
 from db import get_database
-from schemas import TaskCreate, TaskOut, TokenData, TaskStatus, TaskUpdate, TaskStatusUpdate, Role, CommentIn, CommentOut
-from models import Task, PyObjectId
+from common.http_client import get_http_client
+from schemas import TaskCreate, TaskOut, TokenData, TaskStatus, TaskUpdate, TaskStatusUpdate, Role, CommentIn, CommentOut, CommentPage, TaskListItem, TaskPage, TaskStats, AuthzInvalidate
+from models import Task, Comment, PyObjectId
+from common.pagination import encode_cursor, decode_cursor
+from comments import (
+    TASK_TEAM_PROJECTION, has_embedded_comments, migrate_task_comments,
+    insert_comment, find_task_comments, delete_comment as delete_comment_doc, delete_task_comments,
+)
 from security import get_current_user, get_validated_team_leader, get_team_access_for_tasks, get_task_leader_only, authorize_comment_deletion # Import the new dependency
+from security import get_service_caller
+from authz_cache import authz_cache
+from task_stats import task_stats_cache, get_team_stats
 import httpx
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# --- Write helpers ---
+# Updates fold the authorization predicate into the filter of a single
+# find_one_and_update. Only when nothing matched do we read the task again,
+# to answer 404 (no such task) or 403 (not allowed) like before.
+
+def _parse_task_id(task_id: str) -> PyObjectId:
+    try:
+        return PyObjectId(task_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid task ID format.")
+
+async def _raise_task_not_found_or_forbidden(db: AsyncIOMotorDatabase, obj_id: PyObjectId, detail: str):
+    if not await db["tasks"].find_one({"_id": obj_id}, projection={"_id": 1}):
+        raise HTTPException(status_code=404, detail="Task not found.")
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=detail)
+
+def _task_out(task_doc: dict) -> TaskOut:
+    return TaskOut(id=str(task_doc["_id"]), **task_doc)
+
 
 @router.post("", response_model=TaskOut, status_code=status.HTTP_201_CREATED)
 async def create_task(
     task_data: TaskCreate, 
     db: Annotated[AsyncIOMotorDatabase, Depends(get_database)],
     current_user: Annotated[TokenData, Depends(get_current_user)], # For created_by
+    http_client: Annotated[httpx.AsyncClient, Depends(get_http_client)],
     # The security check runs first. If successful, it returns the validated team_id
     validated_team_id: Annotated[str, Depends(get_validated_team_leader)] 
 ):
@@ -27,9 +61,8 @@ async def create_task(
     assigned_user_url = f"http://user_service:8001/users/{task_data.assigned_to}"
     
     try:
-        async with httpx.AsyncClient() as client:
-            headers = {"Authorization": f"Bearer {current_user.token}"}
-            response = await client.get(assigned_user_url, headers=headers)
+        headers = {"Authorization": f"Bearer {current_user.token}"}
+        response = await http_client.get(assigned_user_url, headers=headers)
         
         if response.status_code == 404:
             raise HTTPException(status_code=404, detail=f"User '{task_data.assigned_to}' not found in the system.")
@@ -54,30 +87,41 @@ async def create_task(
         status=task_data.status,
         priority=task_data.priority,
         due_date=task_data.due_date,
-        comments=[]
     )
     
     # --- 3. Save to MongoDB ---
-    result = await db["tasks"].insert_one(new_task.model_dump(by_alias=True))
-    created_task = await db["tasks"].find_one({"_id": result.inserted_id})
+    # We return the document we built instead of reading it back.
+    new_task_doc = new_task.model_dump(by_alias=True)
+    await db["tasks"].insert_one(new_task_doc)
+    task_stats_cache.invalidate(validated_team_id)
     
-    return TaskOut(
-        id=str(created_task["_id"]),
-        **created_task
-    )
+    return _task_out(new_task_doc)
 
 #--------- UPDATE TASK (team leader only) --------
 
 @router.patch("/{task_id}", response_model=TaskOut, tags=["tasks"])
 async def update_task_details(
+    task_id: str,
     task_data: TaskUpdate,
     db: Annotated[AsyncIOMotorDatabase, Depends(get_database)],
     current_user: Annotated[TokenData, Depends(get_current_user)], # <-- ADD THIS
-    task_to_update: Task = Depends(get_task_leader_only)
+    http_client: Annotated[httpx.AsyncClient, Depends(get_http_client)],
 ):
     """
     (Admin or Task Creator/Team Leader Only) Updates specific fields of a task.
     """
+    obj_id = _parse_task_id(task_id)
+    forbidden_detail = "Only the Admin or the Task Creator/Team Leader can delete this task."
+
+    # Security check as a filter: admins match any task,
+    # team leaders only the tasks they created.
+    if current_user.role == Role.ADMIN:
+        task_filter = {"_id": obj_id}
+    elif current_user.role == Role.TEAM_LEADER:
+        task_filter = {"_id": obj_id, "created_by": current_user.username}
+    else:
+        await _raise_task_not_found_or_forbidden(db, obj_id, forbidden_detail)
+
     # 1. Prepare data for MongoDB
     update_data = task_data.model_dump(exclude_unset=True)
     
@@ -91,10 +135,9 @@ async def update_task_details(
         user_service_url = f"http://user_service:8001/users/{assigned_user}"
         
         try:
-            async with httpx.AsyncClient() as client:
-                # Use the token from the current_user dependency
-                headers = {"Authorization": f"Bearer {current_user.token}"}
-                response = await client.get(user_service_url, headers=headers)
+            # Use the token from the current_user dependency
+            headers = {"Authorization": f"Bearer {current_user.token}"}
+            response = await http_client.get(user_service_url, headers=headers)
             
             if response.status_code == 404:
                 raise HTTPException(status_code=404, detail=f"User '{assigned_user}' is either invalid or not part of the team.")
@@ -106,15 +149,18 @@ async def update_task_details(
         except httpx.ConnectError:
             raise HTTPException(status_code=503, detail="User service is unreachable.")
             
-    # 2. Update the team in the database
-    await db["tasks"].update_one(
-        {"_id": task_to_update.id}, 
-        {"$set": update_data}
+    # 2. Update the task and get the new version back in one round trip
+    updated_task_doc = await db["tasks"].find_one_and_update(
+        task_filter,
+        {"$set": update_data},
+        projection={"comments": 0},
+        return_document=ReturnDocument.AFTER
     )
-    
-    # 3. Fetch the updated document and return it
-    updated_task_doc = await db["tasks"].find_one({"_id": task_to_update.id})
-    return TaskOut(id=str(updated_task_doc["_id"]), **updated_task_doc)
+    if updated_task_doc is None:
+        await _raise_task_not_found_or_forbidden(db, obj_id, forbidden_detail)
+    task_stats_cache.invalidate(updated_task_doc["team_id"])
+
+    return _task_out(updated_task_doc)
 
 ###### ONLY TASK UPDATE, meant for assigned member.
 @router.patch("/{task_id}/status", response_model=TaskOut, tags=["tasks"])
@@ -130,115 +176,165 @@ async def update_task_status(
     (Assigned User Only) Updates the status of a specific task.
     """
     
-    # 1. Validate Task ID format
-    try:
-        obj_id = PyObjectId(task_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid task ID format.")
+    obj_id = _parse_task_id(task_id)
 
-    # 2. Find the task
-    task_doc = await db["tasks"].find_one({"_id": obj_id})
-    if not task_doc:
-        raise HTTPException(status_code=404, detail="Task not found.")
-    
-    task = Task(**task_doc)
+    # Security Check folded into the filter: Assigned User ONLY
+    updated_task_doc = await db["tasks"].find_one_and_update(
+        {"_id": obj_id, "assigned_to": current_user.username},
+        {"$set": {"status": status_data.status}},
+        projection={"comments": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_task_doc is None:
+        await _raise_task_not_found_or_forbidden(
+            db, obj_id,
+            "You are not authorized to change the status; only the assigned user can."
+        )
+    task_stats_cache.invalidate(updated_task_doc["team_id"])
 
-    # 3. Security Check: Assigned User ONLY
-    if current_user.username != task.assigned_to:
+    return _task_out(updated_task_doc)
+
+# --------------- FILTER FUNCTIONS -------------
+
+# Listings are paged with a cursor on their sort key: (due_date, _id) with
+# sort_by_due, otherwise _id. Both are unique, so pages never skip or repeat
+# tasks, and each page is one index walk (see indexes.py).
+# Only the TaskOut fields are read from MongoDB (an inclusion projection), so
+# embedded comments of not yet migrated tasks never leave the database.
+TASK_FIELDS = [name for name in TaskListItem.model_fields if name != "id"]
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    if fields is None:
+        return TASK_FIELDS
+    requested = [part.strip() for part in fields.split(",") if part.strip()]
+    unknown = [name for name in requested if name not in TASK_FIELDS]
+    if unknown:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You are not authorized to change the status; only the assigned user can."
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Available fields: {', '.join(TASK_FIELDS)}"
         )
+    return requested
 
-    # 4. Update the status in the database
-    await db["tasks"].update_one(
-        {"_id": task.id},
-        {"$set": {"status": status_data.status}}
-    )
-    
-    # 5. Fetch and return the updated document
-    updated_task_doc = await db["tasks"].find_one({"_id": task.id})
-    return TaskOut(id=str(updated_task_doc["_id"]), **updated_task_doc)
+def _after_cursor(cursor: str, sort_by_due: bool) -> dict:
+    # The filter that starts a page right after the cursor's task
+    try:
+        values = decode_cursor(cursor)
+        if sort_by_due:
+            due_date, task_id = values
+            due_date, task_id = datetime.fromisoformat(due_date), PyObjectId(task_id)
+            return {"$or": [
+                {"due_date": {"$gt": due_date}},
+                {"due_date": due_date, "_id": {"$gt": task_id}},
+            ]}
+        (task_id,) = values
+        return {"_id": {"$gt": PyObjectId(task_id)}}
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-# --------------- FILTER FUNCTIONS -------------
+async def _find_task_page(
+    db: AsyncIOMotorDatabase,
+    query: dict,
+    limit: int,
+    cursor: Optional[str],
+    sort_by_due: bool,
+    fields: Optional[str],
+) -> TaskPage:
+    """
+    Runs `query` on the tasks collection and returns one page of the requested fields.
+    """
+    selected = _parse_fields(fields)
+    # The sort key is always read, the cursor is built from it
+    projection = {name: 1 for name in selected}
+    sort = [("_id", 1)]
+    if sort_by_due:
+        projection["due_date"] = 1
+        sort = [("due_date", 1), ("_id", 1)]
+
+    if cursor:
+        query = {**query, **_after_cursor(cursor, sort_by_due)}
+
+    # Fetch one extra document to know whether there is a next page
+    tasks_cursor = db["tasks"].find(query, projection).sort(sort).limit(limit + 1)
+    tasks = await tasks_cursor.to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(tasks) > limit:
+        last = tasks[limit - 1]
+        next_cursor = encode_cursor(
+            [last["due_date"].isoformat(), str(last["_id"])] if sort_by_due else [str(last["_id"])]
+        )
+    return TaskPage(
+        items=[
+            TaskListItem(id=str(task["_id"]), **{name: task[name] for name in selected if name in task})
+            for task in tasks[:limit]
+        ],
+        next_cursor=next_cursor,
+    )
 
 # User can view all the tasks assigned to them, from all teams
-@router.get("/me", response_model=List[TaskOut], tags=["tasks"])
+@router.get("/me", response_model=TaskPage, response_model_exclude_unset=True, tags=["tasks"])
 async def list_my_assigned_tasks(
     db: Annotated[AsyncIOMotorDatabase, Depends(get_database)],
     current_user: Annotated[TokenData, Depends(get_current_user)],
     # --- NEW QUERY PARAMETERS ---
     status: Optional[TaskStatus] = None, # Filters by status (TODO, IN_PROGRESS, DONE)
     sort_by_due: Optional[bool] = False, # If True, sorts by due_date
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated task fields to return, e.g. 'title,status'"),
     # ---------------------------
 ):
+    """
+    The tasks assigned to the current user, one page at a time.
+    """
     query = {"assigned_to": current_user.username}
     
-    # 1. Status Filtering
+    # Status Filtering
     if status:
         query["status"] = status.value # Use .value to get the string from the Enum
-        
-    # 2. Sorting Logic
-    sort_criteria = []
-    if sort_by_due:
-        # Sort by due_date ascending (1)
-        sort_criteria.append(("due_date", 1))
 
-    # --- THE FIX ---
-    tasks_cursor = db["tasks"].find(query)
-    
-    if sort_criteria: # <-- ONLY apply sort if criteria exist
-        tasks_cursor = tasks_cursor.sort(sort_criteria)
-    # --- END FIX ---
-
-    tasks = await tasks_cursor.to_list(length=100)
-    
-    if not tasks:
-        return []
-
-    return [TaskOut(id=str(task["_id"]), **task) for task in tasks]
+    return await _find_task_page(db, query, limit, cursor, bool(sort_by_due), fields)
 
 # User can see all the tasks of their team
-@router.get("/team/{team_id}", response_model=List[TaskOut], tags=["tasks"])
+@router.get("/team/{team_id}", response_model=TaskPage, response_model_exclude_unset=True, tags=["tasks"])
 async def list_tasks_by_team(
     db: Annotated[AsyncIOMotorDatabase, Depends(get_database)],
     # This dependency runs the security check and returns the validated ID.
     # It ensures the user is a member or admin of the team.
     validated_team_id: Annotated[str, Depends(get_team_access_for_tasks)], 
     
-    # Query Parameters for filtering and sorting
+    # Query Parameters for filtering, sorting and paging
     status: Optional[TaskStatus] = None, 
     sort_by_due: Optional[bool] = False,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated task fields to return, e.g. 'title,status'"),
 ):
     """
-    (Team Members/Admins Only) Lists all tasks for a specific team, with optional filtering.
+    (Team Members/Admins Only) Lists the tasks of a specific team, one page at a time, with optional filtering.
     """
     
-    # 1. Build the MongoDB Query
+    # Build the MongoDB Query
     query = {"team_id": validated_team_id}
     
     if status:
         query["status"] = status.value
-        
-    # 1. Build the MongoDB Sort Criteria
-    sort_criteria = []
-    if sort_by_due:
-        sort_criteria.append(("due_date", 1))
 
-    # 2. Execute the Query
-    tasks_cursor = db["tasks"].find(query)
-    
-    # --- FIX: Only apply sort if criteria exist ---
-    if sort_criteria: 
-        tasks_cursor = tasks_cursor.sort(sort_criteria)
-    # --- END FIX ---
+    return await _find_task_page(db, query, limit, cursor, bool(sort_by_due), fields)
 
-    tasks = await tasks_cursor.to_list(length=100)
-    
-    if not tasks:
-        return []
-
-    return [TaskOut(id=str(task["_id"]), **task) for task in tasks]
+@router.get("/team/{team_id}/stats", response_model=TaskStats, tags=["tasks"])
+async def get_team_task_stats(
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_database)],
+    validated_team_id: Annotated[str, Depends(get_team_access_for_tasks)],
+):
+    """
+    (Team Members/Admins Only) Task counts of a team for dashboards: by status,
+    priority and assignee, plus overdue and due-this-week totals.
+    One aggregation, cached for a few seconds (see task_stats.py).
+    """
+    return await get_team_stats(db, validated_team_id)
 
 @router.delete("/{task_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["tasks"])
 async def delete_task(
@@ -251,6 +347,8 @@ async def delete_task(
     """
     # Use the ID from the validated Task object
     await db["tasks"].delete_one({"_id": task_to_delete.id})
+    await delete_task_comments(db, task_to_delete.id)
+    task_stats_cache.invalidate(task_to_delete.team_id)
     
     return None
 
@@ -259,7 +357,8 @@ async def add_comment_to_task(
     task_id: str,
     comment_data: CommentIn,
     db: Annotated[AsyncIOMotorDatabase, Depends(get_database)],
-    current_user: Annotated[TokenData, Depends(get_current_user)]
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    http_client: Annotated[httpx.AsyncClient, Depends(get_http_client)]
 ):
     """
     (Team Member/Leader/Admin) Adds a new comment to a specific task.
@@ -280,25 +379,20 @@ async def add_comment_to_task(
     
     # 3. Security Check: Check if user has access to the team
     # We call the dependency's logic directly to reuse the powerful ISC check
-    await get_team_access_for_tasks(team_id, current_user)
+    await get_team_access_for_tasks(team_id, current_user, http_client)
 
-    # 4. Create the new Comment object (using model_dump for clean nested insertion)
+    # 4. Create the new Comment object
     new_comment = Comment(
+        task_id=obj_id,
         text=comment_data.text,
         created_by=current_user.username,
     )
     
-    # 5. Insert the comment into the nested 'comments' array in MongoDB
-    result = await db["tasks"].update_one(
-        {"_id": obj_id},
-        {"$push": {"comments": new_comment.model_dump(by_alias=True)}}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=500, detail="Failed to add comment.")
+    # 5. Insert it into the comments collection (the task document is not touched)
+    await insert_comment(db, new_comment.model_dump(by_alias=True))
         
     # Return the newly created comment object (with the generated ID and timestamp)
-    # Since MongoDB generated the ID, we return the object we created locally.
+    # Since we generated the ID, we return the object we created locally.
     return CommentOut(
         id=str(new_comment.id),
         text=new_comment.text,
@@ -307,14 +401,17 @@ async def add_comment_to_task(
     )
 
 
-@router.get("/{task_id}/comments", response_model=List[CommentOut], tags=["comments"])
+@router.get("/{task_id}/comments", response_model=CommentPage, tags=["comments"])
 async def get_all_task_comments(
     task_id: str,
     db: Annotated[AsyncIOMotorDatabase, Depends(get_database)],
-    current_user: Annotated[TokenData, Depends(get_current_user)]
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    http_client: Annotated[httpx.AsyncClient, Depends(get_http_client)],
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
 ):
     """
-    (Team Member/Leader/Admin) Retrieves all comments for a specific task.
+    (Team Member/Leader/Admin) Retrieves the comments of a specific task, one page at a time (oldest first).
     Requires user to be a member of the task's team.
     """
     # 1. Validate Task ID format
@@ -323,29 +420,39 @@ async def get_all_task_comments(
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid task ID format.")
 
-    # 2. Find the task and get the team_id
-    task_doc = await db["tasks"].find_one({"_id": obj_id}, projection={"team_id": 1})
+    after = None
+    if cursor:
+        try:
+            created_at, comment_id = decode_cursor(cursor)
+            after = (datetime.fromisoformat(created_at), PyObjectId(comment_id))
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # 2. Find the task and get the team_id (and whether it still has embedded comments)
+    task_doc = await db["tasks"].find_one({"_id": obj_id}, projection=TASK_TEAM_PROJECTION)
     if not task_doc:
         raise HTTPException(status_code=404, detail="Task not found.")
     
     team_id = task_doc["team_id"]
     
     # 3. Security Check: Check if user has access to the team
-    await get_team_access_for_tasks(team_id, current_user)
+    await get_team_access_for_tasks(team_id, current_user, http_client)
+
+    # Tasks from before the comments collection: move their comments over first
+    if has_embedded_comments(task_doc):
+        await migrate_task_comments(db, obj_id)
     
-    # 4. Retrieve the full task document, but only include the comments array
-    task_with_comments = await db["tasks"].find_one(
-        {"_id": obj_id}, 
-        projection={"comments": 1}
+    # 4. One page from the (task_id, created_at, _id) index, one extra to know if there is more
+    comments = await find_task_comments(db, obj_id, limit + 1, after)
+
+    next_cursor = None
+    if len(comments) > limit:
+        last = comments[limit - 1]
+        next_cursor = encode_cursor([last["created_at"].isoformat(), str(last["_id"])])
+    return CommentPage(
+        items=[CommentOut(id=str(comment["_id"]), **comment) for comment in comments[:limit]],
+        next_cursor=next_cursor,
     )
-    
-    if not task_with_comments or 'comments' not in task_with_comments:
-        return []
-        
-    # 5. Convert MongoDB documents to Pydantic CommentOut objects
-    comments_list = task_with_comments['comments']
-    
-    return [CommentOut(id=str(comment["_id"]), **comment) for comment in comments_list]
 
 @router.delete("/{task_id}/comments/{comment_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["comments"])
 async def delete_comment(
@@ -360,16 +467,28 @@ async def delete_comment(
     # The dependency ensures the user is authorized and returns the validated task_id
     comment_obj_id = PyObjectId(comment_id)
     
-    # Use MongoDB's $pull operator to remove the nested document from the comments array
-    result = await db["tasks"].update_one(
-        {"_id": task_id}, 
-        {"$pull": {"comments": {"_id": comment_obj_id}}}
-    )
+    # One keyed delete in the comments collection
+    deleted = await delete_comment_doc(db, task_id, comment_obj_id)
     
-    if result.modified_count == 0:
-        # If modified_count is 0, it means the comment wasn't removed. 
+    if not deleted:
+        # If nothing was deleted, the comment wasn't removed. 
         # Since the task/comment were found and user was authorized (by the dependency),
         # this case is unlikely but handles a race condition or a server error.
         raise HTTPException(status_code=500, detail="Failed to delete comment or comment was already gone.")
         
-    return None
\ No newline at end of file
+    return None
+
+
+# --- INTERNAL ENDPOINT (for Team-Service) ---
+@router.post("/internal/authz/invalidate", status_code=status.HTTP_204_NO_CONTENT, include_in_schema=False)
+async def invalidate_team_access(
+    payload: AuthzInvalidate,
+    service: Annotated[str, Depends(get_service_caller)]
+):
+    """
+    (Internal Service-Only)
+    Called by team_service after membership or leadership changes, so the
+    cached access decisions of the affected users are asked for again.
+    """
+    authz_cache.invalidate_team(payload.team_id, payload.usernames)
+    return None
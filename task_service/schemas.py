@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 from enum import StrEnum
 from datetime import datetime # ADD THIS IMPORT
 
@@ -24,6 +24,8 @@ class TokenData(BaseModel):
     username: str | None = None
     role: Role | None = None
     token: str | None = None
+    teams: dict | None = None # membership claims {"v", "l", "m"}, see common/team_claims.py
+    issued_at: int | None = None # the token's `iat`
 
 # --- Task Schemas ---
 class TaskCreate(BaseModel):
@@ -65,6 +67,52 @@ class TaskOut(BaseModel):
     created_at: datetime
     # Comments are excluded in the list view for simplicity
 
+class TaskListItem(BaseModel):
+    """
+    One task of a listing. With `?fields=` only the requested fields are
+    returned (and `id`); without it, every field of TaskOut.
+    """
+    id: str
+    team_id: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    created_by: Optional[str] = None
+    assigned_to: Optional[str] = None
+    status: Optional[str] = None
+    priority: Optional[str] = None
+    due_date: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+class TaskPage(BaseModel):
+    """
+    One page of a task listing.
+    Pass `next_cursor` back as `?cursor=` (with the same filters and sorting) to get the next page.
+    """
+    items: List[TaskListItem]
+    next_cursor: Optional[str] = None
+
+class AssigneeLoad(BaseModel):
+    """
+    How many tasks of the team one user has (all, and not DONE).
+    """
+    username: str
+    total: int
+    open: int
+
+class TaskStats(BaseModel):
+    """
+    Task figures of one team (GET /tasks/team/{team_id}/stats).
+    `overdue` and `due_this_week` (next 7 days) only count tasks that are not DONE.
+    """
+    team_id: str
+    total: int
+    by_status: Dict[str, int]
+    by_priority: Dict[str, int]
+    by_assignee: List[AssigneeLoad]
+    overdue: int
+    due_this_week: int
+    computed_at: datetime # may be up to TASK_STATS_CACHE_TTL_SECONDS old
+
 # This is for TEAM LEADER or ADMIN, allows to change anything in the task
 class TaskUpdate(BaseModel):
     """
@@ -93,7 +141,7 @@ class CommentIn(BaseModel):
 class CommentOut(BaseModel):
     """
     Schema for viewing a comment (API Output).
-    Note: The ID here is the nested object's ID (PyObjectId).
+    Note: The ID here is the comment document's _id.
     """
     id: str
     text: str
@@ -101,4 +149,21 @@ class CommentOut(BaseModel):
     created_at: datetime
     
     # Allows conversion from the MongoDB nested model
-    model_config = ConfigDict(json_encoders={datetime: lambda v: v.isoformat()})
\ No newline at end of file
+    model_config = ConfigDict(json_encoders={datetime: lambda v: v.isoformat()})
+
+class CommentPage(BaseModel):
+    """
+    One page of a task's comments, oldest first.
+    Pass `next_cursor` back as `?cursor=` to get the next page.
+    """
+    items: List[CommentOut]
+    next_cursor: Optional[str] = None
+
+# --- Internal: POST /tasks/internal/authz/invalidate (called by team_service) ---
+class AuthzInvalidate(BaseModel):
+    """
+    Drop cached access decisions for a team: for the given users, or for
+    everyone if `usernames` is omitted.
+    """
+    team_id: str
+    usernames: Optional[List[str]] = None
@@ -5,11 +5,14 @@ from pydantic import ValidationError
 import os, httpx # Add httpx
 from typing import Annotated 
 from db import get_database # <--- ADD THIS LINE
+from common.http_client import get_http_client
+from authz_cache import TeamAccess, resolve_team_access
 
 from motor.motor_asyncio import AsyncIOMotorClient # <-- (or similar line for motor)
 from motor.motor_asyncio import AsyncIOMotorDatabase # <--- ADD THIS LINE
 from schemas import TokenData, Role, TaskCreate # Import TaskCreate
 from models import Task, PyObjectId # You'll need to import this once you write the model
+from comments import TASK_TEAM_PROJECTION, has_embedded_comments, migrate_task_comments, find_comment
 
 # --- Settings (MUST be the same as user_service) ---
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -39,7 +42,9 @@ async def get_current_user(token: HTTPAuthorizationCredentials = Depends(bearer_
         token_data = TokenData(
             username=payload.get("sub"), 
             role=payload.get("role"),
-            token=token.credentials
+            token=token.credentials,
+            teams=payload.get("teams"),
+            issued_at=payload.get("iat")
         )
         if token_data.username is None or token_data.role is None:
             raise credentials_exception
@@ -50,9 +55,24 @@ async def get_current_user(token: HTTPAuthorizationCredentials = Depends(bearer_
     return token_data
 # -------------------------------------------------------------------------------------------------
 
+
+async def get_current_admin_user(
+    current_user: TokenData = Depends(get_current_user)
+) -> TokenData:
+    """
+    The Admin "gatekeeper". Checks the role from the token.
+    """
+    if current_user.role != Role.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, 
+            detail="The user does not have privileges to perform this action"
+        )
+    return current_user
+
 async def get_validated_team_leader(
     task_data: TaskCreate, # Get the data from the request body
     current_user: Annotated[TokenData, Depends(get_current_user)],
+    http_client: Annotated[httpx.AsyncClient, Depends(get_http_client)],
 ) -> str: # Returns the validated team_id
     
     team_id = task_data.team_id
@@ -65,31 +85,11 @@ async def get_validated_team_leader(
         )
 
     # 2. Check if the user is the leader of the specific team_id
-    team_service_url = f"http://team_service:8002/teams/{team_id}"
-    
-    try:
-        async with httpx.AsyncClient() as client:
-            # We use the current user's token (which is already a Leader token)
-            headers = {"Authorization": f"Bearer {current_user.token}"}
-            response = await client.get(team_service_url, headers=headers)
-        
-        # If the user is NOT the leader of this team, team_service returns 403
-        if response.status_code == 403:
-            raise HTTPException(
-                status_code=403,
-                detail="You can only create tasks for the team you lead."
-            )
-        
-        # Team not found (404) or service is down (e.g., 500)
-        response.raise_for_status() 
-        
-    # 3. Handle errors from the team_service call (merging 403 and 404)
-    except httpx.ConnectError:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Team service is unreachable.")
-    except Exception:
-        # This catches 404 Not Found (Team ID doesn't exist)
-        # This catches 403 Forbidden (User is not the leader of that team)
-        # This catches 500 Internal Server Error (Something broke)
+    # (cached decision, or one call to team_service; see authz_cache.py)
+    access = await resolve_team_access(current_user, team_id, http_client)
+
+    # 3. Not found, not accessible, or only a member: the same 400 for all
+    if access != TeamAccess.LEADER:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, # <-- Use 400 for a bad request
             detail="Team assignment failed. The specified Team ID is invalid or inaccessible."
@@ -102,34 +102,16 @@ async def get_validated_team_leader(
 async def get_team_access_for_tasks(
     team_id: str,
     current_user: Annotated[TokenData, Depends(get_current_user)],
+    http_client: Annotated[httpx.AsyncClient, Depends(get_http_client)],
 ) -> str: # Returns the validated team_id
     """
     Checks with Team Service if the user is an Admin or a Member of the target team.
     If authorized, returns the team_id.
     """
-    # Prepare for inter-service call
-    team_service_url = f"http://team_service:8002/teams/{team_id}"
-    
-    try:
-        async with httpx.AsyncClient() as client:
-            # We must send the user's token so the Team Service can run its security check
-            headers = {"Authorization": f"Bearer {current_user.token}"}
-            response = await client.get(team_service_url, headers=headers)
-        
-        # Team service will return 403 Forbidden if the user is not a member
-        if response.status_code == 403:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Not authorized to view tasks for this team."
-            )
-            
-        # This catches 404 Not Found (Team ID doesn't exist) and 5xx errors
-        response.raise_for_status() 
-        
-    except httpx.ConnectError:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Team service is unreachable.")
-    except Exception as e:
-        # Merge 404 Not Found errors into 403 Forbidden
+    # Cached decision, or one call to team_service (see authz_cache.py).
+    # Not found and not a member give the same 403.
+    access = await resolve_team_access(current_user, team_id, http_client)
+    if access == TeamAccess.DENIED:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="The specified team was not found or is inaccessible."
@@ -156,7 +138,8 @@ async def get_task_leader_only(
         raise HTTPException(status_code=400, detail="Invalid task ID format.")
 
     # 2. Find the task in the database
-    task_doc = await db["tasks"].find_one({"_id": obj_id})
+    # (without any embedded comments a not yet migrated task may still carry)
+    task_doc = await db["tasks"].find_one({"_id": obj_id}, projection={"comments": 0})
 
     if not task_doc:
         raise HTTPException(status_code=404, detail="Task not found.")
@@ -182,7 +165,8 @@ async def authorize_comment_deletion(
     task_id: str,
     comment_id: str,
     db: Annotated[AsyncIOMotorDatabase, Depends(get_database)],
-    current_user: Annotated[TokenData, Depends(get_current_user)]
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    http_client: Annotated[httpx.AsyncClient, Depends(get_http_client)]
 ) -> PyObjectId: # Returns the validated task ObjectId
     """
     Authorization check for comment deletion:
@@ -197,17 +181,16 @@ async def authorize_comment_deletion(
         raise HTTPException(status_code=400, detail="Invalid task or comment ID format.")
 
     # 2. Find the Task and Comment
-    task_doc = await db["tasks"].find_one(
-        {"_id": task_obj_id}, 
-        projection={"team_id": 1, "comments": 1}
-    )
+    task_doc = await db["tasks"].find_one({"_id": task_obj_id}, projection=TASK_TEAM_PROJECTION)
     if not task_doc:
         raise HTTPException(status_code=404, detail="Task not found.")
+
+    # Tasks from before the comments collection: move their comments over first
+    if has_embedded_comments(task_doc):
+        await migrate_task_comments(db, task_obj_id)
     
-    comments = task_doc.get("comments", [])
-    
-    # Find the specific comment within the list
-    target_comment = next((c for c in comments if c["_id"] == comment_obj_id), None)
+    # Keyed lookup of the comment, no scan of the task's comments
+    target_comment = await find_comment(db, task_obj_id, comment_obj_id)
     if not target_comment:
         raise HTTPException(status_code=404, detail="Comment not found.")
 
@@ -216,19 +199,12 @@ async def authorize_comment_deletion(
     user_is_admin = current_user.role == Role.ADMIN
     user_is_leader = False
     
-    # Check if the user is the Team Leader (Requires ISC call to Team Service)
+    # Check if the user is the Team Leader (cached, or one call to Team Service)
     team_id = task_doc["team_id"]
-    if current_user.role == Role.TEAM_LEADER:
+    if current_user.role == Role.TEAM_LEADER and not user_is_creator:
         try:
-            team_service_url = f"http://team_service:8002/teams/{team_id}/internal/is-leader/{current_user.username}"
-            async with httpx.AsyncClient() as client:
-                headers = {"Authorization": f"Bearer {current_user.token}"}
-                response = await client.get(team_service_url, headers=headers)
-            
-            # Team Service returns 200 if the user is the leader of that team, 404/403 otherwise
-            if response.status_code == 200 and response.json().get("is_leader"):
-                user_is_leader = True
-        except Exception:
+            user_is_leader = await resolve_team_access(current_user, team_id, http_client) == TeamAccess.LEADER
+        except HTTPException:
             # Service error, assume not authorized for safety
             pass 
 
@@ -239,4 +215,25 @@ async def authorize_comment_deletion(
             detail="You must be the comment creator, the Team Leader, or an Admin to delete this comment."
         )
 
-    return task_obj_id # Return the validated Task ID for deletion
\ No newline at end of file
+    return task_obj_id # Return the validated Task ID for deletion
+
+# --- Service-to-service authentication ---
+# Internal endpoints only accept the short-lived JWTs other services sign with
+# the shared SECRET_KEY and an `svc` claim naming themselves.
+SERVICE_NAMES = {"team_service"}
+
+async def get_service_caller(token: HTTPAuthorizationCredentials = Depends(bearer_scheme)) -> str:
+    if SECRET_KEY is None:
+        raise Exception("SECRET_KEY not set in environment")
+    try:
+        payload = jwt.decode(token.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+
+    service = payload.get("svc")
+    if service not in SERVICE_NAMES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="This endpoint is reserved for internal services"
+        )
+    return service
@@ -0,0 +1,100 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from schemas import TaskPriority, TaskStatus
+from common.ttl_cache import TTLCache
+
+# --- Settings ---
+# Dashboards poll; within this window they share one aggregation per team.
+TASK_STATS_CACHE_TTL_SECONDS = float(os.getenv("TASK_STATS_CACHE_TTL_SECONDS", "30"))
+TASK_STATS_CACHE_MAX_ENTRIES = int(os.getenv("TASK_STATS_CACHE_MAX_ENTRIES", "10000"))
+DUE_SOON_DAYS = 7
+
+# Everything GET /tasks/team/{team_id}/stats returns comes from one
+# aggregation: a $match on team_id (index prefix), a $project down to the
+# four fields we count on, then a $facet with one sub-pipeline per figure.
+# "Overdue" and "due this week" only count tasks that are not DONE.
+
+
+def _utcnow() -> datetime:
+    # Motor gives back naive UTC datetimes, so we compare with naive UTC too
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _stats_pipeline(team_id: str, now: datetime) -> list[dict]:
+    open_tasks = {"status": {"$ne": TaskStatus.DONE.value}}
+    return [
+        {"$match": {"team_id": team_id}},
+        {"$project": {"_id": 0, "status": 1, "priority": 1, "assigned_to": 1, "due_date": 1}},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+            "by_priority": [{"$group": {"_id": "$priority", "count": {"$sum": 1}}}],
+            "by_assignee": [
+                {"$group": {
+                    "_id": "$assigned_to",
+                    "total": {"$sum": 1},
+                    "open": {"$sum": {"$cond": [{"$ne": ["$status", TaskStatus.DONE.value]}, 1, 0]}},
+                }},
+                {"$sort": {"open": -1, "_id": 1}},
+            ],
+            "overdue": [
+                {"$match": {**open_tasks, "due_date": {"$lt": now}}},
+                {"$count": "count"},
+            ],
+            "due_this_week": [
+                {"$match": {**open_tasks, "due_date": {"$gte": now, "$lt": now + timedelta(days=DUE_SOON_DAYS)}}},
+                {"$count": "count"},
+            ],
+        }},
+    ]
+
+
+def _count(facet: list[dict]) -> int:
+    # $count gives [] when nothing matched
+    return facet[0]["count"] if facet else 0
+
+
+async def compute_team_stats(db: AsyncIOMotorDatabase, team_id: str) -> dict:
+    now = _utcnow()
+    result = await db["tasks"].aggregate(_stats_pipeline(team_id, now)).to_list(length=1)
+    facets = result[0]
+    return {
+        "team_id": team_id,
+        "total": _count(facets["total"]),
+        # every status/priority is listed, with 0 when the team has none
+        "by_status": {
+            task_status.value: 0 for task_status in TaskStatus
+        } | {row["_id"]: row["count"] for row in facets["by_status"]},
+        "by_priority": {
+            priority.value: 0 for priority in TaskPriority
+        } | {row["_id"]: row["count"] for row in facets["by_priority"]},
+        "by_assignee": [
+            {"username": row["_id"], "total": row["total"], "open": row["open"]}
+            for row in facets["by_assignee"]
+        ],
+        "overdue": _count(facets["overdue"]),
+        "due_this_week": _count(facets["due_this_week"]),
+        "computed_at": now,
+    }
+
+
+# Bounded LRU of team_id -> stats with a short TTL. Task writes invalidate
+# their team's entry; stats computed while a write happened are not stored.
+task_stats_cache: TTLCache[str, dict] = TTLCache(TASK_STATS_CACHE_MAX_ENTRIES, TASK_STATS_CACHE_TTL_SECONDS)
+
+
+async def get_team_stats(db: AsyncIOMotorDatabase, team_id: str) -> dict:
+    """
+    The team's task stats: cached, or one aggregation.
+    """
+    stats = task_stats_cache.get(team_id)
+    if stats is not None:
+        return stats
+    read_started = time.monotonic()
+    stats = await compute_team_stats(db, team_id)
+    task_stats_cache.put(team_id, stats, read_started)
+    return stats
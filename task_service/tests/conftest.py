@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The service's modules import each other by plain name (uvicorn runs from
+# the service directory), and the shared package lives at the repository root.
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVICE_DIR, os.path.dirname(SERVICE_DIR)]
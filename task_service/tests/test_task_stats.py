@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("motor")
+pytest.importorskip("pydantic")
+from schemas import TaskPriority, TaskStatus
+from task_stats import compute_team_stats
+
+
+class AggregationCursor:
+    def __init__(self, result: list[dict]):
+        self.result = result
+
+    async def to_list(self, length: int) -> list[dict]:
+        return self.result[:length]
+
+
+class TasksDatabase:
+    # Just enough of a motor database for the one $facet aggregation
+    def __init__(self, facets: dict):
+        self.facets = facets
+
+    def __getitem__(self, name: str):
+        assert name == "tasks"
+        return self
+
+    def aggregate(self, pipeline: list[dict]) -> AggregationCursor:
+        return AggregationCursor([self.facets])
+
+
+def make_facets(**overrides) -> dict:
+    facets = {
+        "total": [], "by_status": [], "by_priority": [], "by_assignee": [],
+        "overdue": [], "due_this_week": [],
+    }
+    return facets | overrides
+
+
+def test_every_status_and_priority_is_listed_for_an_empty_team():
+    stats = asyncio.run(compute_team_stats(TasksDatabase(make_facets()), "t"))
+    assert stats["total"] == 0
+    assert stats["by_status"] == {task_status.value: 0 for task_status in TaskStatus}
+    assert stats["by_priority"] == {priority.value: 0 for priority in TaskPriority}
+
+
+def test_counts_fill_in_over_the_zeroes():
+    facets = make_facets(
+        total=[{"count": 3}],
+        by_status=[{"_id": "TODO", "count": 2}, {"_id": "DONE", "count": 1}],
+        by_priority=[{"_id": "URGENT", "count": 3}],
+        by_assignee=[{"_id": "alice", "total": 3, "open": 2}],
+        overdue=[{"count": 1}],
+    )
+    stats = asyncio.run(compute_team_stats(TasksDatabase(facets), "t"))
+    assert stats["by_status"] == {"TODO": 2, "IN_PROGRESS": 0, "DONE": 1}
+    assert stats["by_priority"] == {"LOW": 0, "MEDIUM": 0, "URGENT": 3}
+    assert stats["by_assignee"] == [{"username": "alice", "total": 3, "open": 2}]
+    assert stats["overdue"] == 1
+    assert stats["due_this_week"] == 0
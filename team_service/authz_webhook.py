@@ -0,0 +1,43 @@
+import asyncio
+import os
+from typing import Iterable, Optional
+
+from bson import ObjectId
+
+from common.http_client import get_http_client
+from security import create_service_token
+
+# --- Settings ---
+TASK_AUTHZ_INVALIDATE_URL = "http://task_service:8003/tasks/internal/authz/invalidate"
+AUTHZ_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("AUTHZ_WEBHOOK_TIMEOUT_SECONDS", "2"))
+
+# task_service caches "is X a member/leader of team T" (its authz_cache.py).
+# After a membership or leadership change we tell it to forget the affected
+# decisions. Fire-and-forget: the team write never waits for it, and if the
+# call is lost the cache's max-staleness setting bounds the damage.
+
+_in_flight: set[asyncio.Task] = set()
+
+
+async def _send(team_id: str, usernames: Optional[list[str]]):
+    try:
+        response = await get_http_client().post(
+            TASK_AUTHZ_INVALIDATE_URL,
+            json={"team_id": team_id, "usernames": usernames},
+            headers={"Authorization": f"Bearer {create_service_token()}"},
+            timeout=AUTHZ_WEBHOOK_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+    except Exception as e:
+        print(f"Warning: could not invalidate task_service access decisions for team {team_id}: {e}")
+
+
+def notify_membership_change(team_id: ObjectId, usernames: Optional[Iterable[str]] = None):
+    """
+    Invalidates task_service's cached decisions for these users of the team
+    (every user of the team if `usernames` is None).
+    """
+    task = asyncio.create_task(_send(str(team_id), list(usernames) if usernames is not None else None))
+    # keep a reference until it's done, or the task may be garbage collected
+    _in_flight.add(task)
+    task.add_done_callback(_in_flight.discard)
@@ -20,4 +20,10 @@ def get_database() -> AsyncIOMotorDatabase:
         client = AsyncIOMotorClient(get_mongo_uri())
         
     # "pms_db" is the database name we defined in our .env
-    return client["pms_db"]
\ No newline at end of file
+    return client["pms_db"]
+
+
+async def check_database() -> dict:
+    # The readiness probe's database check (see common/health.py)
+    await get_database().command("ping")
+    return {"ok": True}
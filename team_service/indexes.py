@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+
+from common import indexes as common_indexes
+from memberships import MEMBERSHIPS
+from outbox import OUTBOX
+
+# --- Index declarations ---
+# One entry per query shape we serve. create_indexes() is a no-op for
+# indexes that already exist with the same spec, so this runs on every startup.
+INDEXES = {
+    "teams": [
+        # _is_user_still_leader (count_documents on leader_id) and
+        # list_teams_led_by_user. _id is the pagination key.
+        IndexModel([("leader_id", ASCENDING), ("_id", ASCENDING)], name="leader_id_id"),
+    ],
+    MEMBERSHIPS: [
+        # "is X in team T" and "teams of X, ordered by team_id" (GET /teams/mine)
+        IndexModel([("username", ASCENDING), ("team_id", ASCENDING)], name="username_team_id", unique=True),
+        # all the rows of one team, by username (GET /teams/{id}/members, delete_team)
+        IndexModel([("team_id", ASCENDING), ("username", ASCENDING)], name="team_id_username"),
+    ],
+    OUTBOX: [
+        # the worker's "due events" claims, and the lag metric
+        IndexModel([("next_attempt_at", ASCENDING)], name="next_attempt_at"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+}
+
+# Representative queries (collection, filter, sort) whose plans must use an
+# index; common/tests/test_indexes.py checks them against a real MongoDB.
+QUERY_SHAPES = {
+    "list_teams / teams_mine": (MEMBERSHIPS, {"username": "u"}, [("team_id", 1)]),
+    "get_membership_claims": (MEMBERSHIPS, {"username": "u"}, None),
+    "list_team_members": (MEMBERSHIPS, {"team_id": ObjectId()}, [("username", 1)]),
+    "delete_team_memberships": (MEMBERSHIPS, {"team_id": ObjectId()}, None),
+    "role sync worker": (
+        OUTBOX,
+        {"next_attempt_at": {"$lte": datetime(2000, 1, 1)}, "locked_until": {"$not": {"$gt": datetime(2000, 1, 1)}}},
+        [("next_attempt_at", 1)],
+    ),
+    "_is_user_still_leader": ("teams", {"leader_id": "u"}, None),
+    "list_teams_led_by_user": ("teams", {"leader_id": "u"}, [("_id", 1)]),
+}
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """
+    Creates every declared index (idempotent). Called at startup.
+    """
+    await common_indexes.ensure_indexes(db, INDEXES)
@@ -2,9 +2,20 @@ from dotenv import load_dotenv
 load_dotenv() # This reads the root .env file
 
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from security import get_current_admin_user
 from routes import router as teams_router
+from common.health import start_health_probes, stop_health_probes, get_health_status
+from common.http_client import start_http_client, close_http_client
+from indexes import ensure_indexes
+from memberships import require_transactions
+from migrations import run_migrations
+from outbox import start_outbox_worker, stop_outbox_worker, get_outbox_metrics
+from reconciler import start_reconciler, stop_reconciler, get_reconciler_stats
+from team_cache import team_cache, start_team_change_stream, stop_team_change_stream
+from db import get_database, check_database
 
 app = FastAPI(title="Team Management API", version="0.1.0")
 
@@ -18,6 +29,48 @@ app.add_middleware(
 
 app.include_router(teams_router)
 
+@app.on_event("startup")
+async def on_startup():
+    await require_transactions(get_database())
+    await ensure_indexes(get_database())
+    await run_migrations(get_database())
+    start_http_client()
+    start_health_probes(check_database, {"user_service": "http://user_service:8001/health/live"})
+    start_team_change_stream(get_database())
+    start_outbox_worker(get_database())
+    start_reconciler(get_database())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_reconciler()
+    await stop_outbox_worker()
+    await stop_team_change_stream()
+    await stop_health_probes()
+    await close_http_client()
+
+@app.get("/health/live")
+async def liveness():
+    # the process is up and serving requests; no dependencies are checked
+    return {"status": "alive"}
+
+@app.get("/health/ready")
 @app.get("/health")
-def health():
-    return {"service": "Team Management API", "status": "running"}
\ No newline at end of file
+async def readiness():
+    # cached result of the background probe loop (see common/health.py), never hits MongoDB
+    health_status = get_health_status()
+    return JSONResponse(health_status, status_code=200 if health_status["ready"] else 503)
+
+@app.get("/metrics/team-cache", dependencies=[Depends(get_current_admin_user)])
+async def team_cache_metrics():
+    # hit ratio of the authorization snapshot cache (see team_cache.py)
+    return team_cache.stats()
+
+@app.get("/metrics/outbox", dependencies=[Depends(get_current_admin_user)])
+async def outbox_metrics():
+    # role-sync queue size and lag, plus worker counters (see outbox.py)
+    return await get_outbox_metrics(get_database())
+
+@app.get("/metrics/reconciler", dependencies=[Depends(get_current_admin_user)])
+async def reconciler_metrics():
+    # stats of the last leader-role reconciliation (see reconciler.py)
+    return get_reconciler_stats()
@@ -0,0 +1,299 @@
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorDatabase
+from pymongo import DeleteOne, UpdateOne
+
+from schemas import TeamRole
+from common.team_claims import MEMBERSHIP_VERSIONS, TEAM_CLAIMS_MAX_TEAMS, bump_membership_versions
+
+# --- Settings ---
+# Teams diffed (and fixed) per transaction by repair_memberships
+REPAIR_TEAMS_PER_BATCH = 100
+
+# One row per (username, team_id): {"username", "team_id", "role_in_team"}.
+# It mirrors teams.leader_id / teams.member_ids so that "which teams is X in"
+# and "who is in team T" are index walks, whatever the team sizes (see indexes.py).
+# Rows are written in the same transaction as the teams document; the one-off
+# repair_memberships migration (migrations.py) fixed any drift left from
+# before that was enforced.
+MEMBERSHIPS = "team_memberships"
+
+
+# Every team write goes through run_in_transaction together with its
+# membership rows and role-sync outbox events (outbox.py): they are committed
+# together or not at all. Multi-document transactions need a replica set (the
+# docker-compose MongoDB runs as a single-node one), so the service refuses to
+# start without them instead of silently writing non-atomically.
+
+async def require_transactions(db: AsyncIOMotorDatabase):
+    """
+    Raises at startup when MongoDB can't run multi-document transactions.
+    """
+    hello = await db.client.admin.command("hello")
+    if "setName" not in hello and hello.get("msg") != "isdbgrid":
+        raise RuntimeError(
+            "team_service needs MongoDB transactions: run MongoDB as a replica set "
+            "(see docker-compose.yml) or behind mongos."
+        )
+
+
+async def run_in_transaction(
+    db: AsyncIOMotorDatabase,
+    callback: Callable[[AsyncIOMotorClientSession], Awaitable[Any]],
+) -> Any:
+    """
+    Runs `callback(session)` inside a transaction (retried on transient
+    errors by the driver). Returns what the callback returns.
+    """
+    async with await db.client.start_session() as session:
+        return await session.with_transaction(callback)
+
+
+# -------------- Writes (called next to the matching teams write) -----------------
+# Each one also raises the membership version of the users it touches, which
+# makes their token claims stale (common/team_claims.py).
+
+async def add_members(
+    db: AsyncIOMotorDatabase,
+    team_id: ObjectId,
+    usernames: Iterable[str],
+    role: TeamRole = TeamRole.MEMBER,
+    session: Optional[AsyncIOMotorClientSession] = None,
+):
+    usernames = list(usernames)
+    operations = [
+        UpdateOne(
+            {"username": username, "team_id": team_id},
+            {"$set": {"role_in_team": role}},
+            upsert=True,
+        )
+        for username in usernames
+    ]
+    if operations:
+        await db[MEMBERSHIPS].bulk_write(operations, ordered=False, session=session)
+        await bump_membership_versions(db, usernames, session=session)
+
+
+async def remove_members(
+    db: AsyncIOMotorDatabase,
+    team_id: ObjectId,
+    usernames: Iterable[str],
+    session: Optional[AsyncIOMotorClientSession] = None,
+):
+    usernames = list(usernames)
+    await db[MEMBERSHIPS].delete_many(
+        {"team_id": team_id, "username": {"$in": usernames}},
+        session=session,
+    )
+    await bump_membership_versions(db, usernames, session=session)
+
+
+async def change_leader(
+    db: AsyncIOMotorDatabase,
+    team_id: ObjectId,
+    old_leader: str,
+    new_leader: str,
+    session: Optional[AsyncIOMotorClientSession] = None,
+):
+    # The old leader stays in the team as a plain member
+    await db[MEMBERSHIPS].bulk_write([
+        UpdateOne({"username": old_leader, "team_id": team_id}, {"$set": {"role_in_team": TeamRole.MEMBER}}),
+        UpdateOne({"username": new_leader, "team_id": team_id}, {"$set": {"role_in_team": TeamRole.LEADER}}, upsert=True),
+    ], session=session)
+    await bump_membership_versions(db, [old_leader, new_leader], session=session)
+
+
+async def delete_team_memberships(
+    db: AsyncIOMotorDatabase,
+    team_id: ObjectId,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> list[str]:
+    """
+    Deletes every membership of the team and returns the former members.
+    """
+    usernames = await db[MEMBERSHIPS].distinct("username", {"team_id": team_id}, session=session)
+    await db[MEMBERSHIPS].delete_many({"team_id": team_id}, session=session)
+    await bump_membership_versions(db, usernames, session=session)
+    return usernames
+
+
+# -------------- Reads -----------------
+
+async def find_user_memberships(
+    db: AsyncIOMotorDatabase,
+    username: str,
+    limit: int,
+    after_team_id: Optional[ObjectId] = None,
+) -> list[dict]:
+    """
+    Returns up to `limit` memberships of the user, ordered by team_id.
+    """
+    query = {"username": username}
+    if after_team_id is not None:
+        query["team_id"] = {"$gt": after_team_id}
+    cursor = db[MEMBERSHIPS].find(query, {"_id": 0, "team_id": 1, "role_in_team": 1}).sort("team_id", 1).limit(limit)
+    return await cursor.to_list(length=limit)
+
+
+async def find_team_memberships(
+    db: AsyncIOMotorDatabase,
+    team_id: ObjectId,
+    limit: int,
+    after_username: Optional[str] = None,
+) -> list[dict]:
+    """
+    Returns up to `limit` memberships of the team, ordered by username.
+    """
+    query = {"team_id": team_id}
+    if after_username is not None:
+        query["username"] = {"$gt": after_username}
+    cursor = db[MEMBERSHIPS].find(query, {"_id": 0, "username": 1, "role_in_team": 1}).sort("username", 1).limit(limit)
+    return await cursor.to_list(length=limit)
+
+
+async def find_existing_members(
+    db: AsyncIOMotorDatabase,
+    team_id: ObjectId,
+    usernames: Iterable[str],
+) -> set[str]:
+    """
+    Returns which of `usernames` are members of the team (one $in seek).
+    """
+    cursor = db[MEMBERSHIPS].find(
+        {"team_id": team_id, "username": {"$in": list(usernames)}},
+        {"_id": 0, "username": 1},
+    )
+    return {membership["username"] async for membership in cursor}
+
+
+async def get_membership_claims(db: AsyncIOMotorDatabase, username: str) -> dict:
+    """
+    The membership claims user_service puts in the user's access token:
+    {"v": version, "l": [led team ids], "m": [other team ids]}. Users in more
+    than TEAM_CLAIMS_MAX_TEAMS teams only get "v" (the token stays small and
+    every check falls back to the database).
+    """
+    # The version is read first: a change that lands between the two reads
+    # raises it past the claimed "v", so the claims are never trusted.
+    version_doc = await db[MEMBERSHIP_VERSIONS].find_one({"_id": username})
+    claims = {"v": version_doc["v"] if version_doc else 0}
+
+    cursor = db[MEMBERSHIPS].find({"username": username}, {"_id": 0, "team_id": 1, "role_in_team": 1})
+    memberships = await cursor.limit(TEAM_CLAIMS_MAX_TEAMS + 1).to_list(length=TEAM_CLAIMS_MAX_TEAMS + 1)
+    if len(memberships) <= TEAM_CLAIMS_MAX_TEAMS:
+        claims["l"] = [str(m["team_id"]) for m in memberships if m["role_in_team"] == TeamRole.LEADER]
+        claims["m"] = [str(m["team_id"]) for m in memberships if m["role_in_team"] != TeamRole.LEADER]
+    return claims
+
+
+# -------------- Backfill and repair -----------------
+
+def _expected_memberships(teams: list[dict]) -> dict[tuple[str, ObjectId], TeamRole]:
+    # (username, team_id) -> role, as the teams documents say
+    expected = {}
+    for team in teams:
+        for username in set(team.get("member_ids", [])) | {team["leader_id"]}:
+            role = TeamRole.LEADER if username == team["leader_id"] else TeamRole.MEMBER
+            expected[(username, team["_id"])] = role
+    return expected
+
+
+async def _repair_team_batch(
+    db: AsyncIOMotorDatabase,
+    after_id: Optional[ObjectId],
+    session: AsyncIOMotorClientSession,
+) -> tuple[Optional[ObjectId], int]:
+    # Diffs the rows of the next REPAIR_TEAMS_PER_BATCH teams and fixes them.
+    # Returns (last team _id or None when done, number of rows fixed).
+    query = {} if after_id is None else {"_id": {"$gt": after_id}}
+    teams = await db["teams"].find(query, {"leader_id": 1, "member_ids": 1}, session=session) \
+        .sort("_id", 1).limit(REPAIR_TEAMS_PER_BATCH).to_list(length=REPAIR_TEAMS_PER_BATCH)
+    if not teams:
+        return None, 0
+
+    expected = _expected_memberships(teams)
+    rows = db[MEMBERSHIPS].find(
+        {"team_id": {"$in": [team["_id"] for team in teams]}},
+        {"username": 1, "team_id": 1, "role_in_team": 1},
+        session=session,
+    )
+    actual = {(row["username"], row["team_id"]): row async for row in rows}
+
+    operations, touched = [], set()
+    for (username, team_id), role in expected.items():
+        row = actual.get((username, team_id))
+        if row is None or row["role_in_team"] != role:
+            operations.append(UpdateOne(
+                {"username": username, "team_id": team_id},
+                {"$set": {"role_in_team": role}},
+                upsert=True,
+            ))
+            touched.add(username)
+    for (username, team_id), row in actual.items():
+        if (username, team_id) not in expected:
+            operations.append(DeleteOne({"_id": row["_id"]}))
+            touched.add(username)
+
+    if operations:
+        await db[MEMBERSHIPS].bulk_write(operations, ordered=False, session=session)
+        await bump_membership_versions(db, touched, session=session)
+    return teams[-1]["_id"], len(operations)
+
+
+async def _delete_orphan_batch(
+    db: AsyncIOMotorDatabase,
+    team_ids: list[ObjectId],
+    session: AsyncIOMotorClientSession,
+) -> int:
+    # Deletes the rows of those teams that no longer exist
+    existing = {team["_id"] async for team in db["teams"].find({"_id": {"$in": team_ids}}, {"_id": 1}, session=session)}
+    deleted = 0
+    for team_id in team_ids:
+        if team_id not in existing:
+            deleted += len(await delete_team_memberships(db, team_id, session=session))
+    return deleted
+
+
+async def repair_memberships(db: AsyncIOMotorDatabase):
+    """
+    Diffs the memberships collection against the teams collection and fixes
+    any drift: missing rows, wrong roles, rows of users no longer in the team
+    and rows of deleted teams. On an empty collection this is the backfill.
+    Runs once, as a migration (migrations.py). Each batch is read and fixed in its own transaction, so
+    a concurrent team write either lands before the batch's snapshot or makes
+    the batch retry; the repair never undoes it.
+    """
+    fixed, after_id = 0, None
+    while True:
+        after_id, count = await run_in_transaction(
+            db, lambda session: _repair_team_batch(db, after_id, session)
+        )
+        fixed += count
+        if after_id is None:
+            break
+
+    orphans, team_ids = 0, []
+    async for row in db[MEMBERSHIPS].aggregate([{"$group": {"_id": "$team_id"}}]):
+        team_ids.append(row["_id"])
+        if len(team_ids) >= REPAIR_TEAMS_PER_BATCH:
+            batch, team_ids = team_ids, []
+            orphans += await run_in_transaction(db, lambda session: _delete_orphan_batch(db, batch, session))
+    if team_ids:
+        orphans += await run_in_transaction(db, lambda session: _delete_orphan_batch(db, team_ids, session))
+
+    if fixed or orphans:
+        print(f"Repaired team memberships: {fixed} rows fixed, {orphans} rows of deleted teams removed.")
+
+
+async def backfill_member_counts(db: AsyncIOMotorDatabase):
+    """
+    Sets teams.member_count on teams created before it existed.
+    Later writes keep it up to date with $inc.
+    """
+    result = await db["teams"].update_many(
+        {"member_count": {"$exists": False}},
+        [{"$set": {"member_count": {"$size": {"$ifNull": ["$member_ids", []]}}}}],
+    )
+    if result.modified_count:
+        print(f"Backfilled member_count on {result.modified_count} teams.")
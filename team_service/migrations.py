@@ -0,0 +1,74 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+from memberships import backfill_member_counts, repair_memberships
+
+# --- Settings ---
+# How long a worker may hold a migration before another one may take it over
+# (e.g. after a crash halfway through).
+MIGRATION_LEASE_SECONDS = int(os.getenv("MIGRATION_LEASE_SECONDS", "600"))
+
+# One-off data migrations, run at startup by whichever worker claims them
+# first. Each leaves a marker document {"_id": name, "done_at"} behind, so
+# later starts (and the other workers/replicas) skip it with one lookup.
+# Deleting the marker makes the next start run the migration again.
+MIGRATIONS = "migrations"
+
+MIGRATION_STEPS: list[tuple[str, Callable[[AsyncIOMotorDatabase], Awaitable[None]]]] = [
+    ("team_memberships_repair_v1", repair_memberships),
+    ("teams_member_count_v1", backfill_member_counts),
+]
+
+
+async def _claim(db: AsyncIOMotorDatabase, name: str) -> bool:
+    # Takes the lease unless the migration is done or another worker holds it.
+    # A marker that doesn't match the filter makes the upsert hit the _id
+    # unique index, which is how we learn someone else has it.
+    now = datetime.now(timezone.utc)
+    try:
+        await db[MIGRATIONS].find_one_and_update(
+            {
+                "_id": name,
+                "done_at": {"$exists": False},
+                "$or": [{"locked_until": {"$exists": False}}, {"locked_until": {"$lt": now}}],
+            },
+            {"$set": {"locked_until": now + timedelta(seconds=MIGRATION_LEASE_SECONDS)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def run_migration(
+    db: AsyncIOMotorDatabase,
+    name: str,
+    migration: Callable[[AsyncIOMotorDatabase], Awaitable[None]],
+) -> bool:
+    """
+    Runs the migration unless it already ran (or is running elsewhere).
+    Returns whether this worker ran it.
+    """
+    if not await _claim(db, name):
+        return False
+    try:
+        await migration(db)
+    except Exception:
+        # Give the lease back so the next start retries
+        await db[MIGRATIONS].update_one({"_id": name}, {"$unset": {"locked_until": ""}})
+        raise
+    await db[MIGRATIONS].update_one(
+        {"_id": name},
+        {"$set": {"done_at": datetime.now(timezone.utc)}, "$unset": {"locked_until": ""}},
+    )
+    print(f"Migration '{name}' done.")
+    return True
+
+
+async def run_migrations(db: AsyncIOMotorDatabase):
+    for name, migration in MIGRATION_STEPS:
+        await run_migration(db, name, migration)
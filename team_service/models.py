@@ -33,7 +33,9 @@ class Team(BaseModel):
     description: Optional[str] = None
     leader_id: str = Field(...) # We'll store the User's username (from the token)
     member_ids: List[str] = Field(default_factory=list)
+    member_count: int = 0 # len(member_ids), kept by the write routes
     created_at: datetime = Field(default_factory=datetime.now)
+    version: int = 0 # Bumped on every write; see team_cache.py
 
     class Config:
         populate_by_name = True # Allows using _id
@@ -0,0 +1,268 @@
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+import httpx
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorDatabase
+
+from common.http_client import get_http_client
+from schemas import Role
+from security import create_service_token
+
+# --- Settings ---
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "1"))
+OUTBOX_BASE_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BASE_BACKOFF_SECONDS", "2"))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "300"))
+# After this many failed attempts an event is dead-lettered: it is only
+# retried every OUTBOX_DEAD_RETRY_SECONDS from then on
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_DEAD_RETRY_SECONDS = float(os.getenv("OUTBOX_DEAD_RETRY_SECONDS", "3600"))
+# How long a worker owns the events it claimed; longer than a user_service call
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+
+USER_ROLES_URL = "http://user_service:8001/users/internal/roles"
+
+# Leadership changes are recorded here, in the same transaction as the team
+# write (memberships.run_in_transaction, which the service requires), instead
+# of PATCHing user_service on the request path. One document per user whose
+# role may have to change:
+# {"username", "created_at", "next_attempt_at", "attempts", "last_error",
+#  "locked_until", "locked_by", "dead_at"}.
+#
+# A worker claims each due event with find_one_and_update, which sets a lease
+# (`locked_until`, `locked_by`); other workers and replicas skip leased
+# events, and a crashed worker's lease simply runs out. Fresh events are sent
+# in one call; an event that failed before goes in the same pass but in a
+# call of its own (one user), so a user that user_service keeps rejecting
+# can't hold back the others. After OUTBOX_MAX_ATTEMPTS failures it is
+# dead-lettered: `dead_at` is set (shown in /metrics/outbox) and it is only
+# retried every OUTBOX_DEAD_RETRY_SECONDS, so a long user_service outage
+# delays role syncs but never drops them.
+#
+# The worker does not replay what the request wanted: it recomputes each
+# user's role from the teams collection at processing time (leader of any
+# team -> team_leader, otherwise member). Processing an event twice, late,
+# or out of order therefore converges on the same result.
+OUTBOX = "role_sync_outbox"
+# Events the worker will still process (dead-lettered ones included)
+PENDING = {"next_attempt_at": {"$exists": True}}
+
+
+def _utcnow() -> datetime:
+    # Motor gives back naive UTC datetimes, so we store naive UTC too
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def enqueue_role_sync(
+    db: AsyncIOMotorDatabase,
+    usernames: Iterable[str],
+    session: Optional[AsyncIOMotorClientSession] = None,
+):
+    """
+    Records that the role of these users must be re-synced. Call it inside
+    the team write's transaction, then wake_outbox_worker() after it commits.
+    """
+    now = _utcnow()
+    events = [
+        {"username": username, "created_at": now, "next_attempt_at": now, "attempts": 0}
+        for username in dict.fromkeys(usernames)
+    ]
+    if events:
+        await db[OUTBOX].insert_many(events, session=session)
+
+
+# -------------- Worker -----------------
+
+class OutboxMetrics:
+    def __init__(self):
+        self.events_processed = 0
+        self.users_synced = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+        self.last_batch_ms = 0.0
+        self.last_error: str | None = None
+
+    def snapshot(self) -> dict:
+        return {
+            "events_processed": self.events_processed,
+            "users_synced": self.users_synced,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "dead_lettered": self.dead_lettered,
+            "last_batch_ms": round(self.last_batch_ms, 2),
+            "last_error": self.last_error,
+        }
+
+
+_metrics = OutboxMetrics()
+_wakeup = asyncio.Event()
+_worker_task: asyncio.Task | None = None
+
+
+def wake_outbox_worker():
+    _wakeup.set()
+
+
+def _backoff_seconds(attempts: int) -> float:
+    # Exponential, capped, with jitter so failed batches don't retry in lockstep
+    delay = min(OUTBOX_BASE_BACKOFF_SECONDS * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def _desired_roles(db: AsyncIOMotorDatabase, usernames: list[str]) -> dict[str, str]:
+    # One distinct() on the leader_id index for the whole batch
+    leaders = set(await db["teams"].distinct("leader_id", {"leader_id": {"$in": usernames}}))
+    return {username: Role.TEAM_LEADER if username in leaders else Role.MEMBER for username in usernames}
+
+
+def _due(now: datetime) -> dict:
+    # Due and not leased by a worker ($not also matches a missing locked_until)
+    return {"next_attempt_at": {"$lte": now}, "locked_until": {"$not": {"$gt": now}}}
+
+
+async def _claim_due_events(db: AsyncIOMotorDatabase, now: datetime) -> tuple[ObjectId, list[dict]]:
+    # Leases up to OUTBOX_BATCH_SIZE due events, oldest first, one atomic
+    # find_one_and_update each. Returns the lease id and the claimed events.
+    lease_id = ObjectId()
+    lease = {"locked_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS), "locked_by": lease_id}
+    events = []
+    while len(events) < OUTBOX_BATCH_SIZE:
+        event = await db[OUTBOX].find_one_and_update(
+            _due(now),
+            {"$set": lease},
+            projection={"username": 1, "attempts": 1},
+            sort=[("next_attempt_at", 1)],
+        )
+        if event is None:
+            break
+        events.append(event)
+    return lease_id, events
+
+
+async def _sync_events(
+    db: AsyncIOMotorDatabase,
+    http_client: httpx.AsyncClient,
+    lease_id: ObjectId,
+    events: list[dict],
+    now: datetime,
+) -> int:
+    # One user_service call for these (claimed) events. Returns how many were done.
+    event_ids = [event["_id"] for event in events]
+    usernames = list(dict.fromkeys(event["username"] for event in events))
+    started = time.perf_counter()
+
+    try:
+        roles = await _desired_roles(db, usernames)
+        response = await http_client.post(
+            USER_ROLES_URL,
+            json={"roles": [{"username": username, "role": role} for username, role in roles.items()]},
+            headers={"Authorization": f"Bearer {create_service_token()}"},
+        )
+        response.raise_for_status()
+    except Exception as e:
+        attempts = max(event.get("attempts", 0) for event in events) + 1
+        error = f"{type(e).__name__}: {e}"
+        update = {
+            "$inc": {"attempts": 1},
+            "$set": {"last_error": error},
+            "$unset": {"locked_until": "", "locked_by": ""},
+        }
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            update["$set"]["next_attempt_at"] = now + timedelta(seconds=OUTBOX_DEAD_RETRY_SECONDS)
+            update["$min"] = {"dead_at": now}
+            if attempts == OUTBOX_MAX_ATTEMPTS:
+                _metrics.dead_lettered += len(events)
+                print(f"Warning: role sync of {', '.join(usernames)} dead-lettered after {attempts} attempts: {error}")
+        else:
+            update["$set"]["next_attempt_at"] = now + timedelta(seconds=_backoff_seconds(attempts))
+            print(f"Warning: role sync of {len(usernames)} users failed (attempt {attempts}): {error}")
+        await db[OUTBOX].update_many({"_id": {"$in": event_ids}, "locked_by": lease_id}, update)
+        _metrics.failed_batches += 1
+        _metrics.last_error = error
+        return 0
+
+    # Users that no longer exist ("not_found") are done as well
+    await db[OUTBOX].delete_many({"_id": {"$in": event_ids}, "locked_by": lease_id})
+    _metrics.batches += 1
+    _metrics.events_processed += len(events)
+    _metrics.users_synced += len(usernames)
+    _metrics.last_batch_ms = (time.perf_counter() - started) * 1000
+    return len(events)
+
+
+async def process_outbox_batch(db: AsyncIOMotorDatabase, http_client: httpx.AsyncClient) -> int:
+    """
+    Claims up to OUTBOX_BATCH_SIZE due events and syncs their users' roles:
+    the fresh events with a single user_service call, every retried user with
+    a call of its own. Returns how many events were claimed.
+    """
+    now = _utcnow()
+    lease_id, events = await _claim_due_events(db, now)
+
+    fresh = [event for event in events if not event.get("attempts")]
+    retried: dict[str, list[dict]] = {}
+    for event in events:
+        if event.get("attempts"):
+            retried.setdefault(event["username"], []).append(event)
+
+    for group in ([fresh] if fresh else []) + list(retried.values()):
+        await _sync_events(db, http_client, lease_id, group, now)
+    return len(events)
+
+
+async def _worker_loop(db: AsyncIOMotorDatabase):
+    while True:
+        try:
+            processed = await process_outbox_batch(db, get_http_client())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Warning: role sync worker error: {e}")
+            processed = 0
+
+        # A full batch means there is probably more to do right away
+        if processed < OUTBOX_BATCH_SIZE:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+def start_outbox_worker(db: AsyncIOMotorDatabase):
+    global _worker_task
+    if _worker_task is None:
+        _worker_task = asyncio.create_task(_worker_loop(db))
+
+
+async def stop_outbox_worker():
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+async def get_outbox_metrics(db: AsyncIOMotorDatabase) -> dict:
+    """
+    Queue size and lag (age of the oldest pending event) plus worker counters.
+    """
+    now = _utcnow()
+    oldest = await db[OUTBOX].find_one(PENDING, {"created_at": 1}, sort=[("created_at", 1)])
+    return {
+        "pending": await db[OUTBOX].count_documents({**PENDING, "dead_at": {"$exists": False}}),
+        "due": await db[OUTBOX].count_documents(_due(now)),
+        "dead": await db[OUTBOX].count_documents({"dead_at": {"$exists": True}}),
+        "lag_seconds": round((now - oldest["created_at"]).total_seconds(), 3) if oldest else 0.0,
+        "worker_running": _worker_task is not None and not _worker_task.done(),
+        **_metrics.snapshot(),
+    }
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from common.http_client import get_http_client
+from outbox import OUTBOX, PENDING, enqueue_role_sync, wake_outbox_worker
+from schemas import Role
+from security import create_service_token
+
+# --- Settings ---
+# 0 disables the periodic run; it can still be triggered by an admin.
+RECONCILER_INTERVAL_SECONDS = float(os.getenv("RECONCILER_INTERVAL_SECONDS", "0"))
+RECONCILER_DRY_RUN = os.getenv("RECONCILER_DRY_RUN", "false").lower() in ("1", "true", "yes")
+# Users per user_service call; user_service accepts at most 500
+USER_SERVICE_MAX_BATCH = 500
+RECONCILER_BATCH_SIZE = max(1, min(int(os.getenv("RECONCILER_BATCH_SIZE", "500")), USER_SERVICE_MAX_BATCH))
+
+USERS_URL = "http://user_service:8001/users"
+USERS_BATCH_URL = "http://user_service:8001/users/batch"
+
+# Repairs drift between teams.leader_id and users.role, whatever its cause:
+#   leaders      = every distinct teams.leader_id (one $group aggregation)
+#   role_holders = every user whose role is team_leader (paged from user_service)
+#   leaders - role_holders -> promote (unless admin or gone)
+#   role_holders - leaders -> demote
+# Users with a pending outbox event are left to the outbox worker.
+# Everything is read in batches; no per-user request is made.
+#
+# The reconciler never writes roles itself. The reads above are not a
+# snapshot (a leader may be assigned, and its outbox event drained, while we
+# page through user_service), so acting on the diff directly could demote a
+# real leader. Instead every drifted user gets an outbox event: the worker
+# recomputes the role from the teams collection when it processes it, and
+# stays the only writer of roles.
+
+_lock = asyncio.Lock()
+_loop_task: asyncio.Task | None = None
+_last_run: dict | None = None
+_runs = 0
+
+
+def _service_headers() -> dict:
+    # A fresh token per call: a long run may outlive one token
+    return {"Authorization": f"Bearer {create_service_token()}"}
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def _stream_leaders(db: AsyncIOMotorDatabase) -> AsyncIterator[str]:
+    async for row in db["teams"].aggregate([{"$group": {"_id": "$leader_id"}}], allowDiskUse=True):
+        yield row["_id"]
+
+
+async def _stream_role_holders(http_client: httpx.AsyncClient) -> AsyncIterator[str]:
+    # Keyset pagination over GET /users, only the username column
+    after = None
+    while True:
+        params = {"role": Role.TEAM_LEADER.value, "fields": "username", "limit": RECONCILER_BATCH_SIZE}
+        if after is not None:
+            params["after"] = after
+        response = await http_client.get(USERS_URL, params=params, headers=_service_headers())
+        response.raise_for_status()
+        page = response.json()
+        for item in page["items"]:
+            yield item["username"]
+        after = page["next_after"]
+        if after is None:
+            return
+
+
+async def _promotable(http_client: httpx.AsyncClient, candidates: list[str]) -> list[str]:
+    # Drops admins and users that no longer exist, one POST /users/batch per chunk
+    promotable = []
+    for chunk in _chunks(candidates, RECONCILER_BATCH_SIZE):
+        response = await http_client.post(USERS_BATCH_URL, json={"usernames": chunk}, headers=_service_headers())
+        response.raise_for_status()
+        promotable += [
+            user["username"] for user in response.json()["users"]
+            if user["exists"] and user["role"] != Role.ADMIN
+        ]
+    return promotable
+
+
+async def reconcile_roles(db: AsyncIOMotorDatabase, dry_run: bool) -> dict:
+    """
+    Runs one reconciliation and returns its stats. With dry_run the diff is
+    computed and reported but nothing is enqueued.
+    """
+    global _last_run, _runs
+    async with _lock:
+        http_client = get_http_client()
+        started = time.perf_counter()
+
+        leaders = {username async for username in _stream_leaders(db)}
+        role_holders = {username async for username in _stream_role_holders(http_client)}
+        pending = set(await db[OUTBOX].distinct("username", PENDING))
+        read_done = time.perf_counter()
+
+        to_promote = await _promotable(http_client, sorted(leaders - role_holders - pending))
+        to_demote = sorted(role_holders - leaders - pending)
+
+        enqueued = 0
+        if not dry_run:
+            for chunk in _chunks(to_promote + to_demote, RECONCILER_BATCH_SIZE):
+                await enqueue_role_sync(db, chunk)
+                enqueued += len(chunk)
+            if enqueued:
+                wake_outbox_worker()
+
+        elapsed = time.perf_counter() - started
+        users_seen = len(leaders | role_holders)
+        _runs += 1
+        _last_run = {
+            "dry_run": dry_run,
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "leaders": len(leaders),
+            "team_leader_users": len(role_holders),
+            "skipped_pending_outbox": len((leaders ^ role_holders) & pending),
+            "to_promote": len(to_promote),
+            "to_demote": len(to_demote),
+            # a sample, so a dry run shows *who* would change
+            "sample_promote": to_promote[:20],
+            "sample_demote": to_demote[:20],
+            # handed to the outbox worker, which re-checks each user before writing
+            "enqueued": enqueued,
+            "read_seconds": round(read_done - started, 3),
+            "total_seconds": round(elapsed, 3),
+            "users_per_second": round(users_seen / elapsed, 1) if elapsed else 0.0,
+        }
+        return _last_run
+
+
+def reconciler_running() -> bool:
+    return _lock.locked()
+
+
+def get_reconciler_stats() -> dict:
+    return {
+        "interval_seconds": RECONCILER_INTERVAL_SECONDS,
+        "default_dry_run": RECONCILER_DRY_RUN,
+        "running": reconciler_running(),
+        "runs": _runs,
+        "last_run": _last_run,
+    }
+
+
+async def _reconciler_loop(db: AsyncIOMotorDatabase):
+    while True:
+        await asyncio.sleep(RECONCILER_INTERVAL_SECONDS)
+        try:
+            stats = await reconcile_roles(db, RECONCILER_DRY_RUN)
+            print(
+                f"Role reconciler: {stats['to_promote']} to promote, {stats['to_demote']} to demote "
+                f"({'dry run' if stats['dry_run'] else 'enqueued'}) in {stats['total_seconds']}s."
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Warning: role reconciler failed: {e}")
+
+
+def start_reconciler(db: AsyncIOMotorDatabase):
+    global _loop_task
+    if RECONCILER_INTERVAL_SECONDS > 0 and _loop_task is None:
+        _loop_task = asyncio.create_task(_reconciler_loop(db))
+
+
+async def stop_reconciler():
+    global _loop_task
+    if _loop_task is not None:
+        _loop_task.cancel()
+        try:
+            await _loop_task
+        except asyncio.CancelledError:
+            pass
+        _loop_task = None
@@ -1,35 +1,228 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
+from pymongo import ReturnDocument
+from typing import Optional
 
 from db import get_database
-from schemas import TeamCreate, TeamOut, TokenData, Role, TeamUpdate, MemberAdd, LeaderAssign
+from common.http_client import get_http_client
+from common.pagination import encode_cursor, decode_cursor
+from schemas import (
+    TeamCreate, TeamOut, TeamPage, TeamMember, TeamMemberPage, TokenData, Role, TeamRole,
+    TeamUpdate, MemberAdd, MemberBatch, MemberBatchStatus, MemberBatchResult, MemberBatchReport,
+    LeaderAssign,
+)
 from models import Team
-from security import get_current_user, get_current_admin_user, get_team_leader_or_admin, get_team_leader_only, get_team_access_or_admin
+from security import (
+    get_current_user, get_current_admin_user, get_team_access_or_admin, get_team_leader_only,
+    check_team_access, get_service_caller,
+)
+from team_cache import TeamSnapshot, team_cache, get_team_snapshot, remember_membership
+from memberships import (
+    run_in_transaction, add_members, remove_members, change_leader,
+    delete_team_memberships, find_user_memberships, find_team_memberships, find_existing_members,
+    get_membership_claims,
+)
+from outbox import enqueue_role_sync, wake_outbox_worker
+from reconciler import reconcile_roles, reconciler_running
+from authz_webhook import notify_membership_change
 from bson import ObjectId # For querying by ID
 import httpx
+import time
 
 router = APIRouter(prefix="/teams", tags=["teams"])
 
+# --- Write helpers ---
+# Write routes fold the authorization predicate into the update filter and use
+# find_one_and_update, so a successful write costs a single round trip. Only
+# when nothing matched do we look again, to tell the caller why.
+# Every write bumps the team's `version` and invalidates its cached
+# authorization snapshot (see team_cache.py). Membership changes are mirrored
+# into the team_memberships collection in the same transaction (memberships.py).
+# Leadership changes also write a role-sync event to the outbox in that
+# transaction; a background worker updates the roles in user_service (outbox.py).
+# Membership changes also tell task_service to drop its cached access
+# decisions for the affected users (authz_webhook.py).
+
+def _parse_team_id(team_id: str) -> ObjectId:
+    try:
+        return ObjectId(team_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid team ID format")
+
+def _reject_admin(current_user: TokenData):
+    # Same business rule as security.get_team_leader_only
+    if current_user.role == Role.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin users cannot manage team members directly; this is a Team Leader function."
+        )
+
+def _team_out(team_doc: dict, include_members: bool = False) -> TeamOut:
+    if not include_members:
+        team_doc = {key: value for key, value in team_doc.items() if key != "member_ids"}
+    return TeamOut(id=str(team_doc["_id"]), **team_doc)
+
+# --- Listing helpers ---
+# Team responses leave out member_ids (member_count is always there) unless the
+# caller asks for them with ?include=members: large teams make it heavy.
+# The full member list is served page by page by GET /teams/{id}/members.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+SLIM_PROJECTION = {"member_ids": 0}
+
+def _projection_with_member(username: str) -> dict:
+    # Every stored field we return, plus at most `username`'s own entry of
+    # member_ids ($elemMatch), enough to tell whether they are a member.
+    projection = {key: 1 for key in ("name", "description", "leader_id", "created_at", "member_count", "version")}
+    projection["member_ids"] = {"$elemMatch": {"$eq": username}}
+    return projection
+
+def _wants_members(include: Optional[str]) -> bool:
+    return include is not None and "members" in [part.strip() for part in include.split(",")]
+
+async def _find_team_page(
+    db: AsyncIOMotorDatabase,
+    query: dict,
+    limit: int,
+    cursor: Optional[str],
+    include: Optional[str],
+) -> TeamPage:
+    """
+    Runs `query` on the teams collection and returns one page sorted by _id.
+    """
+    if cursor:
+        try:
+            after_id = ObjectId(decode_cursor(cursor)[0])
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = {"$and": [query, {"_id": {"$gt": after_id}}]} if query else {"_id": {"$gt": after_id}}
+
+    projection = None if _wants_members(include) else SLIM_PROJECTION
+
+    # Fetch one extra document to know whether there is a next page
+    teams_cursor = db["teams"].find(query, projection).sort("_id", 1).limit(limit + 1)
+    teams = await teams_cursor.to_list(length=limit + 1)
+
+    next_cursor = encode_cursor([str(teams[limit - 1]["_id"])]) if len(teams) > limit else None
+    return TeamPage(
+        items=[TeamOut(id=str(team["_id"]), **team) for team in teams[:limit]],
+        next_cursor=next_cursor,
+    )
+
+async def _find_my_team_page(
+    db: AsyncIOMotorDatabase,
+    username: str,
+    limit: int,
+    cursor: Optional[str],
+    include: Optional[str],
+) -> TeamPage:
+    """
+    One page of the teams `username` belongs to, sorted by team _id.
+    Walks the memberships index instead of an $or over leader_id/member_ids.
+    """
+    after_team_id = None
+    if cursor:
+        try:
+            after_team_id = ObjectId(decode_cursor(cursor)[0])
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # Fetch one extra membership to know whether there is a next page
+    memberships = await find_user_memberships(db, username, limit + 1, after_team_id)
+    page = memberships[:limit]
+
+    projection = None if _wants_members(include) else SLIM_PROJECTION
+    teams_cursor = db["teams"].find({"_id": {"$in": [m["team_id"] for m in page]}}, projection)
+    teams_by_id = {team["_id"]: team for team in await teams_cursor.to_list(length=len(page))}
+
+    next_cursor = encode_cursor([str(page[-1]["team_id"])]) if len(memberships) > limit else None
+    return TeamPage(
+        items=[
+            TeamOut(id=str(m["team_id"]), role_in_team=m["role_in_team"], **teams_by_id[m["team_id"]])
+            for m in page if m["team_id"] in teams_by_id
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+# Declared before /{team_id} so that "mine" is not taken for a team id
+@router.get("/mine", response_model=TeamPage)
+async def list_my_teams(
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    current_user: TokenData = Depends(get_current_user),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include: Optional[str] = Query(None, description="Set to 'members' to embed member_ids"),
+):
+    """
+    The teams the current user belongs to, with their role in each one.
+    """
+    return await _find_my_team_page(db, current_user.username, limit, cursor, include)
+
+
 @router.get("/{team_id}", response_model=TeamOut)
 async def get_team_details(
-    team_id: str, # We need this for the new dependency
-    db: AsyncIOMotorDatabase = Depends(get_database), # We need to re-add this dependency
-    # CHANGE THIS DEPENDENCY:
-    team: Team = Depends(get_team_access_or_admin) # <-- NEW VIEW ACCESS CHECK
+    team_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    current_user: TokenData = Depends(get_current_user),
+    include: Optional[str] = Query(None, description="Set to 'members' to embed member_ids"),
 ):
     """
     (Admin or Member of Team Only) Get details for a single team.
     """
-    # ... (rest of the function remains the same, as the dependency returns the team object)
-    team_data = team.model_dump(by_alias=True)
-    return TeamOut(id=str(team_data["_id"]), **team_data)
+    obj_id = _parse_team_id(team_id)
+    include_members = _wants_members(include)
+
+    # The access check runs on the document we return (one round trip). Unless
+    # the members were asked for, $elemMatch brings back at most the caller's
+    # own entry of member_ids, which is all the check needs.
+    projection = None if include_members else _projection_with_member(current_user.username)
+
+    read_started = time.monotonic()
+    team_doc = await db["teams"].find_one({"_id": obj_id}, projection=projection)
+    team = TeamSnapshot.from_doc(team_doc) if team_doc else None
+    is_member = team_doc is not None and current_user.username in team_doc.get("member_ids", [])
+    if team is not None:
+        remember_membership(team, current_user.username, is_member, read_started)
+
+    check_team_access(current_user, team, is_member) # <-- VIEW ACCESS CHECK
+    return _team_out(team_doc, include_members)
+
+@router.get("/{team_id}/members", response_model=TeamMemberPage)
+async def list_team_members(
+    team_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    team: TeamSnapshot = Depends(get_team_access_or_admin),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """
+    (Admin or Member of Team Only)
+    The members of a team with their role in it, one page at a time (by username).
+    """
+    after_username = None
+    if cursor:
+        values = decode_cursor(cursor)
+        # a one-element list holding the last username of the previous page
+        if len(values) != 1 or not isinstance(values[0], str):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        after_username = values[0]
+
+    # Fetch one extra membership to know whether there is a next page
+    memberships = await find_team_memberships(db, team.team_id, limit + 1, after_username)
+
+    next_cursor = encode_cursor([memberships[limit - 1]["username"]]) if len(memberships) > limit else None
+    return TeamMemberPage(
+        items=[TeamMember(**membership) for membership in memberships[:limit]],
+        next_cursor=next_cursor,
+    )
 
 @router.post("", response_model=TeamOut, status_code=status.HTTP_201_CREATED)
 async def create_team(
     team_data: TeamCreate,
     db: AsyncIOMotorDatabase = Depends(get_database),
-    admin_user: TokenData = Depends(get_current_admin_user)
+    admin_user: TokenData = Depends(get_current_admin_user),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     (Admin Only) Create a new team.
@@ -42,12 +235,11 @@ async def create_team(
     user_service_url = f"http://user_service:8001/users/{new_leader_username}"
     
     try:
-        async with httpx.AsyncClient() as client:
-            # We need to send our *own* admin token to prove we can access this
-            auth_header = f"Bearer {admin_user.token}" # <-- We need to add this!
-            headers = {"Authorization": auth_header}
-            
-            response = await client.get(user_service_url, headers=headers)
+        # We need to send our *own* admin token to prove we can access this
+        auth_header = f"Bearer {admin_user.token}" # <-- We need to add this!
+        headers = {"Authorization": auth_header}
+
+        response = await http_client.get(user_service_url, headers=headers)
         
         if response.status_code == 404:
             raise HTTPException(status_code=404, detail="Team Leader username not found.")
@@ -64,57 +256,45 @@ async def create_team(
         name=team_data.name,
         description=team_data.description,
         leader_id=user_data["username"], # Use the verified username
-        member_ids=[user_data["username"]] # The leader is also a member
+        member_ids=[user_data["username"]], # The leader is also a member
+        member_count=1
     )
-    result = await db["teams"].insert_one(new_team.model_dump(by_alias=True))
-    
+    new_team_doc = new_team.model_dump(by_alias=True)
+
     # --- 3. Implement Your Plan (Point 1 & 2) ---
-    # Now, promote the user to "team_leader" in the user_service
-    # (It's safe to do this even if they are already a leader)
-    if user_data.get("role") != Role.ADMIN: # <-- THE NEW SAFETY CHECK
-        promote_url = f"http://user_service:8001/users/{new_leader_username}/role"
-        role_payload = {"role": "team_leader"}
-        
-        try:
-            async with httpx.AsyncClient() as client:
-                headers = {"Authorization": f"Bearer {admin_user.token}"} # Use admin token
-                await client.patch(promote_url, json=role_payload, headers=headers)
-                
-        except Exception:
-            # If this fails, we can just log it. The team is created,
-            # but the role wasn't updated.
-            print(f"Warning: Could not promote user {new_leader_username} in user_service.")
+    # The promotion to "team_leader" is queued in the same transaction and
+    # applied by the outbox worker (which never touches admins).
+    async def write(session):
+        await db["teams"].insert_one(new_team_doc, session=session)
+        await add_members(db, new_team_doc["_id"], [new_team.leader_id], TeamRole.LEADER, session=session)
+        await enqueue_role_sync(db, [new_team.leader_id], session=session)
+
+    await run_in_transaction(db, write)
+    wake_outbox_worker()
 
     # --- 4. Return the new team ---
-    created_team = await db["teams"].find_one({"_id": result.inserted_id})
-    return TeamOut(id=str(created_team["_id"]), **created_team)
+    # No need to read it back: we built the document ourselves.
+    return _team_out(new_team_doc)
 
 
-@router.get("", response_model=List[TeamOut])
+@router.get("", response_model=TeamPage)
 async def list_teams(
     db: AsyncIOMotorDatabase = Depends(get_database),
-    current_user: TokenData = Depends(get_current_user)
+    current_user: TokenData = Depends(get_current_user),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include: Optional[str] = Query(None, description="Set to 'members' to embed member_ids"),
 ):
     """
-    List all teams.
+    List all teams, one page at a time.
     - Admins see all teams.
     - Other users see only teams they are a member of.
     """
-    query = {}
     if current_user.role != Role.ADMIN:
-        # If not admin, find teams where user is a member or leader
-        query = {
-            "$or": [
-                {"leader_id": current_user.username},
-                {"member_ids": current_user.username}
-            ]
-        }
+        # If not admin, the same listing as GET /teams/mine
+        return await _find_my_team_page(db, current_user.username, limit, cursor, include)
     
-    teams_cursor = db["teams"].find(query)
-    teams = await teams_cursor.to_list(length=100)
-    
-    # Convert MongoDB docs to TeamOut schema
-    return [TeamOut(id=str(team["_id"]), **team) for team in teams]
+    return await _find_team_page(db, {}, limit, cursor, include)
 
 # --- NEW INTERNAL ENDPOINT (for User-Service) ---
 # User_management requests to know if a person is team leader, so the admin can know if they can delete him.
@@ -124,27 +304,21 @@ async def _is_user_still_leader(db: AsyncIOMotorDatabase, username: str) -> bool
     count = await db["teams"].count_documents({"leader_id": username})
     return count > 0
 
-@router.get("/leader/{username}", response_model=List[TeamOut])
+@router.get("/leader/{username}", response_model=TeamPage)
 async def list_teams_led_by_user(
     username: str,
     db: AsyncIOMotorDatabase = Depends(get_database),
     # Security: Ensure only a logged-in user can access this.
-    admin_user: TokenData = Depends(get_current_admin_user)
+    admin_user: TokenData = Depends(get_current_admin_user),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include: Optional[str] = Query(None, description="Set to 'members' to embed member_ids"),
 ):
     """
     (Logged-in Users Only)
-    Gets a list of all teams where the specified user is the leader.
+    Gets a page of the teams where the specified user is the leader.
     """
-    # 1. Find all teams in the database where the leader_id matches
-    teams_cursor = db["teams"].find({"leader_id": username})
-    teams = await teams_cursor.to_list(length=100)
-
-    # 2. If no teams are found, return an empty list
-    if not teams:
-        return []
-
-    # 3. Convert the MongoDB documents to our TeamOut schema and return them
-    return [TeamOut(id=str(team["_id"]), **team) for team in teams]
+    return await _find_team_page(db, {"leader_id": username}, limit, cursor, include)
 
 @router.get("/internal/is-leader/{username}", include_in_schema=False)
 async def is_user_a_team_leader(
@@ -162,6 +336,37 @@ async def is_user_a_team_leader(
     is_leader = await _is_user_still_leader(db, username)
     return {"is_leader": is_leader}
 
+@router.get("/internal/memberships/{username}", include_in_schema=False)
+async def get_user_membership_claims(
+    username: str,
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    service: str = Depends(get_service_caller)
+):
+    """
+    (Internal Service-Only)
+    The user's team memberships in the compact form user_service puts in
+    access tokens at login/refresh (see common/team_claims.py).
+    """
+    return await get_membership_claims(db, username)
+
+@router.post("/reconcile-roles")
+async def reconcile_leader_roles(
+    dry_run: bool = Query(True, description="Only report the differences, change nothing"),
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    admin_user: TokenData = Depends(get_current_admin_user)
+):
+    """
+    (Admin Only)
+    Compares team leadership with user roles and fixes the users whose role
+    drifted (see reconciler.py). Returns the run's stats.
+    """
+    if reconciler_running():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A reconciliation is already running.")
+    try:
+        return await reconcile_roles(db, dry_run)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"User service call failed: {e}")
+
 @router.delete("/{team_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_team(
     team_id: str,
@@ -173,37 +378,29 @@ async def delete_team(
     If the leader of this team no longer leads any other teams,
     their role is demoted to "member" in the user_service.
     """
-    try:
-        team_object_id = ObjectId(team_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid team ID format")
+    team_object_id = _parse_team_id(team_id)
+
+    # 1. Delete the team (and its memberships), getting back the document we just removed
+    # 2. Queue a role sync for its leader: the outbox worker demotes them
+    #    if they don't lead any other team by the time it runs.
+    async def write(session):
+        team_doc = await db["teams"].find_one_and_delete(
+            {"_id": team_object_id},
+            projection={"leader_id": 1},
+            session=session
+        )
+        former_members = []
+        if team_doc:
+            former_members = await delete_team_memberships(db, team_object_id, session=session)
+            await enqueue_role_sync(db, [team_doc["leader_id"]], session=session)
+        return team_doc, former_members
 
-    # 1. Find the team we are about to delete
-    team_to_delete = await db["teams"].find_one({"_id": team_object_id})
+    team_to_delete, former_members = await run_in_transaction(db, write)
     if not team_to_delete:
         raise HTTPException(status_code=404, detail="Team not found")
-    
-    leader_username = team_to_delete["leader_id"]
-
-    # 2. Delete the team
-    await db["teams"].delete_one({"_id": team_object_id})
-
-    # 3. Implement Your Plan (Point 3 & 4)
-    # Check if this user is *still* a leader of any *other* team
-    is_still_leader = await _is_user_still_leader(db, leader_username)
-    
-    if not is_still_leader:
-        # If not, demote them in user_service
-        demote_url = f"http://user_service:8001/users/{leader_username}/role"
-        role_payload = {"role": "member"} # Demote to member
-        
-        try:
-            async with httpx.AsyncClient() as client:
-                headers = {"Authorization": f"Bearer {admin_user.token}"}
-                await client.patch(demote_url, json=role_payload, headers=headers)
-        except Exception:
-            # Log this error. The team was deleted, but demotion failed.
-            print(f"Warning: Team was deleted, but could not demote user {leader_username}.")
+    team_cache.invalidate(team_object_id)
+    notify_membership_change(team_object_id, former_members)
+    wake_outbox_worker()
 
     return None # Return 204 No Content
 
@@ -215,47 +412,63 @@ async def delete_team(
 
 @router.patch("/{team_id}", response_model=TeamOut)
 async def update_team_details(
+    team_id: str,
     team_data: TeamUpdate, # The JSON payload
-    team: Team = Depends(get_team_leader_or_admin), # Our security check
+    current_user: TokenData = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """
     (Admin or Team Leader Only)
     Update a team's name or description.
     """
-    
+    obj_id = _parse_team_id(team_id)
     update_data = team_data.model_dump(exclude_unset=True)
 
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided (name or description).")
 
-    # Update the team in the database
-    await db["teams"].update_one(
-        {"_id": team.id},
-        {"$set": update_data}
+    # Security check folded into the filter: admins match any team,
+    # everyone else only the teams they lead.
+    team_filter = {"_id": obj_id}
+    if current_user.role != Role.ADMIN:
+        team_filter["leader_id"] = current_user.username
+
+    updated_team_doc = await db["teams"].find_one_and_update(
+        team_filter,
+        {"$set": update_data, "$inc": {"version": 1}},
+        projection=SLIM_PROJECTION,
+        return_document=ReturnDocument.AFTER
     )
 
-    # Get the fresh document from the DB
-    updated_team_doc = await db["teams"].find_one({"_id": team.id})
-    
-    return TeamOut(id=str(updated_team_doc["_id"]), **updated_team_doc)
+    if updated_team_doc is None:
+        if not await db["teams"].find_one({"_id": obj_id}, projection={"_id": 1}):
+            raise HTTPException(status_code=404, detail="Team not found")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not authorized to modify this team."
+        )
+
+    team_cache.invalidate(obj_id)
+    return _team_out(updated_team_doc)
 
 # THIS endpoint only allows us to add members to the team as leader or admin.
 @router.post("/{team_id}/members", response_model=TeamOut)
 async def add_member_to_team(
     payload: MemberAdd, # The JSON body: {"username": "new_user"}
-    team: Team = Depends(get_team_leader_only), # 1. Security: Checks if user is Admin/Leader
-    current_user: TokenData = Depends(get_current_user), # 2. Gets the user's token for the next call
-    db: AsyncIOMotorDatabase = Depends(get_database)
+    team: TeamSnapshot = Depends(get_team_leader_only), # Cached leader check, before anything else
+    current_user: TokenData = Depends(get_current_user), # Gets the user's token for the next call
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
-    (Admin or Team Leader Only)
+    (Team Leader Only)
     Adds a new, validated member to a team.
     """
+    obj_id = team.team_id
     new_member_username = payload.username
 
-    # --- 1. Check if user is already in the team ---
-    if new_member_username in team.member_ids:
+    # --- 1. Check if user is already in the team (one index seek) ---
+    if await find_existing_members(db, obj_id, [new_member_username]):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User is already a member of this team"
@@ -265,12 +478,11 @@ async def add_member_to_team(
     # We must call the user_service to see if this user is real and active.
     user_service_url = f"http://user_service:8001/users/{new_member_username}"
     try:
-        async with httpx.AsyncClient() as client:
-            # We must use our *own* token to prove we are allowed to see user data
-            auth_header = f"Bearer {current_user.token}" 
-            headers = {"Authorization": auth_header}
-            
-            response = await client.get(user_service_url, headers=headers)
+        # We must use our *own* token to prove we are allowed to see user data
+        auth_header = f"Bearer {current_user.token}" 
+        headers = {"Authorization": auth_header}
+
+        response = await http_client.get(user_service_url, headers=headers)
         
         # If user_service returns 404, the user doesn't exist
         if response.status_code == 404:
@@ -286,57 +498,289 @@ async def add_member_to_team(
     except httpx.ConnectError:
         raise HTTPException(status_code=503, detail="User service is unreachable.")
 
-    # --- 3. Add to Database ---
-    # "$addToSet" is a MongoDB operator that adds an item to an array
-    # only if it's not already there. It's safer than "$push".
-    await db["teams"].update_one(
-        {"_id": team.id},
-        {"$addToSet": {"member_ids": new_member_username}}
-    )
+    # --- 3. Add to Database (one atomic round trip) ---
+    # The filter only matches if the caller still leads the team and the
+    # user is not a member yet (both may have changed since the checks above).
+    async def write(session):
+        team_doc = await db["teams"].find_one_and_update(
+            {"_id": obj_id, "leader_id": current_user.username, "member_ids": {"$ne": new_member_username}},
+            {"$addToSet": {"member_ids": new_member_username}, "$inc": {"version": 1, "member_count": 1}},
+            projection=SLIM_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if team_doc is not None:
+            await add_members(db, obj_id, [new_member_username], session=session)
+        return team_doc
+
+    updated_team_doc = await run_in_transaction(db, write)
+
+    # --- 4. Nothing matched: find out why ---
+    if updated_team_doc is None:
+        team_doc = await db["teams"].find_one(
+            {"_id": obj_id},
+            projection={"leader_id": 1, "member_ids": {"$elemMatch": {"$eq": new_member_username}}}
+        )
+        if not team_doc:
+            raise HTTPException(status_code=404, detail="Team not found")
+        if team_doc["leader_id"] != current_user.username:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You are not authorized to manage members for this team."
+            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User is already a member of this team"
+        )
 
-    # --- 4. Return the fully updated team ---
-    updated_team_doc = await db["teams"].find_one({"_id": team.id})
-    return TeamOut(id=str(updated_team_doc["_id"]), **updated_team_doc)
+    team_cache.invalidate(obj_id)
+    notify_membership_change(obj_id, [new_member_username])
+    return _team_out(updated_team_doc)
 
 
-#This allows us to remove a member from a team, as admins or leaders
+#This allows us to remove a member from a team, as leaders
 @router.delete("/{team_id}/members/{username_to_remove}", response_model=TeamOut)
 async def remove_member_from_team(
+    team_id: str,
     username_to_remove: str, # The member to remove (from the URL)
-    team: Team = Depends(get_team_leader_only), # 1. Security: Checks if user is Admin/Leader
+    current_user: TokenData = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     """
-    (Admin or Team Leader Only)
+    (Team Leader Only)
     Removes a member from a team.
     """
-
-    # --- 1. Business Rule: Check if user is the Team Leader ---
-    if username_to_remove == team.leader_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Cannot remove the Team Leader. Please reassign leadership first."
+    obj_id = _parse_team_id(team_id)
+    _reject_admin(current_user)
+
+    # --- 1. Remove from Database (one atomic round trip) ---
+    # Matches only if the caller leads the team, the user to remove is
+    # not the leader, and they are actually a member.
+    async def write(session):
+        team_doc = await db["teams"].find_one_and_update(
+            {
+                "_id": obj_id,
+                "leader_id": {"$eq": current_user.username, "$ne": username_to_remove},
+                "member_ids": username_to_remove,
+            },
+            {"$pull": {"member_ids": username_to_remove}, "$inc": {"version": 1, "member_count": -1}},
+            projection=SLIM_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+            session=session
         )
+        if team_doc is not None:
+            await remove_members(db, obj_id, [username_to_remove], session=session)
+        return team_doc
+
+    updated_team_doc = await run_in_transaction(db, write)
 
-    # --- 2. Check if user is actually in the team ---
-    if username_to_remove not in team.member_ids:
+    # --- 2. Nothing matched: find out why ---
+    if updated_team_doc is None:
+        team_doc = await db["teams"].find_one(
+            {"_id": obj_id},
+            projection={"leader_id": 1}
+        )
+        if not team_doc:
+            raise HTTPException(status_code=404, detail="Team not found")
+        if team_doc["leader_id"] != current_user.username:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You are not authorized to manage members for this team."
+            )
+        # Business Rule: the Team Leader can't be removed
+        if username_to_remove == team_doc["leader_id"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cannot remove the Team Leader. Please reassign leadership first."
+            )
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User is not a member of this team."
         )
 
-    # --- 3. Remove from Database ---
-    # "$pull" is the MongoDB operator to remove a specific item
-    # from an array.
-    await db["teams"].update_one(
-        {"_id": team.id},
-        {"$pull": {"member_ids": username_to_remove}}
+    team_cache.invalidate(obj_id)
+    notify_membership_change(obj_id, [username_to_remove])
+    return _team_out(updated_team_doc)
+
+
+
+# ------- BATCH MEMBERSHIP ENDPOINTS --------
+# One authorization check, one membership lookup, one user_service call and
+# one team write for the whole list, instead of four round trips per user.
+MEMBER_BATCH_MAX = 500 # Same cap as user_service's POST /users/batch
+
+def _distinct_usernames(payload: MemberBatch) -> list[str]:
+    # Keep the caller's order, drop duplicates
+    usernames = list(dict.fromkeys(payload.usernames))
+    if len(usernames) > MEMBER_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many usernames; at most {MEMBER_BATCH_MAX} per request."
+        )
+    return usernames
+
+async def _lookup_users(http_client: httpx.AsyncClient, token: str, usernames: list[str]) -> dict:
+    # username -> {"exists", "active", "role"} from user_service, in one call
+    try:
+        response = await http_client.post(
+            "http://user_service:8001/users/batch",
+            json={"usernames": usernames},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        response.raise_for_status()
+    except httpx.ConnectError:
+        raise HTTPException(status_code=503, detail="User service is unreachable.")
+    return {user["username"]: user for user in response.json()["users"]}
+
+def _batch_conflict(team_doc: Optional[dict], current_user: TokenData):
+    # The guarded write matched nothing although the pre-checks passed:
+    # the team was deleted, changed leader, or its members changed meanwhile.
+    if not team_doc:
+        raise HTTPException(status_code=404, detail="Team not found")
+    if team_doc["leader_id"] != current_user.username:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not authorized to manage members for this team."
+        )
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="The team's members changed while the batch was processed; please retry."
     )
 
-    # --- 4. Return the fully updated team ---
-    updated_team_doc = await db["teams"].find_one({"_id": team.id})
-    return TeamOut(id=str(updated_team_doc["_id"]), **updated_team_doc)
+@router.post("/{team_id}/members:batch", response_model=MemberBatchReport)
+async def add_members_to_team(
+    payload: MemberBatch, # {"usernames": ["a", "b", ...]}
+    team: TeamSnapshot = Depends(get_team_leader_only),
+    current_user: TokenData = Depends(get_current_user),
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """
+    (Team Leader Only)
+    Adds many validated members to a team at once.
+    Users that don't exist, are inactive or are already members are skipped
+    and reported; the others are added.
+    """
+    usernames = _distinct_usernames(payload)
+
+    # --- 1. Who is already in the team (one index seek) ---
+    existing = await find_existing_members(db, team.team_id, usernames)
+    candidates = [username for username in usernames if username not in existing]
+
+    # --- 2. Inter-Service Validation, one call for all of them ---
+    users = await _lookup_users(http_client, current_user.token, candidates) if candidates else {}
+
+    results = {}
+    to_add = []
+    for username in usernames:
+        user = users.get(username)
+        if username in existing:
+            results[username] = MemberBatchStatus.ALREADY_MEMBER
+        elif user is None or not user["exists"]:
+            results[username] = MemberBatchStatus.NOT_FOUND
+        elif not user["active"]:
+            results[username] = MemberBatchStatus.INACTIVE
+        else:
+            results[username] = MemberBatchStatus.ADDED
+            to_add.append(username)
+
+    # --- 3. One atomic write ---
+    # The filter only matches if the caller still leads the team and none of
+    # the users is a member yet, so member_count grows by exactly len(to_add).
+    if to_add:
+        async def write(session):
+            team_doc = await db["teams"].find_one_and_update(
+                {"_id": team.team_id, "leader_id": current_user.username, "member_ids": {"$nin": to_add}},
+                {
+                    "$addToSet": {"member_ids": {"$each": to_add}},
+                    "$inc": {"version": 1, "member_count": len(to_add)}
+                },
+                projection=SLIM_PROJECTION,
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+            if team_doc is not None:
+                await add_members(db, team.team_id, to_add, session=session)
+            return team_doc
+
+        team_doc = await run_in_transaction(db, write)
+        if team_doc is None:
+            _batch_conflict(await db["teams"].find_one({"_id": team.team_id}, projection={"leader_id": 1}), current_user)
+        team_cache.invalidate(team.team_id)
+        notify_membership_change(team.team_id, to_add)
+    else:
+        team_doc = await db["teams"].find_one({"_id": team.team_id}, projection=SLIM_PROJECTION)
+        if team_doc is None:
+            raise HTTPException(status_code=404, detail="Team not found")
+
+    return MemberBatchReport(
+        team=_team_out(team_doc),
+        results=[MemberBatchResult(username=username, status=results[username]) for username in usernames],
+    )
 
+@router.delete("/{team_id}/members:batch", response_model=MemberBatchReport)
+async def remove_members_from_team(
+    payload: MemberBatch,
+    team: TeamSnapshot = Depends(get_team_leader_only),
+    current_user: TokenData = Depends(get_current_user),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    (Team Leader Only)
+    Removes many members from a team at once.
+    The Team Leader and users who are not members are skipped and reported.
+    """
+    usernames = _distinct_usernames(payload)
+    existing = await find_existing_members(db, team.team_id, usernames)
+
+    results = {}
+    to_remove = []
+    for username in usernames:
+        # Business Rule: the Team Leader can't be removed
+        if username == team.leader_id:
+            results[username] = MemberBatchStatus.IS_LEADER
+        elif username not in existing:
+            results[username] = MemberBatchStatus.NOT_MEMBER
+        else:
+            results[username] = MemberBatchStatus.REMOVED
+            to_remove.append(username)
+
+    if to_remove:
+        # Matches only if the caller still leads the team, is not being removed,
+        # and all the users are still members: member_count drops by len(to_remove).
+        async def write(session):
+            team_doc = await db["teams"].find_one_and_update(
+                {
+                    "_id": team.team_id,
+                    "leader_id": {"$eq": current_user.username, "$nin": to_remove},
+                    "member_ids": {"$all": to_remove},
+                },
+                {
+                    "$pull": {"member_ids": {"$in": to_remove}},
+                    "$inc": {"version": 1, "member_count": -len(to_remove)}
+                },
+                projection=SLIM_PROJECTION,
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+            if team_doc is not None:
+                await remove_members(db, team.team_id, to_remove, session=session)
+            return team_doc
+
+        team_doc = await run_in_transaction(db, write)
+        if team_doc is None:
+            _batch_conflict(await db["teams"].find_one({"_id": team.team_id}, projection={"leader_id": 1}), current_user)
+        team_cache.invalidate(team.team_id)
+        notify_membership_change(team.team_id, to_remove)
+    else:
+        team_doc = await db["teams"].find_one({"_id": team.team_id}, projection=SLIM_PROJECTION)
+        if team_doc is None:
+            raise HTTPException(status_code=404, detail="Team not found")
+
+    return MemberBatchReport(
+        team=_team_out(team_doc),
+        results=[MemberBatchResult(username=username, status=results[username]) for username in usernames],
+    )
 
 
 @router.patch("/{team_id}/assign-leader", response_model=TeamOut)
@@ -344,7 +788,8 @@ async def assign_team_leader(
     team_id: str, # <-- 1. We get the team_id from the path
     payload: LeaderAssign, 
     admin_user: TokenData = Depends(get_current_admin_user), # <-- 2. THE FIX: Admin-only
-    db: AsyncIOMotorDatabase = Depends(get_database)
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     (Admin Only)
@@ -353,23 +798,13 @@ async def assign_team_leader(
     a member of the team. Demotes the old leader if necessary.
     """
     new_leader_username = payload.new_leader_username
-    
-    # --- 3. We must now manually fetch the team ---
-    try:
-        obj_id = ObjectId(team_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid team ID format")
+    obj_id = _parse_team_id(team_id)
 
-    team_doc = await db["teams"].find_one({"_id": obj_id})
-    if not team_doc:
+    # --- The team must exist (cached snapshot), before any inter-service call ---
+    team = await get_team_snapshot(db, obj_id)
+    if team is None:
         raise HTTPException(status_code=404, detail="Team not found")
-    
-    team = Team(**team_doc) # We have the team object now
-    old_leader_username = team.leader_id
-    # --- End of manual fetch ---
-
-    # --- Business Rule Checks ---
-    if new_leader_username == old_leader_username:
+    if team.leader_id == new_leader_username:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="This user is already the team leader."
@@ -378,11 +813,10 @@ async def assign_team_leader(
     # --- Inter-Service Validation: Check if new leader is a real, active user ---
     user_service_url = f"http://user_service:8001/users/{new_leader_username}"
     try:
-        async with httpx.AsyncClient() as client:
-            # We use the Admin's token for the call
-            auth_header = f"Bearer {admin_user.token}"
-            headers = {"Authorization": auth_header}
-            response = await client.get(user_service_url, headers=headers)
+        # We use the Admin's token for the call
+        auth_header = f"Bearer {admin_user.token}"
+        headers = {"Authorization": auth_header}
+        response = await http_client.get(user_service_url, headers=headers)
         
         if response.status_code == 404:
             raise HTTPException(status_code=404, detail=f"User '{new_leader_username}' not found.")
@@ -395,37 +829,58 @@ async def assign_team_leader(
     except httpx.ConnectError:
         raise HTTPException(status_code=503, detail="User service is unreachable.")
 
-    # --- Update MongoDB Database ---
-    await db["teams"].update_one(
-        {"_id": team.id},
-        {
-            "$set": {"leader_id": new_leader_username},
-            "$addToSet": {"member_ids": new_leader_username}
-        }
-    )
+    # --- Update MongoDB Database (one atomic round trip) ---
+    # We ask for the document *before* the update to learn the old leader,
+    # then apply the same change locally to return the new state.
+    # A pipeline update, so member_count only grows if the new leader
+    # was not a member yet.
+    async def write(session):
+        old_team_doc = await db["teams"].find_one_and_update(
+            {"_id": obj_id, "leader_id": {"$ne": new_leader_username}},
+            [
+                {"$set": {
+                    "leader_id": new_leader_username,
+                    "member_ids": {"$cond": [
+                        {"$in": [{"$literal": new_leader_username}, "$member_ids"]},
+                        "$member_ids",
+                        {"$concatArrays": ["$member_ids", {"$literal": [new_leader_username]}]},
+                    ]},
+                    "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+                }},
+                {"$set": {"member_count": {"$size": "$member_ids"}}},
+            ],
+            projection=_projection_with_member(new_leader_username),
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if old_team_doc is not None:
+            await change_leader(db, obj_id, old_team_doc["leader_id"], new_leader_username, session=session)
+            # Promote the new leader, demote the old one if they lead nothing else
+            await enqueue_role_sync(db, [new_leader_username, old_team_doc["leader_id"]], session=session)
+        return old_team_doc
+
+    team_doc = await run_in_transaction(db, write)
+
+    if team_doc is None:
+        if not await db["teams"].find_one({"_id": obj_id}, projection={"_id": 1}):
+            raise HTTPException(status_code=404, detail="Team not found")
+        # --- Business Rule Check ---
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This user is already the team leader."
+        )
 
-    # --- Sync with User Service (Promote/Demote) ---
-    auth_header = {"Authorization": f"Bearer {admin_user.token}"}
-    
-    # a. Promote the new leader
-    if user_data.get("role") != Role.ADMIN: # <-- THE NEW SAFETY CHECK
-        try:
-            promote_url = f"http://user_service:8001/users/{new_leader_username}/role"
-            async with httpx.AsyncClient() as client:
-                await client.patch(promote_url, json={"role": "team_leader"}, headers=auth_header)
-        except Exception as e:
-            print(f"Warning: Could not promote new leader {new_leader_username}. Error: {e}")
-        
-    # b. Check and demote the old leader
-    is_still_leader = await _is_user_still_leader(db, old_leader_username)
-    if not is_still_leader:
-        try:
-            demote_url = f"http://user_service:8001/users/{old_leader_username}/role"
-            async with httpx.AsyncClient() as client:
-                await client.patch(demote_url, json={"role": "member"}, headers=auth_header)
-        except Exception as e:
-            print(f"Warning: Could not demote old leader {old_leader_username}. Error: {e}")
+    team_cache.invalidate(obj_id)
+    notify_membership_change(obj_id, [new_leader_username, team_doc["leader_id"]])
+    wake_outbox_worker()
+
+    was_member = bool(team_doc.get("member_ids"))
+    updated_team_doc = dict(
+        team_doc,
+        leader_id=new_leader_username,
+        version=team_doc.get("version", 0) + 1,
+        member_count=team_doc.get("member_count", 0) + (0 if was_member else 1),
+    )
 
     # --- Return the updated team ---
-    updated_team_doc = await db["teams"].find_one({"_id": team.id})
-    return TeamOut(id=str(updated_team_doc["_id"]), **updated_team_doc)
\ No newline at end of file
+    return _team_out(updated_team_doc)
@@ -11,11 +11,18 @@ class Role(StrEnum):
     TEAM_LEADER = "team_leader"
     MEMBER = "member"
 
+# --- A user's role inside one team (team_memberships.role_in_team) ---
+class TeamRole(StrEnum):
+    LEADER = "leader"
+    MEMBER = "member"
+
 # --- Schema for data inside the JWT Token ---
 class TokenData(BaseModel):
     username: str | None = None
     role: Role | None = None
     token: str | None = None # <-- ADD THIS LINE
+    teams: dict | None = None # membership claims {"v", "l", "m"}, see common/team_claims.py
+    issued_at: int | None = None # the token's `iat`
 
 # --- Schemas for Creating/Updating Teams ---
 class TeamCreate(BaseModel):
@@ -42,8 +49,33 @@ class TeamOut(BaseModel):
     name: str
     description: Optional[str] = None
     leader_id: str
-    member_ids: List[str]
+    member_ids: Optional[List[str]] = None # Only filled in when asked for (?include=members)
+    member_count: Optional[int] = None
     created_at: datetime
+    role_in_team: Optional[TeamRole] = None # Only filled in by GET /teams/mine
+
+class TeamPage(BaseModel):
+    """
+    One page of a team listing.
+    Pass `next_cursor` back as `?cursor=` to get the next page.
+    """
+    items: List[TeamOut]
+    next_cursor: Optional[str] = None
+
+class TeamMember(BaseModel):
+    """
+    One row of a team's member listing.
+    """
+    username: str
+    role_in_team: TeamRole
+
+class TeamMemberPage(BaseModel):
+    """
+    One page of a team's members, sorted by username.
+    Pass `next_cursor` back as `?cursor=` to get the next page.
+    """
+    items: List[TeamMember]
+    next_cursor: Optional[str] = None
 
 class MemberAdd(BaseModel):
     """
@@ -51,6 +83,33 @@ class MemberAdd(BaseModel):
     """
     username: str
 
+class MemberBatch(BaseModel):
+    """
+    Schema for adding/removing many members at once.
+    """
+    usernames: List[str] = Field(..., min_length=1)
+
+class MemberBatchStatus(StrEnum):
+    ADDED = "added"
+    REMOVED = "removed"
+    ALREADY_MEMBER = "already_member"
+    NOT_MEMBER = "not_member"
+    NOT_FOUND = "not_found"
+    INACTIVE = "inactive"
+    IS_LEADER = "is_leader"
+
+class MemberBatchResult(BaseModel):
+    username: str
+    status: MemberBatchStatus
+
+class MemberBatchReport(BaseModel):
+    """
+    What a batch add/remove did: the team after the change and one
+    result per (distinct) username, in the order they were sent.
+    """
+    team: TeamOut
+    results: List[MemberBatchResult]
+
 class LeaderAssign(BaseModel):
     """
     Schema for re-assigning a team leader.
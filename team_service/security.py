@@ -3,10 +3,12 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from pydantic import ValidationError
 import os
+from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorDatabase # NEW IMPORT
 from db import get_database # NEW IMPORT
 from bson import ObjectId # NEW IMPORT
-from models import Team # NEW IMPORT
+from team_cache import TeamSnapshot, get_team_snapshot, get_team_membership
+from common.team_claims import claims_role
 
 
 # We import our local schema for TokenData
@@ -18,6 +20,17 @@ ALGORITHM = "HS256"
 
 bearer_scheme = HTTPBearer()
 
+# Short-lived JWTs this service signs for its own calls to internal
+# endpoints of the other services (they check the `svc` claim).
+SERVICE_NAME = "team_service"
+SERVICE_TOKEN_EXPIRE_MINUTES = 5
+
+def create_service_token() -> str:
+    if SECRET_KEY is None:
+        raise Exception("SECRET_KEY not set in environment")
+    expire = datetime.now(timezone.utc) + timedelta(minutes=SERVICE_TOKEN_EXPIRE_MINUTES)
+    return jwt.encode({"sub": SERVICE_NAME, "svc": SERVICE_NAME, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
 credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
     detail="Could not validate credentials",
@@ -42,7 +55,9 @@ async def get_current_user(
         # 2. Get the data from the token payload
         token_data = TokenData(
             username=payload.get("sub"), 
-            role=payload.get("role")
+            role=payload.get("role"),
+            teams=payload.get("teams"),
+            issued_at=payload.get("iat")
         )
         if token_data.username is None or token_data.role is None:
             raise credentials_exception
@@ -70,46 +85,11 @@ async def get_current_admin_user(
         )
     return current_user
 
-async def get_team_leader_or_admin(
-    team_id: str, # FastAPI will get this from the URL path
-    current_user: TokenData = Depends(get_current_user),
-    db: AsyncIOMotorDatabase = Depends(get_database)
-) -> Team: # It will return the team object if successful
-    """
-    Dependency that checks if a user is an ADMIN
-    OR the 'leader_id' of the specific team.
-    
-    Returns the team document if authorized, otherwise raises 403/404.
-    """
-    try:
-        obj_id = ObjectId(team_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid team ID format")
-
-    # Find the team in the database
-    team_doc = await db["teams"].find_one({"_id": obj_id})
-    
-    if not team_doc:
-        raise HTTPException(status_code=404, detail="Team not found")
-
-    # Convert to Pydantic model
-    team = Team(**team_doc)
-
-    # --- The Core Security Logic ---
-    if current_user.role == Role.ADMIN or team.leader_id == current_user.username:
-        return team # Success! Return the team
-    
-    # If we get here, they are not the leader or an admin
-    raise HTTPException(
-        status_code=status.HTTP_403_FORBIDDEN,
-        detail="You are not authorized to modify this team."
-    )
-
 async def get_team_leader_only(
     team_id: str,
     current_user: TokenData = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
-) -> Team:
+) -> TeamSnapshot:
     """
     Dependency that checks if the user is the LEADER of the specific team.
     It explicitly blocks Admin users from using management functions.
@@ -127,12 +107,10 @@ async def get_team_leader_only(
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid team ID format")
 
-    team_doc = await db["teams"].find_one({"_id": obj_id})
+    team = await get_team_snapshot(db, obj_id)
     
-    if not team_doc:
+    if team is None:
         raise HTTPException(status_code=404, detail="Team not found")
-
-    team = Team(**team_doc)
     
     # 3. Final Check: Is the non-admin user the actual leader?
     if team.leader_id == current_user.username:
@@ -144,40 +122,80 @@ async def get_team_leader_only(
         detail="You are not authorized to manage members for this team."
     )
 
+# Ambiguous error used when the team is not found OR access is denied.
+team_access_error = HTTPException(
+    status_code=status.HTTP_403_FORBIDDEN,
+    detail="The requested resource was not found or is inaccessible."
+)
+
+def check_team_access(current_user: TokenData, team: TeamSnapshot | None, is_member: bool):
+    """
+    Raises the ambiguous 403 unless the user is an ADMIN or a MEMBER of the team.
+    """
+    # 1. 404 SCENARIO: Team not found. We return the ambiguous error immediately.
+    if team is None:
+        raise team_access_error
+
+    # 2. 403 SCENARIO: User is Admin OR user is a member
+    if current_user.role == Role.ADMIN or is_member:
+        return
+
+    # 3. FINAL BLOCKING: If they are not Admin and not a member, block with the same ambiguous error.
+    raise team_access_error
+
 # This is used during the task creation.
 async def get_team_access_or_admin(
     team_id: str,
     current_user: TokenData = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
-) -> Team:
+) -> TeamSnapshot:
     """
     Dependency that checks if a user is an ADMIN OR a MEMBER of the specific team.
-    Returns the team document if authorized.
+    Returns the cached team snapshot if authorized.
     """
-    # Ambiguous error used when the team is not found OR access is denied.
-    ambiguous_error = HTTPException(
-        status_code=status.HTTP_403_FORBIDDEN,
-        detail="The requested resource was not found or is inaccessible."
-    )
-
     try:
         obj_id = ObjectId(team_id)
     except Exception:
         # Keep this technical error separate, as it's helpful for developers
         raise HTTPException(status_code=400, detail="Invalid team ID format") 
 
-    team_doc = await db["teams"].find_one({"_id": obj_id})
-    
-    # 1. 404 SCENARIO: Team not found. We return the ambiguous error immediately.
-    if not team_doc:
-        raise ambiguous_error 
+    if current_user.role == Role.ADMIN:
+        # Admins see every team, we only need to know it exists
+        team = await get_team_snapshot(db, obj_id)
+        check_team_access(current_user, team, False)
+        return team
+
+    # Fresh membership claims in the token: only the (shared) team snapshot
+    # is needed, to know the team still exists.
+    if await claims_role(db, current_user, team_id) is not None:
+        team = await get_team_snapshot(db, obj_id)
+        check_team_access(current_user, team, True)
+        return team
+
+    # Cached answer, or one find_one that returns at most one element of
+    # member_ids ($elemMatch), never the whole array.
+    team, is_member = await get_team_membership(db, obj_id, current_user.username)
+    check_team_access(current_user, team, is_member)
+    return team
+
+
+# --- Service-to-service authentication ---
+# Internal endpoints only accept the short-lived JWTs other services sign with
+# the shared SECRET_KEY and an `svc` claim naming themselves.
+SERVICE_NAMES = {"user_service"}
+
+async def get_service_caller(token: HTTPAuthorizationCredentials = Depends(bearer_scheme)) -> str:
+    if SECRET_KEY is None:
+        raise Exception("SECRET_KEY not set in environment")
+    try:
+        payload = jwt.decode(token.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
 
-    team = Team(**team_doc)
-    
-    # 2. 403 SCENARIO: User is Admin OR user is a member
-    if current_user.role == Role.ADMIN or current_user.username in team.member_ids:
-        return team # Success!
-    
-    # 3. FINAL BLOCKING: If they are not Admin and not a member, block with the same ambiguous error.
-    raise ambiguous_error
-    
\ No newline at end of file
+    service = payload.get("svc")
+    if service not in SERVICE_NAMES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="This endpoint is reserved for internal services"
+        )
+    return service
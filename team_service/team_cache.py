@@ -0,0 +1,183 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from common.ttl_cache import TTLCache
+
+# --- Settings ---
+TEAM_CACHE_MAX_ENTRIES = int(os.getenv("TEAM_CACHE_MAX_ENTRIES", "10000"))
+TEAM_CACHE_MAX_MEMBERSHIPS = int(os.getenv("TEAM_CACHE_MAX_MEMBERSHIPS", "100000"))
+# Writes in this process invalidate at once; the TTL bounds how long another
+# worker may serve an old snapshot (unless the change stream is enabled).
+TEAM_CACHE_TTL_SECONDS = float(os.getenv("TEAM_CACHE_TTL_SECONDS", "30"))
+# Needs MongoDB running as a replica set.
+TEAM_CACHE_CHANGE_STREAM = os.getenv("TEAM_CACHE_CHANGE_STREAM", "false").lower() in ("1", "true", "yes")
+
+# Only the fields the authorization dependencies look at. member_ids is never
+# loaded whole: membership is asked per user with an $elemMatch projection.
+SNAPSHOT_PROJECTION = {"leader_id": 1, "version": 1}
+
+def membership_projection(username: str) -> dict:
+    return {**SNAPSHOT_PROJECTION, "member_ids": {"$elemMatch": {"$eq": username}}}
+
+
+@dataclass(frozen=True)
+class TeamSnapshot:
+    """
+    What authorization needs to know about a team.
+    `version` is bumped by every team write.
+    """
+    team_id: ObjectId
+    leader_id: str
+    version: int
+
+    @classmethod
+    def from_doc(cls, team_doc: dict) -> "TeamSnapshot":
+        return cls(
+            team_id=team_doc["_id"],
+            leader_id=team_doc["leader_id"],
+            version=team_doc.get("version", 0),
+        )
+
+
+class TeamSnapshotCache(TTLCache[ObjectId, TeamSnapshot]):
+    """
+    team_id -> TeamSnapshot. Invalidations leave tombstones (see
+    common/ttl_cache.py), and a snapshot never replaces a newer one.
+
+    Membership answers are cached separately per (team_id, username), tagged
+    with the team version they were read at; they only count while the team's
+    cached snapshot still has that version.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float, max_memberships: int):
+        super().__init__(max_entries, ttl_seconds)
+        self.max_memberships = max_memberships
+        self._memberships: OrderedDict[tuple[ObjectId, str], tuple[int, bool]] = OrderedDict()
+
+    def put(self, snapshot: TeamSnapshot, read_started: float):
+        cached = self.peek(snapshot.team_id)
+        if cached is not None and cached.version > snapshot.version:
+            return  # never replace a newer snapshot with an older one
+        super().put(snapshot.team_id, snapshot, read_started)
+
+    def get_membership(self, snapshot: TeamSnapshot, username: str) -> bool | None:
+        entry = self._memberships.get((snapshot.team_id, username))
+        if entry is None or entry[0] != snapshot.version:
+            return None
+        self._memberships.move_to_end((snapshot.team_id, username))
+        return entry[1]
+
+    def put_membership(self, snapshot: TeamSnapshot, username: str, is_member: bool):
+        cached = self.peek(snapshot.team_id)
+        if cached is None or cached.version != snapshot.version:
+            return  # the snapshot was not cached (invalidated, or older than the cached one)
+        key = (snapshot.team_id, username)
+        self._memberships[key] = (snapshot.version, is_member)
+        self._memberships.move_to_end(key)
+        while len(self._memberships) > self.max_memberships:
+            self._memberships.popitem(last=False)
+
+    def stats(self) -> dict:
+        return super().stats() | {
+            "memberships": len(self._memberships),
+            "max_memberships": self.max_memberships,
+            "change_stream": TEAM_CACHE_CHANGE_STREAM,
+        }
+
+
+# The single cache instance for this process
+team_cache = TeamSnapshotCache(TEAM_CACHE_MAX_ENTRIES, TEAM_CACHE_TTL_SECONDS, TEAM_CACHE_MAX_MEMBERSHIPS)
+
+
+async def get_team_snapshot(db: AsyncIOMotorDatabase, team_id: ObjectId) -> TeamSnapshot | None:
+    """
+    Returns the snapshot of a team (None if it doesn't exist).
+    A cache hit costs a dict lookup; a miss costs one projected find_one.
+    """
+    snapshot = team_cache.get(team_id)
+    if snapshot is not None:
+        return snapshot
+
+    read_started = time.monotonic()
+    team_doc = await db["teams"].find_one({"_id": team_id}, projection=SNAPSHOT_PROJECTION)
+    if team_doc is None:
+        return None
+
+    snapshot = TeamSnapshot.from_doc(team_doc)
+    team_cache.put(snapshot, read_started)
+    return snapshot
+
+
+async def get_team_membership(
+    db: AsyncIOMotorDatabase, team_id: ObjectId, username: str
+) -> tuple[TeamSnapshot | None, bool]:
+    """
+    Returns (snapshot, is_member) for one user; snapshot is None if the team
+    doesn't exist. A miss costs one find_one that brings back at most one
+    element of member_ids, however large the team is.
+    """
+    snapshot = team_cache.get(team_id)
+    if snapshot is not None:
+        is_member = team_cache.get_membership(snapshot, username)
+        if is_member is not None:
+            return snapshot, is_member
+
+    read_started = time.monotonic()
+    team_doc = await db["teams"].find_one({"_id": team_id}, projection=membership_projection(username))
+    if team_doc is None:
+        return None, False
+
+    snapshot = TeamSnapshot.from_doc(team_doc)
+    is_member = bool(team_doc.get("member_ids"))
+    remember_membership(snapshot, username, is_member, read_started)
+    return snapshot, is_member
+
+
+def remember_membership(snapshot: TeamSnapshot, username: str, is_member: bool, read_started: float):
+    # Caches a snapshot and one membership answer read from the same document
+    team_cache.put(snapshot, read_started)
+    team_cache.put_membership(snapshot, username, is_member)
+
+
+# -------------- Optional change stream -----------------
+
+_watch_task: asyncio.Task | None = None
+
+
+async def _watch_team_changes(db: AsyncIOMotorDatabase):
+    # Invalidates on every write to the teams collection, including writes
+    # made by other worker processes. Reconnects after errors.
+    while True:
+        try:
+            async with db["teams"].watch() as stream:
+                async for change in stream:
+                    team_id = change.get("documentKey", {}).get("_id")
+                    if team_id is not None:
+                        team_cache.invalidate(team_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Warning: team change stream failed ({e}); retrying in 5s.")
+            await asyncio.sleep(5)
+
+
+def start_team_change_stream(db: AsyncIOMotorDatabase):
+    global _watch_task
+    if TEAM_CACHE_CHANGE_STREAM and _watch_task is None:
+        _watch_task = asyncio.create_task(_watch_team_changes(db))
+
+
+async def stop_team_change_stream():
+    global _watch_task
+    if _watch_task is not None:
+        _watch_task.cancel()
+        try:
+            await _watch_task
+        except asyncio.CancelledError:
+            pass
+        _watch_task = None
@@ -0,0 +1,211 @@
+import codecs
+import csv
+import json
+import os
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import AsyncSessionLocal
+from hashing import get_password_hashes_async
+from models import Role, User
+from schemas import UserCreate
+
+# How many rows are checked, hashed and inserted together.
+# Memory use is bounded by this, not by the size of the uploaded file.
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "200"))
+# Longer lines are reported as invalid and skipped without being buffered
+IMPORT_MAX_LINE_LENGTH = int(os.getenv("IMPORT_MAX_LINE_LENGTH", "4096"))
+
+CSV_COLUMNS = ("username", "email", "password", "first_name", "last_name")
+
+
+# -------------- Reading the upload -----------------
+
+async def _iter_lines(body: AsyncIterator[bytes]) -> AsyncIterator[str | None]:
+    """
+    Turns the raw request stream into text lines without ever holding
+    more than one chunk (plus one partial line) in memory.
+    Lines longer than IMPORT_MAX_LINE_LENGTH are dropped as they arrive
+    and come out as None.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    oversized = False  # we are skipping the rest of a too long line
+    async for chunk in body:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            if oversized or len(line) > IMPORT_MAX_LINE_LENGTH:
+                oversized = False
+                yield None
+            else:
+                yield line.rstrip("\r")
+        if len(pending) > IMPORT_MAX_LINE_LENGTH:
+            oversized = True
+            pending = ""
+    pending += decoder.decode(b"", final=True)
+    if oversized or len(pending) > IMPORT_MAX_LINE_LENGTH:
+        yield None
+    elif pending:
+        yield pending.rstrip("\r")
+
+
+async def _iter_records(body: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """
+    Yields (line_number, record, error) for every non-empty line.
+    CSV needs a header row; quoted values may not span lines.
+    """
+    header = None
+    line_no = 0
+    async for line in _iter_lines(body):
+        line_no += 1
+        if line is None:
+            yield line_no, None, f"Line is longer than {IMPORT_MAX_LINE_LENGTH} characters"
+            if fmt == "csv" and header is None:
+                return
+            continue
+        if not line.strip():
+            continue
+
+        if fmt == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [v.strip() for v in values]
+                missing = [c for c in CSV_COLUMNS if c not in header]
+                if missing:
+                    yield line_no, None, f"CSV header is missing columns: {', '.join(missing)}"
+                    return
+                continue
+            if len(values) != len(header):
+                yield line_no, None, "Wrong number of columns"
+                continue
+            yield line_no, dict(zip(header, values)), None
+        else:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                yield line_no, None, "Invalid JSON"
+                continue
+            if not isinstance(record, dict):
+                yield line_no, None, "Each line must be a JSON object"
+                continue
+            yield line_no, record, None
+
+
+# -------------- Writing a batch -----------------
+
+def _result(line_no: int, username: str | None, status: str, detail: str | None = None) -> dict:
+    result = {"line": line_no, "username": username, "status": status}
+    if detail:
+        result["detail"] = detail
+    return result
+
+
+async def _import_batch(db: AsyncSession, batch: list[tuple[int, UserCreate]], activate: bool) -> list[dict]:
+    """
+    Handles one batch: two IN (...) duplicate checks, parallel hashing and a
+    single executemany INSERT inside one transaction.
+    Results are in no particular order; the caller sorts them by line.
+    """
+    results = []
+
+    usernames = [user.username for _, user in batch]
+    emails = [user.email for _, user in batch]
+    taken_usernames = set((await db.scalars(select(User.username).where(User.username.in_(usernames)))).all())
+    taken_emails = set((await db.scalars(select(User.email).where(User.email.in_(emails)))).all())
+
+    to_insert: list[tuple[int, UserCreate]] = []
+    for line_no, user in batch:
+        if user.username in taken_usernames:
+            results.append(_result(line_no, user.username, "duplicate", "Username already exists"))
+        elif user.email in taken_emails:
+            results.append(_result(line_no, user.username, "duplicate", "Email already exists"))
+        else:
+            # also catches duplicates inside the same batch
+            taken_usernames.add(user.username)
+            taken_emails.add(user.email)
+            to_insert.append((line_no, user))
+
+    if not to_insert:
+        return results
+
+    hashes = await get_password_hashes_async([user.password for _, user in to_insert])
+    rows = [
+        {
+            "username": user.username,
+            "email": user.email,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "password_hash": password_hash,
+            "role": Role.MEMBER,
+            "active": activate,
+        }
+        for (_, user), password_hash in zip(to_insert, hashes)
+    ]
+
+    try:
+        await db.execute(insert(User), rows)
+        await db.commit()
+        results.extend(_result(line_no, user.username, "created") for line_no, user in to_insert)
+    except IntegrityError:
+        # Someone registered one of these users while we were hashing.
+        # Fall back to row-by-row inserts so only the conflicting rows fail.
+        await db.rollback()
+        for (line_no, user), row in zip(to_insert, rows):
+            try:
+                await db.execute(insert(User), [row])
+                await db.commit()
+                results.append(_result(line_no, user.username, "created"))
+            except IntegrityError:
+                await db.rollback()
+                results.append(_result(line_no, user.username, "duplicate", "User already exists"))
+
+    return results
+
+
+# -------------- The streamed response -----------------
+
+async def stream_user_import(body: AsyncIterator[bytes], fmt: str, activate: bool) -> AsyncIterator[bytes]:
+    """
+    Reads users from the request body and yields one NDJSON result line per
+    input row, followed by a summary line.
+    Uses its own session because it keeps running after the route returns.
+    """
+    summary = {"created": 0, "duplicate": 0, "invalid": 0}
+
+    def emit(result: dict) -> bytes:
+        summary[result["status"]] += 1
+        return (json.dumps(result) + "\n").encode()
+
+    async with AsyncSessionLocal() as db:
+        # Invalid lines wait with the batch, so every result comes out in input order
+        batch: list[tuple[int, UserCreate]] = []
+        invalid: list[dict] = []
+
+        async def flush() -> list[dict]:
+            results = invalid + (await _import_batch(db, batch, activate) if batch else [])
+            return sorted(results, key=lambda result: result["line"])
+
+        async for line_no, record, error in _iter_records(body, fmt):
+            if error:
+                invalid.append(_result(line_no, None, "invalid", error))
+            else:
+                try:
+                    batch.append((line_no, UserCreate(**record)))
+                except ValidationError as e:
+                    detail = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+                    invalid.append(_result(line_no, record.get("username"), "invalid", detail))
+
+            if len(batch) + len(invalid) >= IMPORT_BATCH_SIZE:
+                for result in await flush():
+                    yield emit(result)
+                batch, invalid = [], []
+
+        for result in await flush():
+            yield emit(result)
+
+    yield (json.dumps({"summary": summary}) + "\n").encode()
@@ -0,0 +1,256 @@
+import asyncio
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.hash import bcrypt
+from sqlalchemy import update
+
+from db import AsyncSessionLocal
+from models import User
+
+# --- Settings ---
+# bcrypt is pure CPU work. Running it on FastAPI's shared threadpool means a
+# burst of logins starves every other endpoint, so we push it into a separate
+# pool of processes and cap how much work may queue up in front of it.
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(os.cpu_count() or 2)))
+HASH_QUEUE_MAX = int(os.getenv("HASH_QUEUE_MAX", "64"))
+HASH_RETRY_AFTER_SECONDS = int(os.getenv("HASH_RETRY_AFTER_SECONDS", "2"))
+# Bulk imports share that queue but never hold more than one job per worker,
+# and wait for a free slot (polling every BULK_HASH_WAIT_SECONDS) instead of
+# failing, so the rest of the queue stays available to logins.
+BULK_HASH_WAIT_SECONDS = float(os.getenv("BULK_HASH_WAIT_SECONDS", "0.05"))
+
+# --- bcrypt cost ---
+# At startup we benchmark bcrypt on this host and pick the highest cost whose
+# hash time still fits BCRYPT_TARGET_MS. Setting BCRYPT_ROUNDS skips the
+# benchmark and pins the cost.
+BCRYPT_TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+BCRYPT_MIN_ROUNDS = int(os.getenv("BCRYPT_MIN_ROUNDS", "10"))
+BCRYPT_MAX_ROUNDS = int(os.getenv("BCRYPT_MAX_ROUNDS", "15"))
+BCRYPT_ROUNDS = os.getenv("BCRYPT_ROUNDS")
+
+_executor: ProcessPoolExecutor | None = None
+_in_flight = 0
+_bcrypt_rounds = int(BCRYPT_ROUNDS) if BCRYPT_ROUNDS else 12  # passlib's default until calibrated
+_calibrated_hash_ms: float | None = None
+_rehashed = 0
+
+
+# -------------- Worker functions (run in the child processes) -----------------
+
+# The cost is passed in with every job: the child processes are forked
+# before calibration, so their copy of _bcrypt_rounds would be stale.
+def _hash_in_worker(password: str, rounds: int) -> tuple[str, float]:
+    started = time.perf_counter()
+    hashed = bcrypt.using(rounds=rounds).hash(password)
+    return hashed, (time.perf_counter() - started) * 1000
+
+
+def _benchmark_in_worker(rounds: int) -> float:
+    return _hash_in_worker("calibration-password", rounds)[1]
+
+
+def _verify_in_worker(plain_password: str, hashed_password: str) -> tuple[bool, float]:
+    started = time.perf_counter()
+    ok = bcrypt.verify(plain_password, hashed_password)
+    return ok, (time.perf_counter() - started) * 1000
+
+
+# -------------- Metrics -----------------
+
+class HashMetrics:
+    """
+    Per-operation latency counters.
+    `cpu_ms` is the time spent inside bcrypt, `wall_ms` also includes
+    the time the job waited for a free worker.
+    """
+    def __init__(self):
+        self.count = 0
+        self.cpu_ms_total = 0.0
+        self.cpu_ms_max = 0.0
+        self.wall_ms_total = 0.0
+        self.wall_ms_max = 0.0
+        self.last_cpu_ms = 0.0
+
+    def record(self, cpu_ms: float, wall_ms: float):
+        self.count += 1
+        self.cpu_ms_total += cpu_ms
+        self.cpu_ms_max = max(self.cpu_ms_max, cpu_ms)
+        self.wall_ms_total += wall_ms
+        self.wall_ms_max = max(self.wall_ms_max, wall_ms)
+        self.last_cpu_ms = cpu_ms
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "cpu_ms_avg": round(self.cpu_ms_total / self.count, 2) if self.count else 0.0,
+            "cpu_ms_max": round(self.cpu_ms_max, 2),
+            "wall_ms_avg": round(self.wall_ms_total / self.count, 2) if self.count else 0.0,
+            "wall_ms_max": round(self.wall_ms_max, 2),
+            "last_cpu_ms": round(self.last_cpu_ms, 2),
+        }
+
+
+_metrics = {"hash": HashMetrics(), "verify": HashMetrics()}
+_rejected = 0
+_bulk_slots = asyncio.Semaphore(HASH_POOL_WORKERS)
+
+
+def get_hash_metrics() -> dict:
+    return {
+        "bcrypt_rounds": _bcrypt_rounds,
+        "bcrypt_target_ms": BCRYPT_TARGET_MS,
+        "calibrated_hash_ms": round(_calibrated_hash_ms, 2) if _calibrated_hash_ms is not None else None,
+        "rehashed_on_login": _rehashed,
+        "workers": HASH_POOL_WORKERS,
+        "queue_max": HASH_QUEUE_MAX,
+        "in_flight": _in_flight,
+        "rejected": _rejected,
+        "hash": _metrics["hash"].snapshot(),
+        "verify": _metrics["verify"].snapshot(),
+    }
+
+
+# -------------- Pool lifecycle -----------------
+
+def start_hash_pool():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=HASH_POOL_WORKERS)
+
+
+def shutdown_hash_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# -------------- Public async API -----------------
+
+async def _run(op: str, fn, *args, wait: bool = False):
+    """
+    Submits one bcrypt job to the pool.
+    If too many jobs are already waiting, we answer 503 straight away
+    instead of letting the queue (and the response times) grow forever;
+    with `wait` the caller waits for a free slot instead.
+    """
+    global _in_flight, _rejected
+    while _in_flight >= HASH_QUEUE_MAX:
+        if wait:
+            await asyncio.sleep(BULK_HASH_WAIT_SECONDS)
+            continue
+        _rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy. Please retry shortly.",
+            headers={"Retry-After": str(HASH_RETRY_AFTER_SECONDS)},
+        )
+
+    start_hash_pool()
+    _in_flight += 1
+    started = time.perf_counter()
+    try:
+        result, cpu_ms = await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _in_flight -= 1
+
+    _metrics[op].record(cpu_ms, (time.perf_counter() - started) * 1000)
+    return result
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run("verify", _verify_in_worker, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run("hash", _hash_in_worker, password, _bcrypt_rounds)
+
+
+async def get_password_hashes_async(passwords: list[str]) -> list[str]:
+    """
+    Hashes a whole batch (bulk import), one pool job per password so logins
+    queue between them rather than behind a whole batch. At most one bulk job
+    per worker is in flight, and each counts against HASH_QUEUE_MAX.
+    """
+    async def hash_one(password: str) -> str:
+        async with _bulk_slots:
+            return await _run("hash", _hash_in_worker, password, _bcrypt_rounds, wait=True)
+
+    return list(await asyncio.gather(*[hash_one(password) for password in passwords]))
+
+
+# -------------- Cost calibration & rehash -----------------
+
+def current_bcrypt_rounds() -> int:
+    return _bcrypt_rounds
+
+
+def hash_rounds(hashed_password: str) -> int | None:
+    # bcrypt hashes look like "$2b$12$<salt+hash>"; the 12 is the cost
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    return hash_rounds(hashed_password) != _bcrypt_rounds
+
+
+async def calibrate_bcrypt_rounds():
+    """
+    Runs at startup. Every extra round doubles the bcrypt work, so we time
+    one hash at BCRYPT_MIN_ROUNDS, extrapolate to the target, then time the
+    chosen cost once more and step down if it is still too slow.
+    """
+    global _bcrypt_rounds, _calibrated_hash_ms
+    start_hash_pool()
+    loop = asyncio.get_running_loop()
+
+    async def measure(rounds: int) -> float:
+        return await loop.run_in_executor(_executor, _benchmark_in_worker, rounds)
+
+    if BCRYPT_ROUNDS:
+        _calibrated_hash_ms = await measure(_bcrypt_rounds)
+        print(f"bcrypt cost pinned to {_bcrypt_rounds} ({_calibrated_hash_ms:.1f} ms per hash)")
+        return
+
+    base_ms = await measure(BCRYPT_MIN_ROUNDS)
+    extra = int(math.log2(BCRYPT_TARGET_MS / base_ms)) if base_ms < BCRYPT_TARGET_MS else 0
+    rounds = min(max(BCRYPT_MIN_ROUNDS + extra, BCRYPT_MIN_ROUNDS), BCRYPT_MAX_ROUNDS)
+
+    measured = await measure(rounds) if rounds != BCRYPT_MIN_ROUNDS else base_ms
+    while measured > BCRYPT_TARGET_MS and rounds > BCRYPT_MIN_ROUNDS:
+        rounds -= 1
+        measured = await measure(rounds)
+
+    _bcrypt_rounds = rounds
+    _calibrated_hash_ms = measured
+    print(f"bcrypt cost calibrated to {rounds} ({measured:.1f} ms per hash, target {BCRYPT_TARGET_MS} ms)")
+
+
+async def rehash_password(username: str, password: str, old_hash: str):
+    """
+    Background task run after a successful login whose stored hash uses a
+    different cost. The UPDATE only applies if the hash did not change in
+    the meantime (e.g. a password change).
+    """
+    global _rehashed
+    try:
+        new_hash = await get_password_hash_async(password)
+    except HTTPException:
+        return  # pool is saturated; we'll try again on the next login
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(User)
+            .where(User.username == username, User.password_hash == old_hash)
+            .values(password_hash=new_hash)
+        )
+        await db.commit()
+    if result.rowcount:
+        _rehashed += 1
@@ -1,9 +1,15 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import text
+from security import get_current_admin_user
 from routes import router as users_router
 from models import Base
-from db import engine
+from db import async_engine, check_database
+from hashing import start_hash_pool, shutdown_hash_pool, get_hash_metrics, calibrate_bcrypt_rounds
+from user_cache import user_cache
+from throttle import login_throttle
+from common.health import start_health_probes, stop_health_probes, get_health_status
+from common.http_client import start_http_client, close_http_client
 
 from dotenv import load_dotenv
 load_dotenv() # Αυτό διαβάζει το .env και φορτώνει τις μεταβλητές
@@ -17,14 +23,49 @@ app.add_middleware(
 )
 
 @app.on_event("startup")
-def on_startup():
-    Base.metadata.create_all(bind=engine)
+async def on_startup():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    start_hash_pool()
+    await calibrate_bcrypt_rounds()
+    start_http_client()
+    start_health_probes(check_database, {"team_service": "http://team_service:8002/health/live"})
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_health_probes()
+    await close_http_client()
+    shutdown_hash_pool()
+    await async_engine.dispose()
 
 app.include_router(users_router)
 
+@app.get("/health/live")
+async def liveness():
+    # the process is up and serving requests; no dependencies are checked
+    return {"status": "alive"}
+
+@app.get("/health/ready")
 @app.get("/health")
-def health():
-    # light DB ping; if MySQL is down this will raise
-    with engine.connect() as conn:
-        conn.execute(text("SELECT 1"))
-    return {"status": "ok"}
+async def readiness():
+    # cached result of the background probe loop (see common/health.py), never hits MySQL
+    health_status = get_health_status()
+    return JSONResponse(health_status, status_code=200 if health_status["ready"] else 503)
+
+
+@app.get("/metrics/hashing", dependencies=[Depends(get_current_admin_user)])
+def hashing_metrics():
+    # bcrypt cost, calibrated hash time, per-hash latency and queue depth
+    return get_hash_metrics()
+
+
+@app.get("/metrics/user-cache", dependencies=[Depends(get_current_admin_user)])
+def user_cache_metrics():
+    # hit/miss counters of the verified-user cache used by get_current_user
+    return user_cache.stats()
+
+
+@app.get("/metrics/login-throttle", dependencies=[Depends(get_current_admin_user)])
+def login_throttle_metrics():
+    # allowed/rejected login attempts of the /users/token limiter
+    return login_throttle.stats()
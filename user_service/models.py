@@ -1,5 +1,6 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Boolean, Enum as SAEnum
+from sqlalchemy import String, Boolean, DateTime, ForeignKey, Index, Integer, Enum as SAEnum
+from datetime import datetime
 from enum import StrEnum  # Python 3.11+
 
 class Base(DeclarativeBase):
@@ -20,3 +21,28 @@ class User(Base):
     last_name:     Mapped[str] = mapped_column(String(64))
     role:    Mapped[Role] = mapped_column(SAEnum(Role, name="role_enum"), default=Role.MEMBER, nullable=False)
     active:  Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+
+
+class RefreshToken(Base):
+    """
+    Opaque refresh tokens. Only a SHA-256 of the token is stored, so a leaked
+    table cannot be replayed. Each token is single-use (rotated on refresh).
+    """
+    __tablename__ = "refresh_tokens"
+
+    token_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    username:   Mapped[str] = mapped_column(String(64), ForeignKey("users.username", ondelete="CASCADE"), index=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)  # naive UTC
+
+
+class LoginAttempt(Base):
+    """
+    Only used when LOGIN_THROTTLE_BACKEND=db, so that all workers of the
+    service share the same login-attempt windows.
+    """
+    __tablename__ = "login_attempts"
+    __table_args__ = (Index("ix_login_attempts_key_time", "key", "attempted_at"),)
+
+    id:           Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    key:          Mapped[str] = mapped_column(String(128))  # "user:<name>" or "ip:<addr>"
+    attempted_at: Mapped[datetime] = mapped_column(DateTime)  # naive UTC
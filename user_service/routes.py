@@ -1,22 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm 
-from sqlalchemy.orm import Session
-from schemas import UserCreate, UserOut, Token, UserRoleUpdate # <-- Πρόσθεσε το UserRoleUpdate
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from schemas import (
+    UserCreate, UserOut, UserListItem, UserPage, Token, UserRoleUpdate,
+    UserBatchRequest, UserBatchItem, UserBatchOut, RefreshRequest,
+    RoleSyncRequest, RoleSyncResult, RoleSyncOut,
+)
 import httpx
+import os
 
 # ΑΛΛΑΓΗ: Πρόσθεσε τα get_current_user & get_current_admin_user
 from security import (
-    verify_password, 
     create_access_token, 
-    get_password_hash,
     get_current_user,
-    get_current_admin_user
+    get_current_admin_user,
+    issue_refresh_token,
+    consume_refresh_token,
+    revoke_refresh_tokens,
+    purge_expired_refresh_tokens,
+    get_service_caller,
+    get_current_user_or_service,
 )
+from hashing import verify_password_async, get_password_hash_async, needs_rehash, rehash_password
 from models import User, Role
-from db import get_db
+from db import get_async_db
+from user_cache import CachedUser, user_cache
+from bulk_import import stream_user_import
+from throttle import login_throttle
+from common.http_client import get_http_client
+from team_claims import fetch_team_claims
 
 router = APIRouter(prefix="/users") # Αφαίρεσε το tags=["users"]
 
+# Upper bound for the number of usernames in one POST /users/batch call
+USER_BATCH_MAX = int(os.getenv("USER_BATCH_MAX", "500"))
+
 # ------------- AUTH ENDPOINT --------------
 
 # we send username and passwd to endpoint POST users/token.
@@ -25,12 +45,20 @@ router = APIRouter(prefix="/users") # Αφαίρεσε το tags=["users"]
 # create_access_token() returns the token, and server gives it back to us.
 # we now hold the token, and it's our responsibility as clients to show the token where we have to for authorization.
 @router.post("/token", response_model=Token, tags=["auth"])
-def login_for_access_token(
+async def login_for_access_token(
+    request: Request,
+    background_tasks: BackgroundTasks,
     form_data: OAuth2PasswordRequestForm = Depends(), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    # Admission control first: rejected attempts never reach the DB or bcrypt.
+    client_ip = request.client.host if request.client else None
+    await login_throttle.check(form_data.username, client_ip)
+
+    # The bcrypt check runs in the hashing process pool so it never blocks other requests.
+    user = await db.scalar(select(User).where(User.username == form_data.username))
+    if not user or not await verify_password_async(form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -41,24 +69,70 @@ def login_for_access_token(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Inactive user. Please contact administrator for activation."
         )
+    await login_throttle.login_succeeded(user.username)
+
+    # The stored hash uses an old bcrypt cost: upgrade it after the response is sent
+    if needs_rehash(user.password_hash):
+        background_tasks.add_task(rehash_password, user.username, form_data.password, user.password_hash)
+
+    token_data = {"sub": user.username, "role": user.role.value}
+    # Admins pass every team check anyway, they get no team claims
+    if user.role != Role.ADMIN:
+        token_data.update(await fetch_team_claims(http_client, user.username))
+    access_token = create_access_token(data=token_data)
+
+    await purge_expired_refresh_tokens(db, user.username)
+    refresh_token = await issue_refresh_token(db, user.username)
+    await db.commit()
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+# Exchanges a refresh token for a new access token (and a new refresh token).
+# No password and no bcrypt involved: one indexed lookup, one delete, one insert.
+@router.post("/token/refresh", response_model=Token, tags=["auth"])
+async def refresh_access_token(
+    payload: RefreshRequest,
+    db: AsyncSession = Depends(get_async_db),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
+):
+    username = await consume_refresh_token(db, payload.refresh_token)
+
+    # Re-read role/active so a role change is picked up on the next refresh
+    user = (await db.execute(
+        select(User.username, User.role, User.active).where(User.username == username)
+    )).first()
+    if user is None or not user.active:
+        await revoke_refresh_tokens(db, username)
+        await db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh token is no longer valid. Please log in again.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    # Team claims are re-read too, so they are at most one refresh old
     token_data = {"sub": user.username, "role": user.role.value}
+    if user.role != Role.ADMIN:
+        token_data.update(await fetch_team_claims(http_client, user.username))
     access_token = create_access_token(data=token_data)
-    return {"access_token": access_token, "token_type": "bearer"}
+    refresh_token = await issue_refresh_token(db, user.username)
+    await db.commit()
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
 
 
 # --- ADMIN ENDPOINTS (ΝΕΟ!) ---
 
 @router.patch("/{username}/activate", response_model=UserOut, tags=["admin"])
-def activate_user(
+async def activate_user(
     username: str,
-    db: Session = Depends(get_db),
-    admin_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    admin_user: CachedUser = Depends(get_current_admin_user)
 ):
     """
     (Admin Only) Ενεργοποιεί έναν χρήστη.
     """
     print(f"Admin user '{admin_user.username}' is activating '{username}'")
-    user_to_activate = db.query(User).filter(User.username == username).first()
+    user_to_activate = await db.scalar(select(User).where(User.username == username))
     
     if not user_to_activate:
         raise HTTPException(status_code=404, detail="User not found")
@@ -67,16 +141,17 @@ def activate_user(
         raise HTTPException(status_code=400, detail="User is already active")
         
     user_to_activate.active = True
-    db.commit()
-    db.refresh(user_to_activate)
+    await db.commit()
+    user_cache.invalidate(username)
+    await db.refresh(user_to_activate)
     return user_to_activate
 
 @router.patch("/{username}/role", response_model=UserOut, tags=["admin"])
-def update_user_role(
+async def update_user_role(
     username: str,
     payload: UserRoleUpdate,
-    db: Session = Depends(get_db),
-    admin_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    admin_user: CachedUser = Depends(get_current_admin_user)
 ):
     """
     (Admin Only) Changes a user's role.
@@ -84,7 +159,7 @@ def update_user_role(
     and manual promotion to Admin.
     """
     
-    user_to_update = db.query(User).filter(User.username == username).first()
+    user_to_update = await db.scalar(select(User).where(User.username == username))
     
     if not user_to_update:
         raise HTTPException(status_code=404, detail="User not found")
@@ -100,21 +175,22 @@ def update_user_role(
     # --- END OF CORRECTED CHECK ---
         
     user_to_update.role = payload.role
-    db.commit()
-    db.refresh(user_to_update)
+    await db.commit()
+    user_cache.invalidate(username)
+    await db.refresh(user_to_update)
     return user_to_update
 
 @router.patch("/{username}/deactivate", response_model=UserOut, tags=["admin"])
-def deactivate_user(
+async def deactivate_user(
     username: str,
-    db: Session = Depends(get_db),
-    admin_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    admin_user: CachedUser = Depends(get_current_admin_user)
 ):
     """
     (Admin Only) Απενεργοποιεί έναν χρήστη.
     """
     print(f"Admin user '{admin_user.username}' is deactivating '{username}'")
-    user_to_deactivate = db.query(User).filter(User.username == username).first()
+    user_to_deactivate = await db.scalar(select(User).where(User.username == username))
     
     if not user_to_deactivate:
         raise HTTPException(status_code=404, detail="User not found")
@@ -123,15 +199,18 @@ def deactivate_user(
         raise HTTPException(status_code=403, detail="Cannot deactivate an admin account")
         
     user_to_deactivate.active = False
-    db.commit()
-    db.refresh(user_to_deactivate)
+    await revoke_refresh_tokens(db, username)
+    await db.commit()
+    user_cache.invalidate(username)
+    await db.refresh(user_to_deactivate)
     return user_to_deactivate
 
 @router.delete("/{username}", status_code=status.HTTP_204_NO_CONTENT, tags=["admin"])
-def delete_user(
+async def delete_user(
     username: str,
-    db: Session = Depends(get_db),
-    admin_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_db),
+    admin_user: CachedUser = Depends(get_current_admin_user),
+    http_client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
     (Admin Only) Deletes a user, *after* checking they are not a leader.
@@ -143,8 +222,7 @@ def delete_user(
     # --- 1. SAFETY CHECK (Try block is ONLY for the network call) ---
     try:
         url = f"http://team_service:8002/teams/internal/is-leader/{username}"
-        with httpx.Client() as client:
-            response = client.get(url)
+        response = await http_client.get(url)
         
         response.raise_for_status() 
         data = response.json()
@@ -170,7 +248,7 @@ def delete_user(
         )
     
     # --- 3. DELETE LOGIC (Now safe to run) ---
-    user_to_delete = db.query(User).filter(User.username == username).first()
+    user_to_delete = await db.scalar(select(User).where(User.username == username))
     
     if not user_to_delete:
         raise HTTPException(status_code=404, detail="User not found")
@@ -178,19 +256,41 @@ def delete_user(
     if user_to_delete.role == Role.ADMIN:
         raise HTTPException(status_code=403, detail="Cannot delete an admin account")
         
-    db.delete(user_to_delete)
-    db.commit()
+    await revoke_refresh_tokens(db, username)
+    await db.delete(user_to_delete)
+    await db.commit()
+    user_cache.invalidate(username)
     
     return None
 
+@router.post("/import", tags=["admin"])
+async def import_users(
+    request: Request,
+    activate: bool = Query(False, description="Create the imported users as already active"),
+    admin_user: CachedUser = Depends(get_current_admin_user)
+):
+    """
+    (Admin Only) Bulk-creates users from an NDJSON or CSV request body.
+    Send `Content-Type: text/csv` for CSV (with a header row:
+    username,email,password,first_name,last_name), anything else is read as NDJSON.
+    Rows are processed in batches while the body is still uploading, and a
+    result line per row is streamed back as NDJSON.
+    """
+    print(f"Admin user '{admin_user.username}' is importing users (activate={activate})")
+    fmt = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    return StreamingResponse(
+        stream_user_import(request.stream(), fmt, activate),
+        media_type="application/x-ndjson",
+    )
+
 # --- USER ENDPOINTS (Ενημερωμένα/Κλειδωμένα) ---
 
 @router.post("", response_model=UserOut, status_code=status.HTTP_201_CREATED, tags=["users"])
-def create_user(payload: UserCreate, db: Session = Depends(get_db)):
+async def create_user(payload: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # (Αυτό μένει ίδιο - η δημιουργία χρήστη είναι ανοιχτή)
-    if db.query(User).filter(User.username == payload.username).first():
+    if await db.scalar(select(User.username).where(User.username == payload.username)):
         raise HTTPException(status_code=400, detail="Username already exists. Please log in.")
-    if db.query(User).filter(User.email == payload.email).first():
+    if await db.scalar(select(User.username).where(User.email == payload.email)):
         raise HTTPException(status_code=400, detail="Email already exists. Please log in.")
 
     user = User(
@@ -198,51 +298,182 @@ def create_user(payload: UserCreate, db: Session = Depends(get_db)):
         email=payload.email,
         first_name=payload.first_name,
         last_name=payload.last_name,
-        password_hash=get_password_hash(payload.password),
+        password_hash=await get_password_hash_async(payload.password),
         role=Role.MEMBER,
         active=False,
     )
-    db.add(user); db.commit(); db.refresh(user)
+    db.add(user); await db.commit(); await db.refresh(user)
     return user
 
 
-@router.get("", response_model=list[UserOut], tags=["users"])
-def list_users(
-    db: Session = Depends(get_db),
+# Columns that can be requested with GET /users?fields=...
+USER_LIST_FIELDS = tuple(UserListItem.model_fields)
+
+@router.get("", response_model=UserPage, response_model_exclude_unset=True, tags=["users"])
+async def list_users(
+    db: AsyncSession = Depends(get_async_db),
     # ΑΛΛΑΓΗ: Πρόσθεσε αυτή τη "κλειδαριά".
     # Αν το token λείπει ή είναι άκυρο, το request σταματάει εδώ.
-    current_user: User = Depends(get_current_user)
+    # Service tokens are accepted too (team_service's role reconciler).
+    current_user: CachedUser | str = Depends(get_current_user_or_service),
+    limit: int = Query(50, ge=1, le=500),
+    after: str | None = Query(None, description="Return users whose username sorts after this one"),
+    role: Role | None = None,
+    active: bool | None = None,
+    fields: str | None = Query(None, description=f"Comma separated subset of: {', '.join(USER_LIST_FIELDS)}"),
 ):
     """
-    (Logged-in Users Only) Επιστρέφει μια λίστα όλων των χρηστών.
+    (Logged-in Users Only) Επιστρέφει μια σελίδα χρηστών.
+    Keyset pagination on username: pass the returned `next_after` as `after`
+    to get the next page. Only the requested columns are selected.
     """
-    print(f"User '{current_user.username}' is requesting user list.")
-    return db.query(User).all()
+    caller = current_user if isinstance(current_user, str) else current_user.username
+    print(f"User '{caller}' is requesting user list.")
+
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in USER_LIST_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        # username is always returned, it is the pagination key
+        columns = ["username"] + [f for f in requested if f != "username"]
+    else:
+        columns = list(USER_LIST_FIELDS)
+
+    query = select(*[getattr(User, c) for c in columns]).order_by(User.username)
+    if after is not None:
+        query = query.where(User.username > after)
+    if role is not None:
+        query = query.where(User.role == role)
+    if active is not None:
+        query = query.where(User.active == active)
+
+    # Fetch one extra row to know whether there is a next page
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = [UserListItem(**row._asdict()) for row in rows]
+    next_after = rows[-1].username if has_more else None
+    return UserPage(items=items, next_after=next_after)
+
+
+@router.post("/batch", response_model=UserBatchOut, tags=["users"])
+async def batch_lookup_users(
+    payload: UserBatchRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser | str = Depends(get_current_user_or_service)
+):
+    """
+    (Logged-in Users or Services) Resolves many usernames at once.
+    Used by the team and task services to validate several users with
+    one HTTP call and one `IN (...)` query instead of one call per user.
+    """
+    # Keep the caller's order, drop duplicates
+    usernames = list(dict.fromkeys(payload.usernames))
+    if len(usernames) > USER_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many usernames; at most {USER_BATCH_MAX} per request."
+        )
+
+    rows = (await db.execute(
+        select(User.username, User.active, User.role).where(User.username.in_(usernames))
+    )).all()
+    found = {row.username: row for row in rows}
+
+    return UserBatchOut(users=[
+        UserBatchItem(username=name, exists=True, active=found[name].active, role=found[name].role)
+        if name in found else UserBatchItem(username=name, exists=False)
+        for name in usernames
+    ])
+
+
+@router.post("/internal/roles", response_model=RoleSyncOut, include_in_schema=False)
+async def sync_user_roles(
+    payload: RoleSyncRequest,
+    db: AsyncSession = Depends(get_async_db),
+    service: str = Depends(get_service_caller)
+):
+    """
+    (Internal Service-Only)
+    Sets the team_leader/member role of many users at once. Called by the
+    team_service role-sync worker with the role each user *should* have, so
+    calling it twice with the same payload changes nothing the second time.
+    Admins are never touched.
+    """
+    # The last entry wins if a username is repeated
+    wanted = {item.username: item.role for item in payload.roles}
+    if len(wanted) > USER_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many users; at most {USER_BATCH_MAX} per request."
+        )
+
+    rows = (await db.execute(
+        select(User.username, User.role).where(User.username.in_(list(wanted)))
+    )).all()
+    current = {row.username: row.role for row in rows}
+
+    results = []
+    changes = {Role.TEAM_LEADER: [], Role.MEMBER: []}
+    for username, role in wanted.items():
+        if username not in current:
+            results.append(RoleSyncResult(username=username, status="not_found"))
+        elif current[username] == Role.ADMIN:
+            results.append(RoleSyncResult(username=username, status="skipped_admin"))
+        elif current[username] == role:
+            results.append(RoleSyncResult(username=username, status="unchanged"))
+        else:
+            changes[role].append(username)
+            results.append(RoleSyncResult(username=username, status="updated"))
+
+    # One UPDATE per target role; the role != admin guard covers a promotion
+    # to admin that happened since the SELECT above.
+    for role, usernames in changes.items():
+        if usernames:
+            await db.execute(
+                update(User)
+                .where(User.username.in_(usernames), User.role != Role.ADMIN)
+                .values(role=role)
+            )
+    await db.commit()
+
+    for usernames in changes.values():
+        for username in usernames:
+            user_cache.invalidate(username)
+
+    return RoleSyncOut(results=results)
 
 
 @router.get("/me", response_model=UserOut, tags=["users"])
-def get_current_user_me(
+async def get_current_user_me(
     # ΑΛΛΑΓΗ: Ένα νέο, βολικό endpoint
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CachedUser = Depends(get_current_user)
 ):
     """
     (Logged-in Users Only) Επιστρέφει τα στοιχεία του 
     χρήστη που είναι συνδεδεμένος.
     """
-    return current_user
+    # The dependency only carries role/active, so load the full profile here.
+    user = await db.scalar(select(User).where(User.username == current_user.username))
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 
 @router.get("/{username}", response_model=UserOut, tags=["users"])
-def get_user(
+async def get_user(
     username: str, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     # ΑΛΛΑΓΗ: Πρόσθεσε την ίδια "κλειδαριά"
-    current_user: User = Depends(get_current_user)
+    current_user: CachedUser = Depends(get_current_user)
 ):
     """
     (Logged-in Users Only) Επιστρέφει τα στοιχεία ενός χρήστη.
     """
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
\ No newline at end of file
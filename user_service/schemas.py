@@ -1,5 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field
 from pydantic import ConfigDict
+from typing import Literal
 from models import Role
 
 # these are provided when we create a user
@@ -20,10 +21,58 @@ class UserOut(BaseModel):
     role:       Role
     active:     bool
 
+# one row of GET /users; only the fields asked for with ?fields= are filled in
+class UserListItem(BaseModel):
+    username:   str
+    email:      EmailStr | None = None
+    first_name: str | None = None
+    last_name:  str | None = None
+    role:       Role | None = None
+    active:     bool | None = None
+
+class UserPage(BaseModel):
+    items: list[UserListItem]
+    # pass this back as ?after= to get the next page (None on the last page)
+    next_after: str | None = None
+
+# POST /users/batch: resolve many usernames with a single query
+class UserBatchRequest(BaseModel):
+    usernames: list[str] = Field(min_length=1)
+
+class UserBatchItem(BaseModel):
+    username: str
+    exists:   bool
+    active:   bool | None = None
+    role:     Role | None = None
+
+class UserBatchOut(BaseModel):
+    users: list[UserBatchItem]
+
+# POST /users/internal/roles: bulk role sync, called by team_service only.
+# Only team_leader/member can be set this way, never admin.
+class RoleSyncItem(BaseModel):
+    username: str
+    role:     Literal["team_leader", "member"]
+
+class RoleSyncRequest(BaseModel):
+    roles: list[RoleSyncItem] = Field(min_length=1)
+
+class RoleSyncResult(BaseModel):
+    username: str
+    status:   Literal["updated", "unchanged", "skipped_admin", "not_found"]
+
+class RoleSyncOut(BaseModel):
+    results: list[RoleSyncResult]
+
 class Token(BaseModel):
     # schema for what we return to user after login
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+class RefreshRequest(BaseModel):
+    # schema for POST /users/token/refresh
+    refresh_token: str
 
 class TokenData(BaseModel):
     #schema for the data contained INSIDE the JWT
@@ -1,28 +1,25 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from passlib.hash import bcrypt
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from pydantic import ValidationError # Νέο Import
-from sqlalchemy.orm import Session # Νέο Import
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from models import Role, User # Νέο Import
+from models import Role, User, RefreshToken # Νέο Import
 from schemas import TokenData # Νέο Import
-from db import get_db # Νέο Import
+from db import get_async_db
+from user_cache import CachedUser, user_cache
 import os # <-- ΠΡΟΣΘΕΣΕ ΑΥΤΟ
+import hashlib
+import secrets
+import time
 
 # --- Ρυθμίσεις Ασφαλείας ---
 SECRET_KEY = os.getenv("SECRET_KEY", "default_secret_please_change")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
-
-# -------------- Password Hashing -----------------
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.verify(plain_password, hashed_password) #checks if the passwd provided in sign in matches the one in the DB
-
-def get_password_hash(password: str) -> str:
-    return bcrypt.hash(password) #hash passwd provided by user, used in routes.py when user registers
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
 
 # ----------------- JWT Token Creation ------------------
 
@@ -36,10 +33,80 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    # `iat` lets the other services tell how old the token's team claims are
+    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc)})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Short-lived JWTs this service signs for its own calls to internal
+# endpoints of the other services (they check the `svc` claim).
+SERVICE_NAME = "user_service"
+SERVICE_TOKEN_EXPIRE_MINUTES = 5
+
+def create_service_token() -> str:
+    expire = datetime.now(timezone.utc) + timedelta(minutes=SERVICE_TOKEN_EXPIRE_MINUTES)
+    return jwt.encode({"sub": SERVICE_NAME, "svc": SERVICE_NAME, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
+# ----------------- Refresh Tokens ------------------
+
+# Refresh tokens are random strings, not JWTs. We only keep their SHA-256 in
+# the refresh_tokens table. Every refresh deletes the old token and hands out
+# a new one (rotation), so a token can be used at most once.
+# None of this touches bcrypt, which is the whole point: clients stay logged
+# in without paying for a password check every hour.
+
+def _hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _utcnow() -> datetime:
+    # MySQL DATETIME has no timezone, so we store naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+async def issue_refresh_token(db: AsyncSession, username: str) -> str:
+    """
+    Creates a new refresh token for `username`. The caller commits.
+    """
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        token_hash=_hash_refresh_token(token),
+        username=username,
+        expires_at=_utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return token
+
+async def consume_refresh_token(db: AsyncSession, token: str) -> str:
+    """
+    Validates and deletes a refresh token, returning its username.
+    The DELETE doubles as a lock: if two requests race with the same token,
+    only one of them deletes the row and the other gets a 401.
+    """
+    token_hash = _hash_refresh_token(token)
+    username = await db.scalar(
+        select(RefreshToken.username).where(
+            RefreshToken.token_hash == token_hash,
+            RefreshToken.expires_at > _utcnow(),
+        )
+    )
+    if username is None:
+        raise credentials_exception
+
+    result = await db.execute(delete(RefreshToken).where(RefreshToken.token_hash == token_hash))
+    if result.rowcount != 1:
+        raise credentials_exception
+    return username
+
+async def revoke_refresh_tokens(db: AsyncSession, username: str):
+    """
+    Drops every refresh token of a user (deactivation / deletion). The caller commits.
+    """
+    await db.execute(delete(RefreshToken).where(RefreshToken.username == username))
+
+async def purge_expired_refresh_tokens(db: AsyncSession, username: str):
+    # Cheap housekeeping on login, uses the (username) and (expires_at) indexes
+    await db.execute(
+        delete(RefreshToken).where(RefreshToken.username == username, RefreshToken.expires_at <= _utcnow())
+    )
+
 # --------------------------------------------------------------------
 # --- ΝΕΟΣ ΚΩΔΙΚΑΣ: Token Validation & Dependencies ---
 # --------------------------------------------------------------------
@@ -54,13 +121,15 @@ credentials_exception = HTTPException(
     headers={"WWW-Authenticate": "Bearer"},
 )
 
-def get_current_user(
+async def get_current_user(
     token: str = Depends(oauth2_scheme), 
-    db: Session = Depends(get_db)
-) -> User:
+    db: AsyncSession = Depends(get_async_db)
+) -> CachedUser:
     """
     Η βασική Dependency: Παίρνει το token, το σπάει, βρίσκει τον χρήστη.
     Αυτός είναι ο "Έλεγχος Κλειδιού".
+    Returns a CachedUser (username, role, active) served from the
+    verified-user cache when possible, so most requests skip MySQL here.
     """
     try:
         # 1. Αποκωδικοποίησε το token
@@ -74,17 +143,29 @@ def get_current_user(
         
         if token_data.username is None:
             raise credentials_exception
+
+        # Service tokens (see get_service_caller) don't stand for a user
+        if payload.get("svc") is not None:
+            raise credentials_exception
             
     except (JWTError, ValidationError):
         # Αν το token είναι άκυρο ή ληγμένο, πέτα σφάλμα
         raise credentials_exception
 
-    # 3. Βρες τον χρήστη στη βάση
-    user = db.query(User).filter(User.username == token_data.username).first()
-    
+    # 3. Βρες τον χρήστη (πρώτα στην cache, μετά στη βάση)
+    user = user_cache.get(token_data.username)
     if user is None:
-        # Αν ο χρήστης διαγράφηκε αφού πήρε το token
-        raise credentials_exception
+        read_started = time.monotonic()
+        row = (await db.execute(
+            select(User.username, User.role, User.active).where(User.username == token_data.username)
+        )).first()
+
+        if row is None:
+            # Αν ο χρήστης διαγράφηκε αφού πήρε το token
+            raise credentials_exception
+
+        user = CachedUser(username=row.username, role=row.role, active=row.active)
+        user_cache.put(user, read_started)
         
     # 4. Έλεγξε αν είναι active
     if not user.active:
@@ -94,9 +175,9 @@ def get_current_user(
     return user
 
 
-def get_current_admin_user(
-    current_user: User = Depends(get_current_user)
-) -> User:
+async def get_current_admin_user(
+    current_user: CachedUser = Depends(get_current_user)
+) -> CachedUser:
     """
     Η Dependency για Admins: Εξαρτάται από την προηγούμενη
     και απλά ελέγχει τον ρόλο.
@@ -107,4 +188,48 @@ def get_current_admin_user(
             status_code=status.HTTP_403_FORBIDDEN, 
             detail="The user does not have privileges to perform this action"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+# --------------------------------------------------------------------
+# --- Service-to-service authentication ---
+# --------------------------------------------------------------------
+
+# The other services sign short-lived JWTs with the same SECRET_KEY and an
+# `svc` claim naming themselves. Internal endpoints accept only those.
+SERVICE_NAMES = {"team_service", "task_service"}
+
+async def get_service_caller(token: str = Depends(oauth2_scheme)) -> str:
+    """
+    Dependency for internal endpoints: returns the calling service's name.
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+
+    service = payload.get("svc")
+    if service not in SERVICE_NAMES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="This endpoint is reserved for internal services"
+        )
+    return service
+
+async def get_current_user_or_service(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> CachedUser | str:
+    """
+    Like get_current_user, but also lets internal services through.
+    Returns the CachedUser, or the calling service's name for service tokens.
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+
+    service = payload.get("svc")
+    if service in SERVICE_NAMES:
+        return service
+    return await get_current_user(token, db)
@@ -0,0 +1,37 @@
+import os
+
+import httpx
+
+from security import create_service_token
+
+# --- Settings ---
+TEAM_CLAIMS_ENABLED = os.getenv("TEAM_CLAIMS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Login must not hang on team_service: past this we issue the token without claims
+TEAM_CLAIMS_TIMEOUT_SECONDS = float(os.getenv("TEAM_CLAIMS_TIMEOUT_SECONDS", "1"))
+
+TEAM_MEMBERSHIPS_URL = "http://team_service:8002/teams/internal/memberships/{username}"
+
+# Access tokens of non-admins carry the user's team memberships in a compact
+# `teams` claim: {"v": version, "l": [led team ids], "m": [other team ids]}.
+# team_service and task_service authorize from it while it is fresh and fall
+# back to their usual checks otherwise (see common/team_claims.py).
+
+
+async def fetch_team_claims(http_client: httpx.AsyncClient, username: str) -> dict:
+    """
+    Returns {"teams": ...} to merge into the token data, or {} when claims are
+    disabled or team_service could not answer in time.
+    """
+    if not TEAM_CLAIMS_ENABLED:
+        return {}
+    try:
+        response = await http_client.get(
+            TEAM_MEMBERSHIPS_URL.format(username=username),
+            headers={"Authorization": f"Bearer {create_service_token()}"},
+            timeout=TEAM_CLAIMS_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Warning: issuing a token without team claims for {username}: {e}")
+        return {}
+    return {"teams": response.json()}
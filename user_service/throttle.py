@@ -0,0 +1,150 @@
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, func, insert, select
+
+from db import AsyncSessionLocal
+from models import LoginAttempt
+
+# --- Settings ---
+# Sliding window limits for POST /users/token. They are checked before any
+# bcrypt work, so a credential-stuffing burst costs us a dict lookup per
+# attempt instead of a full password hash.
+LOGIN_THROTTLE_WINDOW_SECONDS = float(os.getenv("LOGIN_THROTTLE_WINDOW_SECONDS", "60"))
+LOGIN_MAX_ATTEMPTS_PER_USER = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_USER", "10"))
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_IP", "50"))
+# "memory" (per process) or "db" (shared by all workers through MySQL)
+LOGIN_THROTTLE_BACKEND = os.getenv("LOGIN_THROTTLE_BACKEND", "memory")
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+
+
+class InMemoryBackend:
+    """
+    key -> deque of attempt timestamps, for this process only.
+    The number of tracked keys is bounded; the least recently used go first.
+    """
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._attempts: OrderedDict[str, deque] = OrderedDict()
+
+    async def retry_after(self, key: str, limit: int, window: float) -> float | None:
+        attempts = self._attempts.get(key)
+        if not attempts:
+            return None
+        now = time.monotonic()
+        while attempts and now - attempts[0] >= window:
+            attempts.popleft()
+        if len(attempts) < limit:
+            return None
+        return window - (now - attempts[0])
+
+    async def record(self, key: str):
+        attempts = self._attempts.setdefault(key, deque())
+        attempts.append(time.monotonic())
+        self._attempts.move_to_end(key)
+        while len(self._attempts) > self.max_keys:
+            self._attempts.popitem(last=False)
+
+    async def reset(self, key: str):
+        self._attempts.pop(key, None)
+
+
+class DatabaseBackend:
+    """
+    Same windows, stored in the login_attempts table so several workers
+    (or replicas) see each other's attempts. Costs a couple of indexed
+    queries per login; use it when you run more than one process.
+    """
+    @staticmethod
+    def _now() -> datetime:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+    async def retry_after(self, key: str, limit: int, window: float) -> float | None:
+        since = self._now() - timedelta(seconds=window)
+        async with AsyncSessionLocal() as db:
+            count, oldest = (await db.execute(
+                select(func.count(), func.min(LoginAttempt.attempted_at))
+                .where(LoginAttempt.key == key, LoginAttempt.attempted_at > since)
+            )).one()
+        if count < limit:
+            return None
+        return window - (self._now() - oldest).total_seconds()
+
+    async def record(self, key: str):
+        now = self._now()
+        async with AsyncSessionLocal() as db:
+            # drop this key's rows that fell out of the window, then add the new one
+            await db.execute(delete(LoginAttempt).where(
+                LoginAttempt.key == key,
+                LoginAttempt.attempted_at <= now - timedelta(seconds=LOGIN_THROTTLE_WINDOW_SECONDS),
+            ))
+            await db.execute(insert(LoginAttempt).values(key=key, attempted_at=now))
+            await db.commit()
+
+    async def reset(self, key: str):
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(LoginAttempt).where(LoginAttempt.key == key))
+            await db.commit()
+
+
+class LoginThrottle:
+    def __init__(self, backend):
+        self.backend = backend
+        self.allowed = 0
+        self.rejected_by_user = 0
+        self.rejected_by_ip = 0
+
+    def _reject(self, retry_after: float):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts. Please try again later.",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    async def check(self, username: str, client_ip: str | None):
+        """
+        Raises 429 if either the username or the client IP is over its
+        limit, otherwise counts this attempt against both.
+        """
+        user_key = f"user:{username}"
+        ip_key = f"ip:{client_ip}" if client_ip else None
+
+        wait = await self.backend.retry_after(user_key, LOGIN_MAX_ATTEMPTS_PER_USER, LOGIN_THROTTLE_WINDOW_SECONDS)
+        if wait is not None:
+            self.rejected_by_user += 1
+            self._reject(wait)
+
+        if ip_key:
+            wait = await self.backend.retry_after(ip_key, LOGIN_MAX_ATTEMPTS_PER_IP, LOGIN_THROTTLE_WINDOW_SECONDS)
+            if wait is not None:
+                self.rejected_by_ip += 1
+                self._reject(wait)
+
+        self.allowed += 1
+        await self.backend.record(user_key)
+        if ip_key:
+            await self.backend.record(ip_key)
+
+    async def login_succeeded(self, username: str):
+        # A good password clears the per-user window (not the per-IP one)
+        await self.backend.reset(f"user:{username}")
+
+    def stats(self) -> dict:
+        return {
+            "backend": LOGIN_THROTTLE_BACKEND,
+            "window_seconds": LOGIN_THROTTLE_WINDOW_SECONDS,
+            "max_attempts_per_user": LOGIN_MAX_ATTEMPTS_PER_USER,
+            "max_attempts_per_ip": LOGIN_MAX_ATTEMPTS_PER_IP,
+            "allowed": self.allowed,
+            "rejected_by_user": self.rejected_by_user,
+            "rejected_by_ip": self.rejected_by_ip,
+        }
+
+
+login_throttle = LoginThrottle(
+    DatabaseBackend() if LOGIN_THROTTLE_BACKEND == "db" else InMemoryBackend(LOGIN_THROTTLE_MAX_KEYS)
+)
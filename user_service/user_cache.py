@@ -0,0 +1,37 @@
+import os
+from dataclasses import dataclass
+
+from models import Role
+from common.ttl_cache import TTLCache
+
+# --- Settings ---
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+# Maximum staleness: an entry older than this is treated as a miss.
+# Writes in *this* process invalidate immediately; the TTL bounds how long
+# another worker process may keep serving an old role/active flag.
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """
+    The small part of a User that authorization needs.
+    This is what get_current_user returns.
+    """
+    username: str
+    role: Role
+    active: bool
+
+
+class VerifiedUserCache(TTLCache[str, CachedUser]):
+    """
+    username -> CachedUser. Invalidations leave tombstones (see
+    common/ttl_cache.py), so a read that started before a write commits
+    cannot put the old row back afterwards.
+    """
+    def put(self, user: CachedUser, read_started: float):
+        super().put(user.username, user, read_started)
+
+
+# The single cache instance for this process
+user_cache = VerifiedUserCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)